@@ -0,0 +1,60 @@
+import asyncio
+from typing import Any, Dict
+
+
+class AdmissionController:
+    # Caps the number of requests in flight. A request that cannot get a slot
+    # within wait_sec is rejected (the caller answers 429), so a burst queues
+    # for a bounded time instead of piling up behind the models.
+
+    def __init__(self, max_in_flight: int = 16, wait_sec: float = 2.0):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.wait_sec = max(0.0, float(wait_sec))
+        self.sem = None
+        self.in_flight = 0
+        self.waiting = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the server's running event loop.
+        if self.sem is None:
+            self.sem = asyncio.Semaphore(self.max_in_flight)
+        return self.sem
+
+    async def acquire(self) -> bool:
+        sem = self._semaphore()
+        self.waiting += 1
+        try:
+            if self.wait_sec <= 0:
+                if sem.locked():
+                    self.rejected += 1
+                    return False
+                await sem.acquire()
+            else:
+                await asyncio.wait_for(sem.acquire(), timeout=self.wait_sec)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore().release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "wait_sec": self.wait_sec,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+
+class MicroBatcher:
+    # Collects items submitted from concurrent request threads and runs them
+    # through batch_fn together. The worker waits for the first item, then up
+    # to max_wait_ms for more (at most max_batch_size), and resolves each
+    # caller's Future with its own result. With workers > 1, one batch can be
+    # collected while another is still running.
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 8, max_wait_ms: float = 10.0, workers: int = 1):
+        self.batch_fn = batch_fn
+        self.workers = max(1, int(workers))
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.q: "queue.Queue" = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+        self.stopped = False
+
+        self.submitted = 0
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+        self.max_depth_seen = 0
+        self.errors = 0
+
+    def start(self):
+        with self.lock:
+            if len(self.threads) > 0:
+                return
+            self.stopped = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"micro-batcher-{i}", daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def stop(self):
+        with self.lock:
+            if len(self.threads) == 0:
+                return
+            self.stopped = True
+            threads = self.threads
+            self.threads = []
+            for _ in threads:
+                self.q.put(None)
+        for t in threads:
+            t.join(timeout=5)
+
+    def submit(self, item: Any) -> Future:
+        fut: Future = Future()
+        self.q.put((item, fut))
+        with self.lock:
+            self.submitted += 1
+            depth = self.q.qsize()
+            if depth > self.max_depth_seen:
+                self.max_depth_seen = depth
+        return fut
+
+    def _collect(self, first) -> List:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    nxt = self.q.get_nowait()
+                else:
+                    nxt = self.q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if nxt is None:
+                self.q.put(None)
+                break
+            batch.append(nxt)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self.q.get()
+            if first is None:
+                if self.stopped:
+                    return
+                continue
+
+            batch = self._collect(first)
+            live = [(item, fut) for item, fut in batch if fut.set_running_or_notify_cancel()]
+            if len(live) == 0:
+                continue
+
+            with self.lock:
+                self.batches += 1
+                self.items += len(live)
+                if len(live) > self.max_batch_seen:
+                    self.max_batch_seen = len(live)
+
+            try:
+                results = self.batch_fn([item for item, _ in live])
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                for _, fut in live:
+                    fut.set_exception(e)
+                continue
+
+            for (_, fut), res in zip(live, results):
+                fut.set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            avg = self.items / self.batches if self.batches > 0 else 0.0
+            return {
+                "queue_depth": self.q.qsize(),
+                "max_queue_depth": self.max_depth_seen,
+                "submitted": self.submitted,
+                "batches": self.batches,
+                "avg_batch_size": round(avg, 3),
+                "max_batch_size_seen": self.max_batch_seen,
+                "errors": self.errors,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "workers": self.workers,
+            }
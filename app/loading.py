@@ -0,0 +1,64 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ComponentUnavailable(RuntimeError):
+    pass
+
+
+class LazyComponent:
+    # A model or index that is loaded once, on first use or by a background
+    # thread. Callers of get() wait for an in-progress load; a failed load is
+    # retried by the next caller.
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.state = "not_loaded"
+        self.value = None
+        self.error: Optional[str] = None
+        self.load_sec: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def load(self):
+        if self.ready:
+            return
+        with self.lock:
+            if self.ready:
+                return
+            self.state = "loading"
+            t0 = time.monotonic()
+            try:
+                self.value = self.loader()
+                self.error = None
+                self.state = "ready"
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                self.state = "failed"
+            finally:
+                self.load_sec = round(time.monotonic() - t0, 3)
+
+    def get(self) -> Any:
+        self.load()
+        if not self.ready:
+            raise ComponentUnavailable(f"{self.name} failed to load: {self.error}")
+        return self.value
+
+    def status(self) -> Dict[str, Any]:
+        return {"state": self.state, "load_sec": self.load_sec, "error": self.error}
+
+
+def load_in_background(components: List[LazyComponent]) -> threading.Thread:
+    # Loads in list order, so put what the cheapest answers need first.
+    def run():
+        for c in components:
+            c.load()
+
+    t = threading.Thread(target=run, name="rag-loader", daemon=True)
+    t.start()
+    return t
@@ -1,26 +1,36 @@
+import os
 import re
 import json
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional, Dict, Any, Tuple
 
 import numpy as np
-import faiss
 import torch
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from starlette.concurrency import iterate_in_threadpool
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from transformers.modeling_outputs import BaseModelOutput
 
-
-def load_meta(meta_file: Path) -> List[Dict[str, Any]]:
-    rows = []
-    with meta_file.open("r", encoding="utf-8") as f:
-        for line in f:
-            s = line.strip()
-            if not s:
-                continue
-            rows.append(json.loads(s))
-    return rows
+from app.admission import AdmissionController
+from app.batching import MicroBatcher
+from app.loading import ComponentUnavailable, LazyComponent, load_in_background
+from app.metrics import Registry
+from app.procinfo import process_memory
+from rag.acronyms import definition_acronym, load_acronyms, lookup_acronym
+from rag.ann_index import load_index_info, load_search_index, search_params
+from rag.bm25 import open_bm25, retrieve
+from rag.embedder import load_sentence_model
+from rag.generator import load_seq2seq
+from rag.lru_cache import LRUCache
+from rag.meta_store import open_meta
+from rag.query_cache import QueryEmbeddingCache
+from rag.shards import has_shards, open_shards, read_shards, shard_state
 
 
 def strip_citations(answer: str) -> str:
@@ -83,7 +93,7 @@ def find_expansion_in_text(acronym: str, text: str) -> Optional[str]:
 
 
 def truncate_text(s: str, max_chars: int) -> str:
-    if len(s) <= max_chars:
+    if max_chars <= 0 or len(s) <= max_chars:
         return s
     return s[:max_chars].rstrip() + " ..."
 
@@ -112,17 +122,102 @@ def rerank_for_definition(query: str, retrieved: List[Tuple[float, str, str, int
 app = FastAPI()
 
 INDEX_FILE = Path("data/index/faiss.index")
-META_FILE = Path("data/index/meta.jsonl")
+META_FILE = Path("data/index/meta.bin")
+INFO_FILE = Path("data/index/info.json")
+# With data/index/shards.json (rag/build_shards.py) the index is served as
+# shards instead, each searched in parallel on the shard executor.
+INDEX_DIR = INDEX_FILE.parent
 
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 GEN_MODEL = "google/flan-t5-base"
+# torch (fp32), int8 (dynamically quantized Linear layers) or onnx (ONNX
+# Runtime export via optimum, saved under RAG_ONNX_DIR or data/onnx/).
+GEN_BACKEND = os.environ.get("RAG_GEN_BACKEND", "torch")
+ONNX_DIR = os.environ.get("RAG_ONNX_DIR") or None
+# Query embeddings must come from the backend the index was built with
+# (info.json "embed_backend"); RAG_EMBED_BACKEND overrides it.
+EMBED_BACKEND = os.environ.get("RAG_EMBED_BACKEND", "")
+
+GEN_BATCH_SIZE = 8
+# Beam widths for the first attempt and the too-short retry; requests can
+# override them with num_beams / retry_num_beams.
+GEN_BEAMS = int(os.environ.get("RAG_GEN_BEAMS", "4"))
+RETRY_BEAMS = int(os.environ.get("RAG_RETRY_BEAMS", "4"))
+MAX_BATCH_REQUESTS = 128
+# Per-chunk prompt truncation for character-sliced chunks. Token-budgeted
+# chunks (build_chunks.py --chunker tokens) already fit and are not cut.
+MAX_CHUNK_CHARS = 900
+
+# Concurrent /ask calls are queued and answered together in one batched
+# embed/search/generate pass.
+MICRO_BATCH = os.environ.get("RAG_MICRO_BATCH", "1") != "0"
+BATCH_MAX_SIZE = int(os.environ.get("RAG_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("RAG_BATCH_MAX_WAIT_MS", "10"))
+
+ANSWER_CACHE_SIZE = int(os.environ.get("RAG_ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL_SEC = float(os.environ.get("RAG_ANSWER_CACHE_TTL_SEC", "3600"))
+QUERY_CACHE_SIZE = int(os.environ.get("RAG_QUERY_CACHE_SIZE", "4096"))
+# How often info.json is checked for a rebuilt index (< 0 disables).
+INDEX_CHECK_SEC = float(os.environ.get("RAG_INDEX_CHECK_SEC", "5"))
+# Map faiss.index read-only (shared between worker processes via the page
+# cache) instead of reading it onto each process's heap.
+INDEX_MMAP = os.environ.get("RAG_INDEX_MMAP", "1") != "0"
+
+# Weight of BM25 in the reciprocal rank fusion with dense search, used when
+# the index was built with bm25.bin; 0 (the default) means dense only, so
+# scores stay cosines unless hybrid is asked for.
+SPARSE_WEIGHT = float(os.environ.get("RAG_SPARSE_WEIGHT", "0"))
+# eager: load everything before serving. background: serve /health at once
+# and load index -> embedder -> generator on a thread. lazy: load each on
+# first use. Requests wait for the components they need.
+STARTUP_MODE = os.environ.get("RAG_STARTUP_MODE", "background")
+
+# Model work runs on dedicated executors, never on the event loop: at most
+# EMBED_WORKERS encodes and GEN_WORKERS generate() calls run at once.
+# PIPELINE_WORKERS batches can be in flight (one embedding while another
+# generates). Requests beyond MAX_IN_FLIGHT wait up to ADMISSION_WAIT_SEC for
+# a slot and then get 429; REQUEST_TIMEOUT_SEC bounds each request end to end.
+EMBED_WORKERS = int(os.environ.get("RAG_EMBED_WORKERS", "1"))
+GEN_WORKERS = int(os.environ.get("RAG_GEN_WORKERS", "1"))
+PIPELINE_WORKERS = int(os.environ.get("RAG_PIPELINE_WORKERS", "2"))
+MAX_IN_FLIGHT = int(os.environ.get("RAG_MAX_IN_FLIGHT", "16"))
+ADMISSION_WAIT_SEC = float(os.environ.get("RAG_ADMISSION_WAIT_SEC", "2"))
+REQUEST_TIMEOUT_SEC = float(os.environ.get("RAG_REQUEST_TIMEOUT_SEC", "120"))
+# Threads searching shards in parallel (sharded indexes only; 0 = serial).
+SHARD_WORKERS = int(os.environ.get("RAG_SHARD_WORKERS", "4"))
 
-rows: List[Dict[str, Any]] = []
+rows = []
 index = None
+index_info: Dict[str, Any] = {}
+sparse_index = None
+acronym_table = None
+shard_set = None
+index_version = ""
+info_mtime = 0
+last_index_check = 0.0
+reload_lock = threading.Lock()
+answer_cache = LRUCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SEC)
+encoder_stats = {"encoded": 0, "reused": 0}
 embedder = None
+query_cache = None
 tokenizer = None
 gen_model = None
 
+embed_executor = ThreadPoolExecutor(max_workers=max(1, EMBED_WORKERS), thread_name_prefix="rag-embed")
+gen_executor = ThreadPoolExecutor(max_workers=max(1, GEN_WORKERS), thread_name_prefix="rag-gen")
+pipeline_executor = ThreadPoolExecutor(max_workers=max(1, PIPELINE_WORKERS), thread_name_prefix="rag-pipeline")
+shard_executor = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="rag-shard") if SHARD_WORKERS > 0 else None
+admission = AdmissionController(MAX_IN_FLIGHT, ADMISSION_WAIT_SEC)
+
+# Per-worker metrics, served at /metrics in the Prometheus text format.
+metrics = Registry()
+stage_seconds = metrics.histogram("rag_stage_seconds", "Seconds each request spent in a pipeline stage.", ["stage"])
+request_seconds = metrics.histogram("rag_request_seconds", "End-to-end request latency in seconds.", ["endpoint"])
+requests_total = metrics.counter("rag_requests_total", "Requests by endpoint and HTTP status.", ["endpoint", "status"])
+retries_total = metrics.counter("rag_retries_total", "Too-short answer retries.")
+fast_path_total = metrics.counter("rag_acronym_fast_path_total", "Acronym definitions answered without generation, by source.", ["source"])
+abstains_total = metrics.counter("rag_abstains_total", "Abstained answers by reason.", ["reason"])
+
 
 class AskRequest(BaseModel):
     query: str
@@ -131,67 +226,334 @@ class AskRequest(BaseModel):
     include_evidence: bool = False
     min_score: float = 0.35
     max_context_chars: int = 6500
-    max_chunk_chars: int = 900
+    max_chunk_chars: Optional[int] = None
     max_new_tokens: int = 220
     min_words: int = 8
+    nprobe: Optional[int] = Field(default=None, ge=1)
+    ef_search: Optional[int] = Field(default=None, ge=1)
+    num_beams: Optional[int] = Field(default=None, ge=1, le=8)
+    retry_num_beams: Optional[int] = Field(default=None, ge=1, le=8)
+    sparse_weight: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+    include_timings: bool = False
 
 
-@app.on_event("startup")
-def startup():
-    global rows, index, embedder, tokenizer, gen_model
+class AskBatchRequest(BaseModel):
+    requests: List[AskRequest]
+
+
+def info_state() -> Tuple[int, str]:
+    if has_shards(INDEX_DIR):
+        return shard_state(INDEX_DIR)
+    try:
+        mtime = INFO_FILE.stat().st_mtime_ns
+    except OSError:
+        return 0, ""
+    info = load_index_info(INFO_FILE)
+    return mtime, str(info.get("index_version") or f"mtime:{mtime}")
+
+
+def load_index():
+    global rows, index, index_info, index_version, info_mtime, sparse_index, acronym_table, shard_set
+
+    if has_shards(INDEX_DIR):
+        mtime, _ = info_state()
+        new_set = open_shards(INDEX_DIR, INDEX_MMAP, shard_executor, shard_set)
+        rows, index, index_info, sparse_index, acronym_table = (
+            new_set.meta, new_set.index, new_set.info, new_set.bm25, new_set.acronyms
+        )
+        shard_set = new_set
+        index_version = new_set.version
+        info_mtime = mtime
+        return
 
     if not INDEX_FILE.exists():
         raise RuntimeError(f"Missing index file: {INDEX_FILE}")
     if not META_FILE.exists():
         raise RuntimeError(f"Missing meta file: {META_FILE}")
 
-    rows = load_meta(META_FILE)
-    index = faiss.read_index(str(INDEX_FILE))
+    mtime, version = info_state()
+    new_rows = open_meta(META_FILE)
+    new_info = load_index_info(INFO_FILE)
+    new_index = load_search_index(INDEX_FILE, new_info, INDEX_MMAP)
+    new_sparse = open_bm25(INDEX_FILE.parent, new_info)
+    new_acronyms = load_acronyms(INDEX_FILE.parent, new_info)
+
+    rows, index, index_info, sparse_index, acronym_table = new_rows, new_index, new_info, new_sparse, new_acronyms
+    shard_set = None
+    index_version = version
+    info_mtime = mtime
+
+
+def maybe_reload_index():
+    # Called under reload_lock. build_index.py writes info.json last, so a
+    # new mtime with a new index_version means a complete rebuild is on disk.
+    global info_mtime, last_index_check
+
+    if INDEX_CHECK_SEC < 0 or index is None:
+        return
+    now = time.monotonic()
+    if now - last_index_check < INDEX_CHECK_SEC:
+        return
+    last_index_check = now
+
+    mtime, version = info_state()
+    if mtime == 0 or mtime == info_mtime:
+        return
+    if version == index_version:
+        info_mtime = mtime
+        return
+
+    load_index()
+    answer_cache.clear()
+
+
+def load_index_component():
+    with reload_lock:
+        load_index()
+    return index
 
-    embedder = SentenceTransformer(EMBED_MODEL)
 
-    tokenizer = AutoTokenizer.from_pretrained(GEN_MODEL)
-    gen_model = AutoModelForSeq2SeqLM.from_pretrained(GEN_MODEL)
-    gen_model.eval()
+def embed_backend() -> str:
+    info = read_shards(INDEX_DIR) if has_shards(INDEX_DIR) else load_index_info(INFO_FILE)
+    return EMBED_BACKEND or info.get("embed_backend", "torch")
+
+
+def load_embedder():
+    global embedder, query_cache
+    embedder = load_sentence_model(EMBED_MODEL, embed_backend())
+    query_cache = QueryEmbeddingCache(embedder, QUERY_CACHE_SIZE)
+    return embedder
+
+
+def load_generator():
+    global tokenizer, gen_model
+
+    tok, model = load_seq2seq(GEN_MODEL, GEN_BACKEND, ONNX_DIR)
+    tokenizer, gen_model = tok, model
+    return gen_model
+
+
+# Retrieval comes first: acronym definitions are answered from retrieved
+# text and never wait for the generator.
+components = {
+    "index": LazyComponent("index", load_index_component),
+    "embedder": LazyComponent("embedder", load_embedder),
+    "generator": LazyComponent("generator", load_generator),
+}
+
+
+def preload_runs_torch_ops() -> bool:
+    # int8 backends quantize the weights (quantize_dynamic) while loading.
+    return GEN_BACKEND == "int8" or embed_backend() == "int8"
+
+
+def preload():
+    # Loads every component now. app/server.py calls this before forking
+    # workers so their weights and index pages are shared copy-on-write;
+    # startup() then finds everything already loaded. Loading runs torch ops,
+    # so server.py calls it with torch limited to one thread, which keeps the
+    # intra-op pool (whose threads do not survive the fork) from starting;
+    # int8 quantization is not preloaded at all (preload_runs_torch_ops()).
+    for c in components.values():
+        c.get()
+
+
+@app.on_event("startup")
+def startup():
+    if STARTUP_MODE == "eager":
+        preload()
+    elif STARTUP_MODE == "background":
+        load_in_background(list(components.values()))
+
+    if MICRO_BATCH:
+        batcher.start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    batcher.stop()
+    for ex in (pipeline_executor, embed_executor, gen_executor, shard_executor):
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)
+
+
+def components_ready() -> bool:
+    return all(c.ready for c in components.values())
 
 
 @app.get("/health")
-def health():
-    return {"ok": True, "rows": len(rows)}
+async def health():
+    return {
+        "ok": True,
+        "ready": components_ready(),
+        "startup_mode": STARTUP_MODE,
+        "generator_backend": GEN_BACKEND,
+        "components": {name: c.status() for name, c in components.items()},
+        "rows": len(rows),
+        "index_type": index_info.get("index_type", "flat"),
+        "shards": shard_set.describe() if shard_set is not None else None,
+        "retrieval": "hybrid" if sparse_index is not None and SPARSE_WEIGHT > 0 else "dense",
+        "acronyms": len(acronym_table["entries"]) if acronym_table is not None else 0,
+        "index_version": index_version,
+        "batching": batcher.stats() if MICRO_BATCH else None,
+        "answer_cache": answer_cache.stats(),
+        "query_embedding_cache": query_cache.stats() if query_cache is not None else None,
+        "encoder_outputs": dict(encoder_stats),
+        "admission": admission.stats(),
+        "worker": process_memory(),
+    }
 
 
-@app.post("/ask")
-def ask(req: AskRequest):
-    q = req.query.strip()
-    if len(q) == 0:
-        return {"query": req.query, "abstained": True, "answer": "ABSTAIN", "citations": [], "top_chunks": []}
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+async def ready():
+    # Readiness probe: 503 until every component has loaded.
+    if not components_ready():
+        raise HTTPException(status_code=503, detail={name: c.state for name, c in components.items()})
+    return {"ready": True}
+
+
+def abstain_result(req: AskRequest, top_chunks=None, reason: str = "") -> Dict[str, Any]:
+    if reason:
+        abstains_total.inc(reason=reason)
+    return {
+        "query": req.query,
+        "abstained": True,
+        "answer": "ABSTAIN",
+        "citations": [],
+        "top_chunks": top_chunks if (req.include_evidence and top_chunks) else [],
+    }
+
+
+def timeout_result(req: AskRequest) -> Dict[str, Any]:
+    out = abstain_result(req)
+    out["error"] = "timeout"
+    return out
+
 
+def input_abstain_reason(q: str) -> Optional[str]:
+    if len(q) == 0:
+        return "empty_query"
     if looks_like_sensitive_personal_info_query(q):
-        return {"query": req.query, "abstained": True, "answer": "ABSTAIN", "citations": [], "top_chunks": []}
+        return "sensitive_query"
+    return None
+
+
+def observe_stage(stage: str, t0: float, timings: List[Dict[str, float]]):
+    # Batched stages are charged in full to every request in the batch.
+    dt = time.perf_counter() - t0
+    for t in timings:
+        t[stage] = dt
+        stage_seconds.observe(dt, stage=stage)
+
+
+def with_timings(req: AskRequest, out: Dict[str, Any], timing: Dict[str, float], started: float) -> Dict[str, Any]:
+    if not req.include_timings:
+        return out
+    timing = dict(timing)
+    timing["total"] = time.perf_counter() - started
+    return dict(out, timings={k: round(v, 4) for k, v in timing.items()})
+
+
+def expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class DeadlineCriteria(StoppingCriteria):
+    # Ends generate() early once nobody is waiting for the result: the
+    # deadline has passed or stop_event was set by the caller.
+    def __init__(self, deadline: Optional[float], stop_event: Optional[threading.Event] = None):
+        self.deadline = deadline
+        self.stop_event = stop_event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = expired(self.deadline) or (self.stop_event is not None and self.stop_event.is_set())
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
 
-    qvec = embedder.encode([q], convert_to_numpy=True, normalize_embeddings=True)
-    if qvec.dtype != np.float32:
-        qvec = qvec.astype(np.float32)
+def batch_deadline(deadlines: List[Optional[float]]) -> Optional[float]:
+    # A padded batch is only abandoned when every request in it has expired.
+    if len(deadlines) == 0 or any(d is None for d in deadlines):
+        return None
+    return max(deadlines)
+
+
+def embed_queries(queries: List[str]) -> np.ndarray:
+    components["embedder"].get()
+    return query_cache.encode(queries)
+
+
+def search_queries(qvec: np.ndarray, reqs: List[AskRequest], idx_snap, info_snap: Dict[str, Any], sparse_snap=None):
+    # Requests sharing top_k and search params are searched as one matrix.
+    # Returns per-request scores, ids and best dense score (see retrieve()).
+    D_out = [None] * len(reqs)
+    I_out = [None] * len(reqs)
+    top_out = [0.0] * len(reqs)
+    groups: Dict[Tuple[int, Optional[int], Optional[int], float], List[int]] = {}
+    for i, req in enumerate(reqs):
+        weight = SPARSE_WEIGHT if req.sparse_weight is None else req.sparse_weight
+        key = (req.top_k, req.nprobe, req.ef_search, weight)
+        groups.setdefault(key, []).append(i)
+
+    for (top_k, nprobe, ef_search, weight), members in groups.items():
+        params = search_params(info_snap, nprobe, ef_search)
+        queries = [reqs[i].query.strip() for i in members]
+        D, I, top = retrieve(idx_snap, sparse_snap, qvec[members], queries, top_k, weight, params)
+        for j, i in enumerate(members):
+            D_out[i] = D[j]
+            I_out[i] = I[j]
+            top_out[i] = float(top[j])
+    return D_out, I_out, top_out
 
-    D, I = index.search(qvec, req.top_k)
 
-    top_score = float(D[0][0])
+def chunk_char_limit(req: AskRequest, info_snap: Optional[Dict[str, Any]]) -> int:
+    if req.max_chunk_chars is not None:
+        return req.max_chunk_chars
+    if (info_snap or {}).get("chunking", {}).get("mode") == "tokens":
+        return 0
+    return MAX_CHUNK_CHARS
+
+
+def page_label(page, page_end) -> str:
+    if page_end is None or page_end == page:
+        return str(page)
+    return f"{page}-{page_end}"
+
+
+def plan_answer(req: AskRequest, q: str, D_row, I_row, meta, timing: Optional[Dict[str, float]] = None,
+                top_score: Optional[float] = None, info_snap: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # Returns {"result": ...} when no generation is needed, otherwise the
+    # retrieval state and prompt for the generator. top_score is the best
+    # dense score, which differs from D_row[0] under hybrid fusion.
+    timing = {} if timing is None else timing
+    t0 = time.perf_counter()
+    if top_score is None:
+        top_score = float(D_row[0])
     if top_score < req.min_score:
-        return {"query": req.query, "abstained": True, "answer": "ABSTAIN", "citations": [], "top_chunks": []}
+        return {"result": abstain_result(req, reason="low_score")}
 
     retrieved = []
     allowed_cite = set()
+    page_ends = {}
 
     for j in range(req.top_k):
-        idx = int(I[0][j])
-        score = float(D[0][j])
-        r = rows[idx]
+        idx = int(I_row[j])
+        if idx < 0:
+            continue
+        score = float(D_row[j])
+        r = meta[idx]
         doc_id = r.get("doc_id", "")
         chunk_id = r.get("chunk_id", "")
         page = int(r.get("page", 0))
         text = r.get("text", "")
         key = f"{doc_id}:{chunk_id}"
         allowed_cite.add(key)
+        if r.get("page_end") is not None:
+            page_ends[key] = int(r["page_end"])
         retrieved.append((score, doc_id, chunk_id, page, text))
 
     retrieved = rerank_for_definition(q, retrieved)
@@ -205,8 +567,11 @@ def ask(req: AskRequest):
             "page": page,
             "text_preview": truncate_text(text.replace("\n", " "), 220),
         })
+        if f"{doc_id}:{chunk_id}" in page_ends:
+            top_chunks[-1]["page_end"] = page_ends[f"{doc_id}:{chunk_id}"]
+    observe_stage("rerank", t0, [timing])
 
-    acronym = extract_acronym_from_query(q)
+    acronym = definition_acronym(q)
     if acronym:
         for score, doc_id, chunk_id, page, text in retrieved:
             exp = find_expansion_in_text(acronym, text)
@@ -222,19 +587,26 @@ def ask(req: AskRequest):
                         break
                 cites.extend(extra)
                 answer = base + " " + " ".join([f"[{x}]" for x in cites])
+                fast_path_total.inc(source="retrieval")
                 return {
-                    "query": req.query,
-                    "abstained": False,
-                    "answer": answer.strip(),
-                    "citations": cites,
-                    "top_chunks": top_chunks if req.include_evidence else [],
+                    "result": {
+                        "query": req.query,
+                        "abstained": False,
+                        "answer": answer.strip(),
+                        "citations": cites,
+                        "top_chunks": top_chunks if req.include_evidence else [],
+                    },
+                    "top_chunks": top_chunks,
                 }
 
+    t0 = time.perf_counter()
     context_blocks = []
     used_chars = 0
+    max_chunk_chars = chunk_char_limit(req, info_snap)
     for score, doc_id, chunk_id, page, text in retrieved:
-        tshort = truncate_text(text, req.max_chunk_chars)
-        block = f"SOURCE [{doc_id}:{chunk_id}] (page={page}): {tshort}"
+        tshort = truncate_text(text, max_chunk_chars)
+        pages = page_label(page, page_ends.get(f"{doc_id}:{chunk_id}"))
+        block = f"SOURCE [{doc_id}:{chunk_id}] (page={pages}): {tshort}"
         if used_chars + len(block) > req.max_context_chars:
             continue
         context_blocks.append(block)
@@ -253,33 +625,166 @@ def ask(req: AskRequest):
         f"SOURCES:\n{context}\n\n"
         "ANSWER:"
     )
+    observe_stage("prompt", t0, [timing])
+
+    return {
+        "prompt": prompt,
+        "retrieved": retrieved,
+        "allowed_cite": allowed_cite,
+        "top_chunks": top_chunks,
+    }
+
+
+def definition_answer(req: AskRequest, q: str, table, meta) -> Optional[Dict[str, Any]]:
+    # "What does X stand for" answered from the index-time acronym table,
+    # before embedding, search or generation.
+    acronym = definition_acronym(q)
+    if acronym is None:
+        return None
+    found = lookup_acronym(table, acronym)
+    if found is None:
+        return None
+    key, ent = found
 
-    def generate_once(p: str, max_new_tokens: int) -> str:
-        inputs = tokenizer(p, return_tensors="pt", truncation=True)
+    cites = ent["cites"][:req.cite_k]
+    answer = f"{key} stands for {ent['expansion']}."
+    if word_count(answer) < req.min_words and ent.get("context"):
+        answer += f" From the sources, {ent['context']}"
+
+    top_chunks = []
+    if req.include_evidence:
+        for idx in ent["rows"][:req.cite_k]:
+            r = meta[idx]
+            top_chunks.append({
+                "score": 1.0,
+                "doc_id": r.get("doc_id", ""),
+                "chunk_id": r.get("chunk_id", ""),
+                "page": int(r.get("page", 0)),
+                "text_preview": truncate_text(r.get("text", "").replace("\n", " "), 220),
+            })
+
+    fast_path_total.inc(source="table")
+    return {
+        "query": req.query,
+        "abstained": False,
+        "answer": answer + " " + " ".join([f"[{x}]" for x in cites]),
+        "citations": cites,
+        "top_chunks": top_chunks,
+    }
+
+
+def retry_prompt(prompt: str, min_words: int) -> str:
+    return (
+        prompt
+        + "\n\nYour previous answer was too short.\n"
+        + f"Rewrite the answer with at least {min_words} words, still using ONLY sources.\n"
+        + "ANSWER:"
+    )
+
+
+def encoder_inputs(prompts: List[str], slots: List[int], cache: Dict[int, Tuple[List[int], Any]]) -> Dict[str, Any]:
+    # generate() kwargs with precomputed T5 encoder outputs. cache maps a
+    # request slot to (token ids, encoder states) from its previous attempt.
+    # The retry prompt extends the first one, but inputs are truncated to the
+    # tokenizer's max length, so for long contexts the ids are identical and
+    # the encoder pass is skipped; otherwise the prompt is encoded again.
+    ids = tokenizer(prompts, truncation=True)["input_ids"]
+    hidden = [None] * len(ids)
+    todo = []
+    for j, slot in enumerate(slots):
+        hit = cache.get(slot)
+        if hit is not None and hit[0] == ids[j]:
+            hidden[j] = hit[1]
+        else:
+            todo.append(j)
+    encoder_stats["reused"] += len(ids) - len(todo)
+    encoder_stats["encoded"] += len(todo)
+
+    if len(todo) > 0:
+        padded = tokenizer.pad({"input_ids": [ids[j] for j in todo]}, return_tensors="pt")
+        with torch.inference_mode():
+            states = gen_model.get_encoder()(
+                input_ids=padded["input_ids"],
+                attention_mask=padded["attention_mask"],
+            ).last_hidden_state
+        for n, j in enumerate(todo):
+            hidden[j] = states[n, :len(ids[j])]
+            cache[slots[j]] = (ids[j], hidden[j])
+
+    width = max(len(x) for x in ids)
+    states = hidden[0].new_zeros((len(ids), width, hidden[0].shape[-1]))
+    mask = torch.zeros((len(ids), width), dtype=torch.long)
+    for j, h in enumerate(hidden):
+        states[j, :h.shape[0]] = h
+        mask[j, :h.shape[0]] = 1
+    return {"encoder_outputs": BaseModelOutput(last_hidden_state=states), "attention_mask": mask}
+
+
+def generation_inputs(prompts: List[str], slots: Optional[List[int]], cache) -> Dict[str, Any]:
+    # The ONNX backend has no separate encoder to call, so it always gets
+    # plain token ids.
+    if cache is None or slots is None or not hasattr(gen_model, "get_encoder"):
+        return tokenizer(prompts, return_tensors="pt", truncation=True, padding=True)
+    return encoder_inputs(prompts, slots, cache)
+
+
+def generate_many(prompts: List[str], max_new_tokens: int, deadlines: Optional[List[Optional[float]]] = None,
+                  num_beams: int = 4, slots: Optional[List[int]] = None, encoder_cache=None) -> List[str]:
+    # Prompts are padded into batches of GEN_BATCH_SIZE; a single prompt is
+    # encoded without padding, exactly as before.
+    if deadlines is None:
+        deadlines = [None] * len(prompts)
+    outs = []
+    for start in range(0, len(prompts), GEN_BATCH_SIZE):
+        batch = prompts[start:start + GEN_BATCH_SIZE]
+        deadline = batch_deadline(deadlines[start:start + GEN_BATCH_SIZE])
+        if expired(deadline):
+            outs.extend([""] * len(batch))
+            continue
+        stopping = StoppingCriteriaList([DeadlineCriteria(deadline)]) if deadline is not None else None
+        batch_slots = slots[start:start + GEN_BATCH_SIZE] if slots is not None else None
+        inputs = generation_inputs(batch, batch_slots, encoder_cache)
         with torch.inference_mode():
             out = gen_model.generate(
                 **inputs,
                 max_new_tokens=max_new_tokens,
                 do_sample=False,
-                num_beams=4,
+                num_beams=num_beams,
+                stopping_criteria=stopping,
             )
-        return tokenizer.decode(out[0], skip_special_tokens=True).strip()
+        for seq in out:
+            outs.append(tokenizer.decode(seq, skip_special_tokens=True).strip())
+    return outs
 
-    ans1 = generate_once(prompt, req.max_new_tokens)
-    if ans1 == "ABSTAIN":
-        return {"query": req.query, "abstained": True, "answer": "ABSTAIN", "citations": [], "top_chunks": top_chunks if req.include_evidence else []}
-
-    wc1 = word_count(strip_citations(ans1))
-    if wc1 < req.min_words:
-        prompt2 = (
-            prompt
-            + "\n\nYour previous answer was too short.\n"
-            + f"Rewrite the answer with at least {req.min_words} words, still using ONLY sources.\n"
-            + "ANSWER:"
+
+def generate_grouped(jobs: List[Tuple[int, str, int, int]], deadlines: Optional[Dict[int, Optional[float]]] = None,
+                     encoder_cache=None) -> Dict[int, str]:
+    # jobs: (slot, prompt, max_new_tokens, num_beams). generate() takes one
+    # max_new_tokens and beam width per call, so jobs are grouped by them.
+    groups: Dict[Tuple[int, int], List[Tuple[int, str]]] = {}
+    for slot, prompt, max_new_tokens, num_beams in jobs:
+        groups.setdefault((max_new_tokens, num_beams), []).append((slot, prompt))
+
+    deadlines = deadlines or {}
+    answers = {}
+    for (max_new_tokens, num_beams), members in groups.items():
+        outs = generate_many(
+            [p for _, p in members],
+            max_new_tokens,
+            [deadlines.get(slot) for slot, _ in members],
+            num_beams,
+            [slot for slot, _ in members],
+            encoder_cache,
         )
-        ans2 = generate_once(prompt2, max(req.max_new_tokens, 260))
-        if ans2 != "ABSTAIN":
-            ans1 = ans2
+        for (slot, _), ans in zip(members, outs):
+            answers[slot] = ans
+    return answers
+
+
+def finish_answer(req: AskRequest, state: Dict[str, Any], ans1: str) -> Dict[str, Any]:
+    retrieved = state["retrieved"]
+    allowed_cite = state["allowed_cite"]
+    top_chunks = state["top_chunks"]
 
     answer_text = strip_citations(ans1)
     wc_final = word_count(answer_text)
@@ -309,3 +814,401 @@ def ask(req: AskRequest):
         "citations": cites if answer.strip() != "ABSTAIN" else [],
         "top_chunks": top_chunks if req.include_evidence else [],
     }
+
+
+def normalize_query(q: str) -> str:
+    q = re.sub(r"\s+", " ", q).strip()
+    return q.rstrip("?.! ")
+
+
+def answer_cache_key(req: AskRequest, version: str):
+    return (
+        version,
+        normalize_query(req.query),
+        req.top_k,
+        req.cite_k,
+        req.include_evidence,
+        req.min_score,
+        req.max_context_chars,
+        req.max_chunk_chars,
+        req.max_new_tokens,
+        req.min_words,
+        req.nprobe,
+        req.ef_search,
+        req.num_beams,
+        req.retry_num_beams,
+        req.sparse_weight,
+    )
+
+
+def answer_requests(reqs: List[AskRequest], deadlines: Optional[List[Optional[float]]] = None,
+                    started: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    # Runs on a batcher/pipeline thread; embedding and generation are handed
+    # to their executors. Requests past their deadline are dropped between
+    # stages (and cut short inside generate()) with a timeout result.
+    # started holds each request's arrival time (perf_counter), for timings.
+    t_enter = time.perf_counter()
+    if started is None:
+        started = [t_enter] * len(reqs)
+    timings: List[Dict[str, float]] = [{"queue": t_enter - t} for t in started]
+    components["index"].get()
+    with reload_lock:
+        maybe_reload_index()
+        meta, idx_snap, info_snap, version = rows, index, index_info, index_version
+        sparse_snap, acronym_snap = sparse_index, acronym_table
+
+    if deadlines is None:
+        deadlines = [None] * len(reqs)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(reqs)
+    queries = [req.query.strip() for req in reqs]
+    keys = [answer_cache_key(req, version) for req in reqs]
+
+    def still_live(idxs):
+        keep = []
+        for i in idxs:
+            if expired(deadlines[i]):
+                results[i] = timeout_result(reqs[i])
+            else:
+                keep.append(i)
+        return keep
+
+    live = []
+    for i, req in enumerate(reqs):
+        reason = input_abstain_reason(queries[i])
+        if reason is not None:
+            results[i] = abstain_result(req, reason=reason)
+            continue
+        defined = definition_answer(req, queries[i], acronym_snap, meta)
+        if defined is not None:
+            results[i] = defined
+            continue
+        hit = answer_cache.get(keys[i])
+        if hit is not None:
+            out = dict(hit[0])
+            out["query"] = req.query
+            results[i] = out
+        else:
+            live.append(i)
+
+    live = still_live(live)
+    if len(live) == 0:
+        return finish_timings(reqs, results, timings, started)
+
+    t0 = time.perf_counter()
+    qvec = embed_executor.submit(embed_queries, [queries[i] for i in live]).result()
+    observe_stage("embed", t0, [timings[i] for i in live])
+    t0 = time.perf_counter()
+    D, I, top = search_queries(qvec, [reqs[i] for i in live], idx_snap, info_snap, sparse_snap)
+    observe_stage("search", t0, [timings[i] for i in live])
+
+    states = {}
+    # Retrieval evidence per request, cached with the answer so a cache hit
+    # on /ask_stream sends the same "retrieval" event as a fresh answer.
+    evidence: Dict[int, List[Dict[str, Any]]] = {}
+    for j, i in enumerate(live):
+        plan = plan_answer(reqs[i], queries[i], D[j], I[j], meta, timings[i], top[j], info_snap)
+        evidence[i] = plan.get("top_chunks", [])
+        if "result" in plan:
+            results[i] = plan["result"]
+        else:
+            states[i] = plan
+
+    for i in set(states) - set(still_live(list(states))):
+        del states[i]
+    slot_deadlines = {i: deadlines[i] for i in states}
+    # Encoder outputs of the first attempt, reused by the retry.
+    encoder_cache: Dict[int, Tuple[List[int], Any]] = {}
+    first_jobs = [(i, st["prompt"], reqs[i].max_new_tokens, reqs[i].num_beams or GEN_BEAMS) for i, st in states.items()]
+    t0 = time.perf_counter()
+    first = run_generation(first_jobs, slot_deadlines, encoder_cache)
+    observe_stage("generate", t0, [timings[i] for i in states])
+    for i in set(states) - set(still_live(list(states))):
+        del states[i]
+
+    retry_jobs = []
+    for i, st in states.items():
+        req = reqs[i]
+        ans1 = first[i]
+        if ans1 == "ABSTAIN":
+            results[i] = abstain_result(req, st["top_chunks"], reason="model_abstain")
+            continue
+        st["answer"] = ans1
+        if word_count(strip_citations(ans1)) < req.min_words:
+            retry_beams = req.retry_num_beams or RETRY_BEAMS
+            retry_jobs.append((i, retry_prompt(st["prompt"], req.min_words), max(req.max_new_tokens, 260), retry_beams))
+
+    retries_total.inc(len(retry_jobs))
+    t0 = time.perf_counter()
+    second = run_generation(retry_jobs, slot_deadlines, encoder_cache)
+    if len(retry_jobs) > 0:
+        observe_stage("retry", t0, [timings[slot] for slot, _, _, _ in retry_jobs])
+    for i in set(second) - set(still_live(list(second))):
+        del states[i]
+    for i, ans2 in second.items():
+        if i in states and ans2 != "ABSTAIN":
+            states[i]["answer"] = ans2
+
+    for i, st in states.items():
+        if results[i] is None:
+            results[i] = finish_answer(reqs[i], st, st["answer"])
+
+    for i in live:
+        if "error" not in results[i]:
+            answer_cache.put(keys[i], (results[i], evidence.get(i, [])))
+    return finish_timings(reqs, results, timings, started)
+
+
+def finish_timings(reqs: List[AskRequest], results: List[Dict[str, Any]], timings: List[Dict[str, float]],
+                   started: List[float]) -> List[Dict[str, Any]]:
+    # Called after caching, so cached answers never carry timings.
+    return [with_timings(req, out, timing, t) for req, out, timing, t in zip(reqs, results, timings, started)]
+
+
+def run_generation(jobs: List[Tuple[int, str, int, int]], deadlines: Dict[int, Optional[float]], encoder_cache=None) -> Dict[int, str]:
+    if len(jobs) == 0:
+        return {}
+    components["generator"].get()
+    return gen_executor.submit(generate_grouped, jobs, deadlines, encoder_cache).result()
+
+
+def answer_jobs(jobs: List[Tuple[AskRequest, Optional[float], float]]) -> List[Dict[str, Any]]:
+    return answer_requests([job[0] for job in jobs], [job[1] for job in jobs], [job[2] for job in jobs])
+
+
+batcher = MicroBatcher(answer_jobs, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, PIPELINE_WORKERS)
+
+
+async def admit():
+    if not await admission.acquire():
+        raise HTTPException(status_code=429, detail="server busy, retry later", headers={"Retry-After": "1"})
+
+
+async def wait_result(fut: Future, timeout: float):
+    # On timeout the future is cancelled: still queued, it is skipped by the
+    # batcher; already running, its deadline stops generation.
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(fut), timeout=timeout)
+    except ComponentUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        fut.cancel()
+        admission.timeouts += 1
+        raise HTTPException(status_code=504, detail="request timed out")
+
+
+def observe_request(endpoint: str, status: int, t0: float):
+    request_seconds.observe(time.perf_counter() - t0, endpoint=endpoint)
+    requests_total.inc(endpoint=endpoint, status=str(status))
+
+
+async def answer_one(req: AskRequest, t0: float) -> Dict[str, Any]:
+    await admit()
+    try:
+        deadline = time.monotonic() + REQUEST_TIMEOUT_SEC
+        if MICRO_BATCH:
+            out = await wait_result(batcher.submit((req, deadline, t0)), REQUEST_TIMEOUT_SEC)
+        else:
+            out = (await wait_result(pipeline_executor.submit(answer_requests, [req], [deadline], [t0]), REQUEST_TIMEOUT_SEC))[0]
+    finally:
+        admission.release()
+    if out.get("error") == "timeout":
+        admission.timeouts += 1
+        raise HTTPException(status_code=504, detail="request timed out")
+    return out
+
+
+@app.post("/ask")
+async def ask(req: AskRequest):
+    t0 = time.perf_counter()
+    status = 200
+    try:
+        return await answer_one(req, t0)
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    finally:
+        observe_request("ask", status, t0)
+
+
+async def answer_batch(req: AskBatchRequest, t0: float) -> Dict[str, Any]:
+    if len(req.requests) > MAX_BATCH_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_BATCH_REQUESTS} requests per batch")
+    await admit()
+    try:
+        deadline = time.monotonic() + REQUEST_TIMEOUT_SEC
+        n = len(req.requests)
+        fut = pipeline_executor.submit(answer_requests, req.requests, [deadline] * n, [t0] * n)
+        results = await wait_result(fut, REQUEST_TIMEOUT_SEC)
+    finally:
+        admission.release()
+    return {"results": results}
+
+
+@app.post("/ask_batch")
+async def ask_batch(req: AskBatchRequest):
+    t0 = time.perf_counter()
+    status = 200
+    try:
+        return await answer_batch(req, t0)
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    finally:
+        observe_request("ask_batch", status, t0)
+
+
+def sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def generate_stream(p: str, max_new_tokens: int, deadline: Optional[float] = None, encoder_cache=None):
+    # transformers streamers do not support beam search, so the streamed
+    # answer is decoded greedily (num_beams=1). Generation runs on
+    # gen_executor and stops if the client goes away or the deadline passes.
+    components["generator"].get()
+    inputs = gen_executor.submit(generation_inputs, [p], [0], encoder_cache).result()
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            with torch.inference_mode():
+                gen_model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    num_beams=1,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([DeadlineCriteria(deadline, stop)]),
+                )
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    fut = gen_executor.submit(run)
+    try:
+        for piece in streamer:
+            if piece:
+                yield piece
+        fut.result()
+    finally:
+        stop.set()
+        fut.cancel()
+    if errors:
+        raise errors[0]
+
+
+def stream_answer(req: AskRequest, deadline: Optional[float] = None, started: Optional[float] = None):
+    started = time.perf_counter() if started is None else started
+    timing: Dict[str, float] = {}
+
+    def final(out: Dict[str, Any]) -> str:
+        return sse("final", with_timings(req, out, timing, started))
+
+    q = req.query.strip()
+    reason = input_abstain_reason(q)
+    if reason is not None:
+        yield sse("retrieval", {"query": req.query, "top_chunks": []})
+        yield final(abstain_result(req, reason=reason))
+        return
+
+    components["index"].get()
+    with reload_lock:
+        maybe_reload_index()
+        meta, idx_snap, info_snap, version = rows, index, index_info, index_version
+        sparse_snap, acronym_snap = sparse_index, acronym_table
+
+    defined = definition_answer(req, q, acronym_snap, meta)
+    if defined is not None:
+        yield sse("retrieval", {"query": req.query, "top_chunks": defined["top_chunks"]})
+        yield final(defined)
+        return
+
+    hit = answer_cache.get(answer_cache_key(req, version))
+    if hit is not None:
+        out = dict(hit[0])
+        out["query"] = req.query
+        yield sse("retrieval", {"query": req.query, "top_chunks": hit[1]})
+        yield final(out)
+        return
+
+    t0 = time.perf_counter()
+    qvec = embed_executor.submit(embed_queries, [q]).result()
+    observe_stage("embed", t0, [timing])
+    t0 = time.perf_counter()
+    D, I, top = search_queries(qvec, [req], idx_snap, info_snap, sparse_snap)
+    observe_stage("search", t0, [timing])
+    plan = plan_answer(req, q, D[0], I[0], meta, timing, top[0], info_snap)
+    yield sse("retrieval", {"query": req.query, "top_chunks": plan.get("top_chunks", [])})
+    if "result" in plan:
+        yield final(plan["result"])
+        return
+
+    encoder_cache: Dict[int, Tuple[List[int], Any]] = {}
+    pieces = []
+    t0 = time.perf_counter()
+    for piece in generate_stream(plan["prompt"], req.max_new_tokens, deadline, encoder_cache):
+        pieces.append(piece)
+        yield sse("token", {"text": piece})
+    observe_stage("generate", t0, [timing])
+    if expired(deadline):
+        yield final(timeout_result(req))
+        return
+    ans1 = "".join(pieces).strip()
+    if ans1 == "ABSTAIN":
+        yield final(abstain_result(req, plan["top_chunks"], reason="model_abstain"))
+        return
+
+    if word_count(strip_citations(ans1)) < req.min_words:
+        retries_total.inc()
+        yield sse("retry", {"reason": "too_short_answer"})
+        pieces = []
+        retry_p = retry_prompt(plan["prompt"], req.min_words)
+        t0 = time.perf_counter()
+        for piece in generate_stream(retry_p, max(req.max_new_tokens, 260), deadline, encoder_cache):
+            pieces.append(piece)
+            yield sse("token", {"text": piece})
+        observe_stage("retry", t0, [timing])
+        if expired(deadline):
+            yield final(timeout_result(req))
+            return
+        ans2 = "".join(pieces).strip()
+        if ans2 != "ABSTAIN":
+            ans1 = ans2
+
+    yield final(finish_answer(req, plan, ans1))
+
+
+@app.post("/ask_stream")
+async def ask_stream(req: AskRequest):
+    # Server-sent events: "retrieval" (top_chunks) first, then "token" events
+    # as the answer is decoded ("retry" resets it), then "final" with the
+    # same body /ask returns. The admission slot is held until the stream ends.
+    t0 = time.perf_counter()
+    try:
+        await admit()
+    except HTTPException as e:
+        observe_request("ask_stream", e.status_code, t0)
+        raise
+    deadline = time.monotonic() + REQUEST_TIMEOUT_SEC
+
+    async def body():
+        # The status is sent before the first event, so the metric records
+        # what /ask would have returned: 504 for a timeout final, 500 when
+        # the stream fails.
+        status = 200
+        try:
+            async for chunk in iterate_in_threadpool(stream_answer(req, deadline, t0)):
+                if chunk.startswith("event: final\n") and '"error": "timeout"' in chunk:
+                    admission.timeouts += 1
+                    status = 504
+                yield chunk
+        except Exception:
+            status = 500
+            raise
+        finally:
+            admission.release()
+            observe_request("ask_stream", status, t0)
+
+    return StreamingResponse(body(), media_type="text/event-stream")
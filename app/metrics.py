@@ -0,0 +1,95 @@
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_str(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+        if len(self.labelnames) == 0:
+            self.values[()] = 0.0
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, v in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {v:g}")
+        return lines
+
+
+class Histogram:
+    # Cumulative-bucket histogram in the Prometheus text format.
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        pos = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            s = self.series.get(key)
+            if s is None:
+                # per-bucket counts, then +Inf count, sum
+                s = [0.0] * (len(self.buckets) + 2)
+                self.series[key] = s
+            s[pos] += 1
+            s[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, s in sorted(self.series.items()):
+                cum = 0.0
+                bounds = ["%g" % b for b in self.buckets] + ["+Inf"]
+                for le, c in zip(bounds, s):
+                    cum += c
+                    le_label = 'le="' + le + '"'
+                    lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le_label)} {cum:g}")
+                lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {s[-1]:g}")
+                lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {cum:g}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        m = Counter(name, help_text, labelnames)
+        self.metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        m = Histogram(name, help_text, labelnames, buckets)
+        self.metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
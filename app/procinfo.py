@@ -0,0 +1,28 @@
+import os
+import resource
+from typing import Any, Dict
+
+
+def process_memory(pid: Any = "self") -> Dict[str, Any]:
+    # rss counts shared pages in full; pss splits them between the processes
+    # mapping them, so summing pss over workers gives real node usage.
+    out: Dict[str, Any] = {"pid": os.getpid() if pid == "self" else int(pid)}
+    try:
+        fields = {}
+        with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        if pid == "self":
+            out["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+        return out
+
+    shared = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    out["rss_mb"] = round(fields.get("Rss", 0) / 1024.0, 1)
+    out["pss_mb"] = round(fields.get("Pss", 0) / 1024.0, 1)
+    out["shared_mb"] = round(shared / 1024.0, 1)
+    out["private_mb"] = round(private / 1024.0, 1)
+    return out
@@ -0,0 +1,196 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from pathlib import Path
+
+import uvicorn
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.procinfo import process_memory
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, args):
+    if args.torch_threads > 0:
+        import torch
+        torch.set_num_threads(args.torch_threads)
+    server = uvicorn.Server(uvicorn.Config(app, log_level=args.log_level))
+    server.run(sockets=[sock])
+
+
+def spawn_worker(app, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        run_worker(app, sock, args)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    # os._exit skips the interpreter's flush of stdio.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
+
+
+def report_memory(workers):
+    total_pss = 0.0
+    for pid, slot in sorted(workers.items(), key=lambda x: x[1]):
+        mem = process_memory(pid)
+        total_pss += mem.get("pss_mb", 0.0)
+        print(f"worker={slot} pid={pid} rss_mb={mem.get('rss_mb')} pss_mb={mem.get('pss_mb')} "
+              f"shared_mb={mem.get('shared_mb')} private_mb={mem.get('private_mb')}", flush=True)
+    print(f"workers={len(workers)} total_pss_mb={round(total_pss, 1)}", flush=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=1,
+                    help="int8 backends skip preload: each worker loads and quantizes its own copy")
+    ap.add_argument("--no_preload", action="store_true")
+    ap.add_argument("--torch_threads", type=int, default=0)
+    ap.add_argument("--report_sec", type=float, default=0.0)
+    ap.add_argument("--log_level", default="info")
+    ap.add_argument("--min_uptime_sec", type=float, default=10.0)
+    ap.add_argument("--max_restarts", type=int, default=5)
+    ap.add_argument("--max_backoff_sec", type=float, default=30.0)
+    args = ap.parse_args()
+
+    from app.main import app, preload, preload_runs_torch_ops
+
+    if args.workers <= 1:
+        uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
+        return
+    if not hasattr(os, "fork"):
+        raise SystemExit("--workers > 1 needs os.fork; run one process per port instead")
+
+    if args.torch_threads <= 0:
+        args.torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+
+    # Fork safety: the parent must not have started torch's intra-op thread
+    # pool when it forks (pool threads are not copied into the children, and
+    # a child reusing the pool's state can hang). Loading does run torch ops
+    # (from_pretrained initialises and copies tensors), and with more than
+    # one thread they start the pool, so the parent loads with one thread:
+    # ops then run on the calling thread. Each worker sets --torch_threads in
+    # run_worker(). int8 backends quantize while loading, so they are loaded
+    # in each worker instead.
+    import torch
+    torch.set_num_threads(1)
+    if not args.no_preload and preload_runs_torch_ops():
+        print("WARN: int8 backends run torch ops while loading; not preloading in the parent", file=sys.stderr, flush=True)
+        args.no_preload = True
+
+    # Load the index and models in the parent, then fork: workers share those
+    # pages copy-on-write instead of each loading its own copy. gc.freeze()
+    # keeps the collector from touching (and so copying) preloaded objects.
+    if not args.no_preload:
+        t0 = time.time()
+        preload()
+        gc.collect()
+        gc.freeze()
+        mem = process_memory()
+        print(f"preload_sec={time.time() - t0:.1f} rss_mb={mem.get('rss_mb')}", flush=True)
+
+    sock = bind_socket(args.host, args.port)
+    workers = {}
+    started = {}
+    # Per slot: consecutive exits within --min_uptime_sec of starting, and the
+    # time a pending restart is due.
+    fails = {}
+    pending = {}
+    exit_code = 0
+
+    def start(slot: int) -> int:
+        pid = spawn_worker(app, sock, args)
+        workers[pid] = slot
+        started[pid] = time.monotonic()
+        return pid
+
+    for slot in range(args.workers):
+        pid = start(slot)
+        print(f"worker={slot} pid={pid}", flush=True)
+    print(f"listening=http://{args.host}:{args.port} workers={args.workers} torch_threads={args.torch_threads}", flush=True)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    next_report = time.monotonic() + args.report_sec
+    while len(workers) > 0 or len(pending) > 0:
+        if stopping:
+            pending.clear()
+        for slot, due in list(pending.items()):
+            if time.monotonic() >= due:
+                del pending[slot]
+                pid = start(slot)
+                print(f"worker={slot} pid={pid} restarted", flush=True)
+        if len(workers) == 0:
+            time.sleep(0.1)
+            continue
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.5)
+            if args.report_sec > 0 and not stopping and time.monotonic() >= next_report:
+                report_memory(workers)
+                next_report = time.monotonic() + args.report_sec
+            continue
+        slot = workers.pop(pid, None)
+        uptime = time.monotonic() - started.pop(pid, 0.0)
+        if slot is None or stopping:
+            continue
+        # A worker that dies right after starting (bad config, model load
+        # error) is restarted with exponential backoff, and the supervisor
+        # gives up after --max_restarts such exits in a row.
+        fails[slot] = fails.get(slot, 0) + 1 if uptime < args.min_uptime_sec else 1
+        if fails[slot] > args.max_restarts:
+            print(f"ERROR: worker={slot} exited {fails[slot]} times in a row within {args.min_uptime_sec:g}s "
+                  f"of starting (last status={status}); stopping", file=sys.stderr, flush=True)
+            exit_code = 1
+            stop(signal.SIGTERM, None)
+            continue
+        delay = min(args.max_backoff_sec, 0.5 * 2 ** (fails[slot] - 1))
+        print(f"worker={slot} pid={pid} exited status={status}; restarting in {delay:.1f}s", flush=True)
+        pending[slot] = time.monotonic() + delay
+
+    sock.close()
+    if exit_code != 0:
+        sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from rag.build_chunks import chunk_text, extract_pdf_pages, iter_inputs, normalize_text, read_text_file
+from rag.chunker import DEFAULT_TOKENIZERS, SENTENCE_END_RE, TokenChunker, TokenCounter, clean_page_text, parse_tokenizers
+from run_eval import percentile
+
+
+def load_pages(files):
+    # (pages per file, seconds). Pages keep their line breaks; the char
+    # chunker gets normalize_text() of the same text.
+    import fitz
+
+    docs = []
+    t0 = time.perf_counter()
+    for path in files:
+        if path.suffix.lower() != ".pdf":
+            docs.append([(None, clean_page_text(read_text_file(path)))])
+            continue
+        try:
+            with fitz.open(str(path)) as pdf:
+                n = pdf.page_count
+        except Exception as e:
+            print(f"WARN: failed to open PDF: {path} ({e})", file=sys.stderr)
+            continue
+        docs.append(extract_pdf_pages(path, 0, n, clean_page_text))
+    return docs, time.perf_counter() - t0
+
+
+def chars_mode(docs, chunk_chars: int, overlap_chars: int):
+    chunks = []
+    t0 = time.perf_counter()
+    for pages in docs:
+        for page, text in pages:
+            text = normalize_text(text)
+            for part in chunk_text(text, chunk_chars, overlap_chars):
+                chunks.append({"text": part, "page": page, "page_end": page})
+    return chunks, time.perf_counter() - t0
+
+
+def tokens_mode(docs, counter, chunk_tokens: int, overlap_tokens: int):
+    chunks = []
+    t0 = time.perf_counter()
+    for pages in docs:
+        ch = TokenChunker(counter, chunk_tokens, overlap_tokens)
+        chunks.extend(ch.add_pages([(p, t) for p, t in pages if t]))
+        chunks.extend(ch.finish())
+    return chunks, time.perf_counter() - t0
+
+
+def summarize(name: str, chunks, sec: float, n_pages: int, n_bytes: int, counter, limit: int):
+    # Token counts are exact: each chunk is re-tokenized whole, special
+    # tokens included, under every tokenizer.
+    tokens = [n + counter.special for n in counter.counts([c["text"] for c in chunks])]
+    n = len(chunks)
+    return {
+        "mode": name,
+        "chunks": n,
+        "sec": sec,
+        "pages_per_sec": n_pages / sec if sec > 0 else 0.0,
+        "mb_per_sec": n_bytes / 1e6 / sec if sec > 0 else 0.0,
+        "chunks_per_sec": n / sec if sec > 0 else 0.0,
+        "tokens_mean": sum(tokens) / n if n > 0 else 0.0,
+        "tokens_p50": percentile(tokens, 50),
+        "tokens_p95": percentile(tokens, 95),
+        "tokens_max": max(tokens) if tokens else 0,
+        "over_limit": sum(1 for t in tokens if t > limit),
+        "sentence_end": sum(1 for c in chunks if SENTENCE_END_RE.search(c["text"])) / n if n > 0 else 0.0,
+        "cross_page": sum(1 for c in chunks if c["page"] is not None and c["page_end"] != c["page"]),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", default="data/sample_docs")
+    ap.add_argument("--max_files", type=int, default=0)
+    ap.add_argument("--out_report", default="eval/chunk_bench.md")
+    ap.add_argument("--chunk_chars", type=int, default=2000)
+    ap.add_argument("--overlap_chars", type=int, default=300)
+    ap.add_argument("--chunk_tokens", type=int, default=256)
+    ap.add_argument("--overlap_tokens", type=int, default=32)
+    ap.add_argument("--tokenizers", default=DEFAULT_TOKENIZERS)
+    args = ap.parse_args()
+
+    files = iter_inputs(Path(args.in_dir))
+    if args.max_files > 0:
+        files = files[:args.max_files]
+    if len(files) == 0:
+        print(f"ERROR: no input files found under: {args.in_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    docs, extract_sec = load_pages(files)
+    n_pages = sum(len(pages) for pages in docs)
+    n_bytes = sum(len(t.encode("utf-8")) for pages in docs for _, t in pages)
+    print(f"files={len(docs)} pages={n_pages} mb={n_bytes / 1e6:.2f} extract_sec={extract_sec:.2f}")
+
+    t0 = time.perf_counter()
+    counter = TokenCounter(parse_tokenizers(args.tokenizers))
+    load_sec = time.perf_counter() - t0
+
+    rows = []
+    chunks, sec = chars_mode(docs, args.chunk_chars, args.overlap_chars)
+    rows.append(summarize("chars", chunks, sec, n_pages, n_bytes, counter, args.chunk_tokens))
+    chunks, sec = tokens_mode(docs, counter, args.chunk_tokens, args.overlap_tokens)
+    rows.append(summarize("tokens", chunks, sec, n_pages, n_bytes, counter, args.chunk_tokens))
+
+    for r in rows:
+        print(
+            f"mode={r['mode']} chunks={r['chunks']} sec={r['sec']:.2f} pages_per_sec={r['pages_per_sec']:.1f} "
+            f"mb_per_sec={r['mb_per_sec']:.2f} tokens_p50={r['tokens_p50']:.0f} tokens_max={r['tokens_max']} "
+            f"over_limit={r['over_limit']} sentence_end={r['sentence_end']:.3f} cross_page={r['cross_page']}"
+        )
+
+    lines = []
+    lines.append("# Chunking Benchmark")
+    lines.append("")
+    lines.append(f"- Input: **{len(docs)}** files, **{n_pages}** pages, **{n_bytes / 1e6:.2f} MB** of text from `{args.in_dir}`")
+    lines.append(f"- PDF text extraction: **{extract_sec:.2f}s** (not included below)")
+    lines.append(f"- Tokenizers: {', '.join(f'`{n}`' for n in counter.names)} (loaded in {load_sec:.2f}s)")
+    lines.append(f"- chars: `chunk_chars={args.chunk_chars}`, `overlap_chars={args.overlap_chars}`; "
+                 f"tokens: `chunk_tokens={args.chunk_tokens}`, `overlap_tokens={args.overlap_tokens}`")
+    lines.append(f"- Token counts are the max over the tokenizers, special tokens included; "
+                 f"`over limit` counts chunks above {args.chunk_tokens} tokens.")
+    lines.append("")
+    lines.append("| mode | chunks | sec | pages/s | MB/s | chunks/s | tokens mean | p50 | p95 | max | over limit | ends a sentence | cross-page |")
+    lines.append("|---|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|")
+    for r in rows:
+        lines.append(
+            f"| {r['mode']} | {r['chunks']} | {r['sec']:.2f} | {r['pages_per_sec']:.1f} | {r['mb_per_sec']:.2f} | "
+            f"{r['chunks_per_sec']:.0f} | {r['tokens_mean']:.1f} | {r['tokens_p50']:.0f} | {r['tokens_p95']:.0f} | "
+            f"{r['tokens_max']} | {r['over_limit']} | {r['sentence_end']:.1%} | {r['cross_page']} |"
+        )
+    lines.append("")
+
+    Path(args.out_report).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.out_report).write_text("\n".join(lines), encoding="utf-8")
+    print(f"wrote: {args.out_report}")
+
+
+if __name__ == "__main__":
+    main()
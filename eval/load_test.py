@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from run_eval import percentile, read_jsonl
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def parse_levels(s: str, cast):
+    return [cast(x) for x in s.split(",") if x.strip() != ""]
+
+
+def build_payloads(tasks, n: int, top_k: int, cite_k: int):
+    # Replays the task file in order, wrapping around when n > len(tasks).
+    payloads = []
+    for i in range(n):
+        t = tasks[i % len(tasks)]
+        payloads.append({
+            "query": t["query"],
+            "top_k": int(t.get("top_k", top_k)),
+            "cite_k": int(t.get("cite_k", cite_k)),
+        })
+    return payloads
+
+
+def classify(status: int) -> str:
+    if status == 200:
+        return "ok"
+    if status == 429:
+        return "rejected"
+    if status in (0, 504):
+        return "timeout"
+    return "error"
+
+
+async def send(client, payload, timeout_sec: float) -> int:
+    try:
+        r = await client.post("/ask", json=payload, timeout=timeout_sec)
+        return int(r.status_code)
+    except httpx.TimeoutException:
+        return 0
+    except Exception:
+        return -1
+
+
+async def run_closed(client, payloads, concurrency: int, timeout_sec: float):
+    # Closed loop: each of `concurrency` clients sends its next request as
+    # soon as the previous one returns.
+    it = iter(payloads)
+    samples = []
+
+    async def worker():
+        for p in it:
+            t0 = time.perf_counter()
+            status = await send(client, p, timeout_sec)
+            samples.append((status, time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return samples, time.perf_counter() - t0
+
+
+async def run_open(client, payloads, qps: float, timeout_sec: float):
+    # Open loop: request i is due at start + i / qps whether or not earlier
+    # requests have returned. Latency is measured from the due time, so a
+    # client that falls behind does not hide queueing (coordinated omission).
+    start = time.perf_counter()
+
+    async def one(i, p):
+        due = start + i / qps
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        status = await send(client, p, timeout_sec)
+        return status, time.perf_counter() - due
+
+    samples = await asyncio.gather(*[one(i, p) for i, p in enumerate(payloads)])
+    return list(samples), time.perf_counter() - start
+
+
+async def cache_hits(client) -> int:
+    try:
+        r = await client.get("/health", timeout=10)
+        return int(r.json().get("answer_cache", {}).get("hits", 0))
+    except Exception:
+        return 0
+
+
+def summarize(mode: str, level, samples, wall: float, hits: int):
+    n = len(samples)
+    kinds = [classify(s) for s, _ in samples]
+    ok_lat = [dt for (s, dt), k in zip(samples, kinds) if k == "ok"]
+    ok = kinds.count("ok")
+    return {
+        "mode": mode,
+        "level": level,
+        "requests": n,
+        "ok": ok,
+        "rejected": kinds.count("rejected"),
+        "timeouts": kinds.count("timeout"),
+        "errors": kinds.count("error"),
+        "fail_rate": (n - ok) / n if n > 0 else 0.0,
+        "throughput": ok / wall if wall > 0 else 0.0,
+        "wall_sec": wall,
+        "p50": percentile(ok_lat, 50),
+        "p95": percentile(ok_lat, 95),
+        "p99": percentile(ok_lat, 99),
+        "max": max(ok_lat) if ok_lat else 0.0,
+        "cache_hits": hits,
+    }
+
+
+def closed_saturation(rows, min_gain: float, max_fail_rate: float):
+    # The last concurrency that still bought throughput: beyond it, throughput
+    # grows by less than min_gain or requests start failing.
+    for prev, cur in zip(rows, rows[1:]):
+        if cur["fail_rate"] > max_fail_rate or cur["throughput"] < prev["throughput"] * (1.0 + min_gain):
+            return prev
+    return None
+
+
+def open_saturation(rows, max_fail_rate: float):
+    # The first offered rate the server could not keep up with.
+    for r in rows:
+        if r["fail_rate"] > max_fail_rate or r["throughput"] < 0.9 * r["level"]:
+            return r
+    return None
+
+
+def table(rows, level_name: str):
+    lines = []
+    lines.append(f"| {level_name} | requests | ok | 429 | timeouts | errors | throughput | p50 | p95 | p99 | max | cache hits |")
+    lines.append("|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|")
+    for r in rows:
+        lines.append(
+            f"| {r['level']:g} | {r['requests']} | {r['ok']} | {r['rejected']} | {r['timeouts']} | {r['errors']} | "
+            f"{r['throughput']:.2f}/s | {r['p50']:.3f}s | {r['p95']:.3f}s | {r['p99']:.3f}s | {r['max']:.3f}s | {r['cache_hits']} |"
+        )
+    lines.append("")
+    return lines
+
+
+def in_process_client(timeout_sec: float):
+    # Imports the API and drives it through httpx's ASGI transport: no socket,
+    # no uvicorn. Models are loaded before the first level is timed.
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    from app import main
+
+    main.preload()
+    main.startup()
+    transport = httpx.ASGITransport(app=main.app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://in-process", timeout=timeout_sec)
+    return main, client
+
+
+def clear_caches(main):
+    if main is None:
+        return
+    main.answer_cache.clear()
+    if main.query_cache is not None:
+        main.query_cache.cache.clear()
+
+
+async def run(args):
+    tasks = [t for t in read_jsonl(Path(args.in_file)) if "query" in t]
+    n = args.requests if args.requests > 0 else len(tasks)
+    payloads = build_payloads(tasks, n, args.top_k, args.cite_k)
+    concurrency = parse_levels(args.concurrency, int)
+    qps = parse_levels(args.qps, float)
+
+    main = None
+    if args.in_process:
+        main, client = in_process_client(args.timeout_sec)
+        target = "in-process (ASGI transport)"
+    else:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=max(concurrency + [16]))
+        client = httpx.AsyncClient(base_url=args.api, timeout=args.timeout_sec, limits=limits)
+        target = args.api
+
+    closed_rows = []
+    open_rows = []
+    try:
+        for p in payloads[:args.warmup]:
+            await send(client, p, args.timeout_sec)
+
+        for c in concurrency:
+            if not args.keep_cache:
+                clear_caches(main)
+            h0 = await cache_hits(client)
+            samples, wall = await run_closed(client, payloads, c, args.timeout_sec)
+            closed_rows.append(summarize("closed", c, samples, wall, await cache_hits(client) - h0))
+            r = closed_rows[-1]
+            print(f"concurrency={c} throughput={r['throughput']:.3f} p50={r['p50']:.3f} p95={r['p95']:.3f} p99={r['p99']:.3f} fail_rate={r['fail_rate']:.3f}")
+
+        for rate in qps:
+            if not args.keep_cache:
+                clear_caches(main)
+            h0 = await cache_hits(client)
+            samples, wall = await run_open(client, payloads, rate, args.timeout_sec)
+            open_rows.append(summarize("open", rate, samples, wall, await cache_hits(client) - h0))
+            r = open_rows[-1]
+            print(f"qps={rate:g} throughput={r['throughput']:.3f} p50={r['p50']:.3f} p95={r['p95']:.3f} p99={r['p99']:.3f} fail_rate={r['fail_rate']:.3f}")
+    finally:
+        await client.aclose()
+        if main is not None:
+            main.shutdown()
+
+    closed_sat = closed_saturation(closed_rows, args.min_gain, args.max_fail_rate)
+    open_sat = open_saturation(open_rows, args.max_fail_rate)
+
+    lines = []
+    lines.append("# Load Test Report")
+    lines.append("")
+    lines.append(f"- Target: **{target}**")
+    lines.append(f"- Queries: **{len(tasks)}** from `{args.in_file}`")
+    lines.append(f"- Requests per level: **{n}** (warmup {args.warmup})")
+    if main is not None:
+        lines.append(f"- Answer/query caches: **{'kept' if args.keep_cache else 'cleared before each level'}**")
+    lines.append("- Latency percentiles are over successful (200) requests; throughput counts successful requests only.")
+    lines.append("")
+    if closed_rows:
+        lines.append("## Closed loop (fixed concurrency)")
+        lines.append("")
+        lines.extend(table(closed_rows, "concurrency"))
+        if closed_sat is not None:
+            lines.append(f"Saturation: **concurrency {closed_sat['level']}** ({closed_sat['throughput']:.2f}/s). "
+                         f"More clients add less than {args.min_gain:.0%} throughput or fail over {args.max_fail_rate:.0%} of requests.")
+        else:
+            lines.append("Saturation: not reached at the tested concurrency levels.")
+        lines.append("")
+    if open_rows:
+        lines.append("## Open loop (fixed arrival rate)")
+        lines.append("")
+        lines.extend(table(open_rows, "qps"))
+        if open_sat is not None:
+            lines.append(f"Saturation: **{open_sat['level']:g} qps** (served {open_sat['throughput']:.2f}/s, "
+                         f"fail rate {open_sat['fail_rate']:.3f}).")
+        else:
+            lines.append("Saturation: not reached at the tested arrival rates.")
+        lines.append("")
+
+    Path(args.out_report).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.out_report).write_text("\n".join(lines), encoding="utf-8")
+    if args.out_run:
+        Path(args.out_run).parent.mkdir(parents=True, exist_ok=True)
+        with Path(args.out_run).open("w", encoding="utf-8") as f:
+            for r in closed_rows + open_rows:
+                f.write(json.dumps(r) + "\n")
+        print(f"wrote: {args.out_run}")
+
+    print(f"wrote: {args.out_report}")
+    if closed_sat is not None:
+        print(f"saturation_concurrency={closed_sat['level']}")
+    if open_sat is not None:
+        print(f"saturation_qps={open_sat['level']:g}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--api", default="http://localhost:8000")
+    ap.add_argument("--in_process", action="store_true")
+    ap.add_argument("--in_file", default="eval/questions.jsonl")
+    ap.add_argument("--out_report", default="eval/load_report.md")
+    ap.add_argument("--out_run", default="")
+
+    ap.add_argument("--concurrency", default="1,2,4,8")
+    ap.add_argument("--qps", default="")
+    ap.add_argument("--requests", type=int, default=0)
+    ap.add_argument("--warmup", type=int, default=2)
+    ap.add_argument("--keep_cache", action="store_true")
+
+    ap.add_argument("--top_k", type=int, default=10)
+    ap.add_argument("--cite_k", type=int, default=2)
+    ap.add_argument("--timeout_sec", type=float, default=120)
+
+    ap.add_argument("--min_gain", type=float, default=0.10)
+    ap.add_argument("--max_fail_rate", type=float, default=0.01)
+    args = ap.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
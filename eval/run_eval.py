@@ -1,11 +1,28 @@
 import argparse
+import itertools
 import json
+import sys
+import threading
 import time
 from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import requests
 
+ROOT = Path(__file__).resolve().parents[1]
+
+# AskRequest fields that --grid can sweep.
+GRID_PARAMS = {
+    "top_k": int,
+    "cite_k": int,
+    "min_score": float,
+    "max_context_chars": int,
+    "max_chunk_chars": int,
+    "max_new_tokens": int,
+    "sparse_weight": float,
+}
+
 
 def read_jsonl(path: Path):
     rows = []
@@ -73,26 +90,244 @@ def percentile(values, p):
     return float(d0 + d1)
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--api", default="http://localhost:8000")
-    ap.add_argument("--in_file", default="eval/questions.jsonl")
-    ap.add_argument("--out_run", default="eval/runs/latest.jsonl")
-    ap.add_argument("--out_report", default="eval/report.md")
-    ap.add_argument("--sleep_ms", type=int, default=0)
+def server_backend(api: str, timeout_sec: int) -> str:
+    try:
+        r = requests.get(api + "/health", timeout=timeout_sec)
+        return str(r.json().get("generator_backend", "unknown"))
+    except Exception:
+        return "unknown"
+
+
+def run_summary(rows):
+    lat = [float(r.get("latency_sec", 0.0)) for r in rows]
+    n = len(rows)
+    passed = sum(1 for r in rows if r.get("passed"))
+    return {
+        "pass_rate": passed / n if n > 0 else 0.0,
+        "passed": passed,
+        "total": n,
+        "lat_avg": sum(lat) / n if n > 0 else 0.0,
+        "lat_p95": percentile(lat, 95),
+    }
+
+
+def compare_to_baseline(run_rows, base_rows, label: str):
+    # Pairs tasks by id; answers are compared on answer_preview, which both
+    # runs record the same way.
+    base_by_id = {r["id"]: r for r in base_rows}
+    pairs = [(r, base_by_id[r["id"]]) for r in run_rows if r["id"] in base_by_id]
+    same_pass = sum(1 for r, b in pairs if bool(r["passed"]) == bool(b["passed"]))
+    same_answer = sum(1 for r, b in pairs if r.get("answer_preview", "") == b.get("answer_preview", ""))
+    regressions = [r["id"] for r, b in pairs if b["passed"] and not r["passed"]]
+    fixes = [r["id"] for r, b in pairs if r["passed"] and not b["passed"]]
+
+    base_label = str(base_rows[0].get("backend", "baseline")) if base_rows else "baseline"
+    cur = run_summary([r for r, _ in pairs])
+    base = run_summary([b for _, b in pairs])
+    n = len(pairs)
 
-    ap.add_argument("--top_k", type=int, default=10)
-    ap.add_argument("--cite_k", type=int, default=2)
-    ap.add_argument("--include_evidence", action="store_true")
+    lines = []
+    lines.append("## Backend comparison")
+    lines.append("")
+    lines.append("| run | backend | pass rate | lat avg | lat p95 |")
+    lines.append("|---|---|---:|---:|---:|")
+    lines.append(f"| baseline | {base_label} | {base['pass_rate']:.3f} | {base['lat_avg']:.3f}s | {base['lat_p95']:.3f}s |")
+    lines.append(f"| this run | {label} | {cur['pass_rate']:.3f} | {cur['lat_avg']:.3f}s | {cur['lat_p95']:.3f}s |")
+    lines.append("")
+    lines.append(f"- Tasks compared: **{n}**")
+    lines.append(f"- Same pass/fail as baseline: **{same_pass}/{n}**")
+    lines.append(f"- Same answer as baseline: **{same_answer}/{n}**")
+    lines.append(f"- Newly failing: {', '.join(regressions) if regressions else '_none_'}")
+    lines.append(f"- Newly passing: {', '.join(fixes) if fixes else '_none_'}")
+    lines.append("")
 
-    ap.add_argument("--min_words", type=int, default=8)
-    ap.add_argument("--timeout_sec", type=int, default=120)
-    ap.add_argument("--fail_examples", type=int, default=12)
-    args = ap.parse_args()
+    stats = {
+        "baseline_pass_rate": base["pass_rate"],
+        "baseline_lat_avg": base["lat_avg"],
+        "pass_agreement": same_pass / n if n > 0 else 0.0,
+        "answer_agreement": same_answer / n if n > 0 else 0.0,
+        "regressions": len(regressions),
+    }
+    return lines, stats
 
-    tasks = read_jsonl(Path(args.in_file))
 
-    run_rows = []
+def is_abstain(abstained: bool, answer: str) -> bool:
+    return abstained or strip_citations(answer) == "ABSTAIN"
+
+
+_local = threading.local()
+
+
+def session() -> requests.Session:
+    # One pooled keep-alive session per worker thread.
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = requests.Session()
+        _local.session = s
+    return s
+
+
+def task_payload(t, args, params):
+    # Grid values override the task's own top_k/cite_k.
+    payload = {
+        "query": t["query"],
+        "top_k": int(t.get("top_k", args.top_k)),
+        "cite_k": int(t.get("cite_k", args.cite_k)),
+        "include_evidence": bool(args.include_evidence),
+    }
+    payload.update(params)
+    return payload
+
+
+def score_task(t, payload, out, http_ok: bool, http_status: int, err: str, dt: float, args, label: str):
+    must_abstain = bool(t.get("must_abstain", False))
+    expect_any_of = t.get("expect_any_of", None)
+
+    abstained = bool(out.get("abstained", False))
+    answer = out.get("answer", "")
+    citations = out.get("citations", [])
+
+    answer_stripped = strip_citations(answer)
+    wc = word_count(answer_stripped)
+
+    ok = True
+    reason = "ok"
+
+    if not http_ok or http_status >= 400:
+        ok = False
+        reason = "http_error"
+    else:
+        if must_abstain:
+            if not is_abstain(abstained, answer):
+                ok = False
+                reason = "should_abstain_but_answered"
+        else:
+            if is_abstain(abstained, answer):
+                ok = False
+                reason = "abstained_unexpectedly"
+            else:
+                if not isinstance(citations, list) or len(citations) == 0:
+                    ok = False
+                    reason = "missing_citations"
+                if ok and wc < args.min_words:
+                    ok = False
+                    reason = "too_short_answer"
+                if ok and expect_any_of is not None:
+                    if not contains_any(answer_stripped, expect_any_of):
+                        ok = False
+                        reason = "keyword_miss"
+
+    return {
+        "id": t["id"],
+        "category": t.get("category", "unknown"),
+        "query": t["query"],
+        "must_abstain": must_abstain,
+        "passed": ok,
+        "reason": reason,
+        "latency_sec": dt,
+        "http_ok": http_ok,
+        "http_status": http_status,
+        "error": err,
+        "abstained": abstained,
+        "citations": citations,
+        "word_count": wc,
+        "top_k": payload["top_k"],
+        "cite_k": payload["cite_k"],
+        "answer_preview": answer[:220],
+        "backend": label,
+    }
+
+
+def eval_task(t, args, label: str):
+    payload = task_payload(t, args, {})
+
+    t0 = time.time()
+    http_ok = True
+    http_status = 0
+    err = ""
+
+    try:
+        r = session().post(args.api + "/ask", json=payload, timeout=args.timeout_sec)
+        http_status = int(r.status_code)
+        out = r.json()
+    except Exception as e:
+        http_ok = False
+        out = {}
+        err = str(e)
+
+    dt = time.time() - t0
+
+    if args.sleep_ms > 0:
+        time.sleep(args.sleep_ms / 1000.0)
+
+    return score_task(t, payload, out, http_ok, http_status, err, dt, args, label)
+
+
+def load_resume(path: Path):
+    # Rows already in out_run, by id (last one wins). http_error rows are
+    # dropped so a resumed run retries them.
+    done = {}
+    if not path.exists():
+        return done
+    for r in read_jsonl(path):
+        if r.get("reason") == "http_error":
+            done.pop(r["id"], None)
+        else:
+            done[r["id"]] = r
+    return done
+
+
+def run_tasks(tasks, args, label: str, done):
+    # Rows are appended to out_run as they complete, so a crashed run can be
+    # resumed; the file is rewritten in task order at the end.
+    out_path = Path(args.out_run)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    rows = dict(done)
+    todo = [t for t in tasks if t["id"] not in rows]
+    lock = threading.Lock()
+
+    with out_path.open("w", encoding="utf-8") as f:
+        for t in tasks:
+            if t["id"] in rows:
+                f.write(json.dumps(rows[t["id"]], ensure_ascii=False) + "\n")
+        f.flush()
+
+        def record(row):
+            with lock:
+                rows[row["id"]] = row
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+
+        if args.concurrency <= 1:
+            for t in todo:
+                record(eval_task(t, args, label))
+        else:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+                futs = [ex.submit(eval_task, t, args, label) for t in todo]
+                for fut in as_completed(futs):
+                    record(fut.result())
+
+    run_rows = [rows[t["id"]] for t in tasks]
+    write_jsonl(out_path, run_rows)
+    return run_rows, len(todo)
+
+
+def print_summary(summary, label: str, compare_stats):
+    print(f"overall_pass_rate={summary['pass_rate']:.3f}")
+    print(f"citation_coverage={summary['citation_coverage']:.3f}")
+    print(f"abstain_rate={summary['abstain_rate']:.3f}")
+    print(f"lat_avg={summary['lat_avg']:.3f}")
+    print(f"lat_p95={summary['lat_p95']:.3f}")
+    print(f"backend={label}")
+    if compare_stats is not None:
+        print(f"baseline_pass_rate={compare_stats['baseline_pass_rate']:.3f}")
+        print(f"baseline_lat_avg={compare_stats['baseline_lat_avg']:.3f}")
+        print(f"pass_agreement={compare_stats['pass_agreement']:.3f}")
+        print(f"answer_agreement={compare_stats['answer_agreement']:.3f}")
+        print(f"regressions={compare_stats['regressions']}")
+
+
+def summarize_rows(run_rows):
     fail_modes = Counter()
 
     totals = 0
@@ -107,151 +342,73 @@ def main():
 
     latencies = []
 
-    for t in tasks:
-        tid = t["id"]
-        cat = t.get("category", "unknown")
-        q = t["query"]
-        must_abstain = bool(t.get("must_abstain", False))
-        expect_any_of = t.get("expect_any_of", None)
-
-        top_k = int(t.get("top_k", args.top_k))
-        cite_k = int(t.get("cite_k", args.cite_k))
-
-        payload = {
-            "query": q,
-            "top_k": top_k,
-            "cite_k": cite_k,
-            "include_evidence": bool(args.include_evidence),
-        }
-
-        t0 = time.time()
-        http_ok = True
-        http_status = 0
-        err = ""
-
-        try:
-            r = requests.post(args.api + "/ask", json=payload, timeout=args.timeout_sec)
-            http_status = int(r.status_code)
-            out = r.json()
-        except Exception as e:
-            http_ok = False
-            out = {}
-            err = str(e)
-
-        dt = time.time() - t0
-        latencies.append(dt)
-
-        abstained = bool(out.get("abstained", False))
-        answer = out.get("answer", "")
-        citations = out.get("citations", [])
+    for r in run_rows:
+        cat = r["category"]
+        citations = r["citations"]
+        latencies.append(float(r["latency_sec"]))
 
         totals += 1
         cat_tot[cat] += 1
 
-        answer_stripped = strip_citations(answer)
-        wc = word_count(answer_stripped)
-
-        if abstained or answer_stripped == "ABSTAIN":
+        if is_abstain(r["abstained"], r["answer_preview"]):
             abstain_cnt += 1
         else:
             answered_cnt += 1
             if isinstance(citations, list) and len(citations) > 0:
                 answered_with_cites += 1
 
-        ok = True
-        reason = "ok"
-
-        if not http_ok or http_status >= 400:
-            ok = False
-            reason = "http_error"
-            fail_modes[reason] += 1
-        else:
-            if must_abstain:
-                if not (abstained or answer_stripped == "ABSTAIN"):
-                    ok = False
-                    reason = "should_abstain_but_answered"
-                    fail_modes[reason] += 1
-            else:
-                if abstained or answer_stripped == "ABSTAIN":
-                    ok = False
-                    reason = "abstained_unexpectedly"
-                    fail_modes[reason] += 1
-                else:
-                    if not isinstance(citations, list) or len(citations) == 0:
-                        ok = False
-                        reason = "missing_citations"
-                        fail_modes[reason] += 1
-                    if ok and wc < args.min_words:
-                        ok = False
-                        reason = "too_short_answer"
-                        fail_modes[reason] += 1
-                    if ok and expect_any_of is not None:
-                        if not contains_any(answer_stripped, expect_any_of):
-                            ok = False
-                            reason = "keyword_miss"
-                            fail_modes[reason] += 1
-
-        if ok:
+        if r["passed"]:
             passed += 1
             cat_pass[cat] += 1
-
-        run_rows.append({
-            "id": tid,
-            "category": cat,
-            "query": q,
-            "must_abstain": must_abstain,
-            "passed": ok,
-            "reason": reason,
-            "latency_sec": dt,
-            "http_ok": http_ok,
-            "http_status": http_status,
-            "error": err,
-            "abstained": abstained,
-            "citations": citations,
-            "word_count": wc,
-            "top_k": top_k,
-            "cite_k": cite_k,
-            "answer_preview": answer[:220]
-        })
-
-        if args.sleep_ms > 0:
-            time.sleep(args.sleep_ms / 1000.0)
-
-    Path(args.out_run).parent.mkdir(parents=True, exist_ok=True)
-    write_jsonl(Path(args.out_run), run_rows)
+        else:
+            fail_modes[r["reason"]] += 1
 
     citation_coverage = 0.0
     if answered_cnt > 0:
         citation_coverage = answered_with_cites / answered_cnt
 
-    abstain_rate = abstain_cnt / totals if totals > 0 else 0.0
-    pass_rate = passed / totals if totals > 0 else 0.0
-
-    lat_avg = sum(latencies) / len(latencies) if len(latencies) > 0 else 0.0
-    lat_p95 = percentile(latencies, 95)
-
+    return {
+        "totals": totals,
+        "passed": passed,
+        "pass_rate": passed / totals if totals > 0 else 0.0,
+        "cat_tot": cat_tot,
+        "cat_pass": cat_pass,
+        "answered_cnt": answered_cnt,
+        "answered_with_cites": answered_with_cites,
+        "citation_coverage": citation_coverage,
+        "abstain_cnt": abstain_cnt,
+        "abstain_rate": abstain_cnt / totals if totals > 0 else 0.0,
+        "lat_avg": sum(latencies) / len(latencies) if len(latencies) > 0 else 0.0,
+        "lat_p95": percentile(latencies, 95),
+        "fail_modes": fail_modes,
+    }
+
+
+def report_lines(run_rows, s, label: str, args, compare_lines):
     lines = []
     lines.append("# Eval Report")
     lines.append("")
-    lines.append(f"- Total tasks: **{totals}**")
-    lines.append(f"- Overall pass rate: **{pass_rate:.3f}** ({passed}/{totals})")
-    lines.append(f"- Abstain rate: **{abstain_rate:.3f}** ({abstain_cnt}/{totals})")
-    lines.append(f"- Citation coverage (when answered): **{citation_coverage:.3f}** ({answered_with_cites}/{answered_cnt})")
-    lines.append(f"- Latency avg: **{lat_avg:.3f}s**, p95: **{lat_p95:.3f}s**")
+    lines.append(f"- Generator backend: **{label}**")
+    lines.append(f"- Total tasks: **{s['totals']}**")
+    lines.append(f"- Overall pass rate: **{s['pass_rate']:.3f}** ({s['passed']}/{s['totals']})")
+    lines.append(f"- Abstain rate: **{s['abstain_rate']:.3f}** ({s['abstain_cnt']}/{s['totals']})")
+    lines.append(f"- Citation coverage (when answered): **{s['citation_coverage']:.3f}** ({s['answered_with_cites']}/{s['answered_cnt']})")
+    lines.append(f"- Latency avg: **{s['lat_avg']:.3f}s**, p95: **{s['lat_p95']:.3f}s**")
     lines.append("")
     lines.append("## Per-category pass rate")
     lines.append("")
     lines.append("| category | pass | total | rate |")
     lines.append("|---|---:|---:|---:|")
-    for cat in sorted(cat_tot.keys()):
-        tot = cat_tot[cat]
-        pas = cat_pass.get(cat, 0)
+    for cat in sorted(s["cat_tot"].keys()):
+        tot = s["cat_tot"][cat]
+        pas = s["cat_pass"].get(cat, 0)
         rate = pas / tot if tot > 0 else 0.0
         lines.append(f"| {cat} | {pas} | {tot} | {rate:.3f} |")
     lines.append("")
+    lines.extend(compare_lines)
     lines.append("## Top failure modes")
     lines.append("")
-    for k, v in fail_modes.most_common(10):
+    for k, v in s["fail_modes"].most_common(10):
         lines.append(f"- **{k}**: {v}")
     lines.append("")
     lines.append(f"## Example failures (first {args.fail_examples})")
@@ -266,15 +423,216 @@ def main():
             if shown >= args.fail_examples:
                 break
     lines.append("")
-    Path(args.out_report).write_text("\n".join(lines), encoding="utf-8")
+    return lines
+
+
+def parse_grid(specs):
+    # ["top_k=5,10", "min_score=0.3,0.35"] -> one params dict per point of the
+    # cartesian product; no specs -> a single point with no overrides.
+    axes = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        name = name.strip()
+        if name not in GRID_PARAMS:
+            raise SystemExit(f"unknown grid param: {name} (one of {', '.join(GRID_PARAMS)})")
+        axes.append([(name, GRID_PARAMS[name](v)) for v in values.split(",") if v.strip() != ""])
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+
+def format_params(params) -> str:
+    return " ".join(f"{k}={v}" for k, v in params.items()) or "defaults"
+
+
+def load_pipeline():
+    # Imports the API module and loads the index and both models once.
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    from app import main
+
+    main.preload()
+    return main
+
+
+def cache_across_points(main):
+    # Query embeddings are already cached by main.query_cache. On top of that,
+    # search results are memoized per (query, top_k, search params) and
+    # answers per generator job (prompt, max_new_tokens, beams), so grid
+    # points that only change cite_k or min_score reuse earlier generations.
+    # Decoding is deterministic, so a cached answer is the one generate()
+    # would return.
+    search = main.search_queries
+    generate = main.run_generation
+    searched = {}
+    generated = {}
+
+    def search_queries(qvec, reqs, idx_snap, info_snap, sparse_snap=None):
+        keys = [(r.query.strip(), r.top_k, r.nprobe, r.ef_search, r.sparse_weight) for r in reqs]
+        miss = [i for i, k in enumerate(keys) if k not in searched]
+        if len(miss) > 0:
+            D, I, top = search(qvec[miss], [reqs[i] for i in miss], idx_snap, info_snap, sparse_snap)
+            for j, i in enumerate(miss):
+                searched[keys[i]] = (D[j], I[j], top[j])
+        hits = [searched[k] for k in keys]
+        return [h[0] for h in hits], [h[1] for h in hits], [h[2] for h in hits]
+
+    def run_generation(jobs, deadlines, encoder_cache=None):
+        miss = [job for job in jobs if job[1:] not in generated]
+        out = generate(miss, deadlines, encoder_cache)
+        for job in miss:
+            generated[job[1:]] = out[job[0]]
+        return {job[0]: generated[job[1:]] for job in jobs}
+
+    main.search_queries = search_queries
+    main.run_generation = run_generation
+
+
+def eval_point(main, tasks, args, label: str, params):
+    # Questions go through answer_requests in batches, as the micro-batcher
+    # would send them; each row's latency is its batch's wall time.
+    rows = []
+    for start in range(0, len(tasks), args.batch_size):
+        batch = tasks[start:start + args.batch_size]
+        payloads = [task_payload(t, args, params) for t in batch]
+        t0 = time.time()
+        outs = main.answer_requests([main.AskRequest(**p) for p in payloads])
+        dt = time.time() - t0
+        for t, p, out in zip(batch, payloads, outs):
+            row = score_task(t, p, out, True, 200, "", dt, args, label)
+            row["params"] = params
+            rows.append(row)
+    return rows
+
+
+def sweep_report_lines(points, label: str, args):
+    names = list(points[0][0].keys())
+    cats = sorted({c for _, _, s in points for c in s["cat_tot"].keys()})
+    best = max(points, key=lambda p: p[2]["pass_rate"])
+
+    lines = []
+    lines.append("# Parameter Sweep Report")
+    lines.append("")
+    lines.append(f"- Generator backend: **{label}**")
+    lines.append(f"- Tasks per point: **{best[2]['totals']}**, grid points: **{len(points)}**")
+    lines.append(f"- Best pass rate: **{best[2]['pass_rate']:.3f}** at `{format_params(best[0])}`")
+    lines.append(f"- Latency is the wall time of each in-process batch of {args.batch_size}; searches and generations")
+    lines.append("  repeated across points are served from memory, so later points run faster.")
+    lines.append("")
+    lines.append("## Grid")
+    lines.append("")
+    header = names + ["pass rate", "abstain rate", "citation coverage"] + cats + ["lat avg", "wall"]
+    lines.append("| " + " | ".join(header) + " |")
+    lines.append("|" + "|".join(["---"] * len(names) + ["---:"] * (len(header) - len(names))) + "|")
+    for params, _, s in points:
+        cells = [str(params[n]) for n in names]
+        cells.append(f"{s['pass_rate']:.3f}")
+        cells.append(f"{s['abstain_rate']:.3f}")
+        cells.append(f"{s['citation_coverage']:.3f}")
+        for c in cats:
+            tot = s["cat_tot"].get(c, 0)
+            cells.append(f"{s['cat_pass'].get(c, 0) / tot:.3f}" if tot > 0 else "-")
+        cells.append(f"{s['lat_avg']:.3f}s")
+        cells.append(f"{s['wall_sec']:.1f}s")
+        lines.append("| " + " | ".join(cells) + " |")
+    lines.append("")
+    lines.append("## Top failure modes per point")
+    lines.append("")
+    for params, _, s in points:
+        modes = ", ".join(f"{k}: {v}" for k, v in s["fail_modes"].most_common(5)) or "_none_"
+        lines.append(f"- `{format_params(params)}`: {modes}")
+    lines.append("")
+    return lines
+
+
+def run_in_process(tasks, args):
+    if args.resume:
+        raise SystemExit("--resume is not supported with --in_process")
+    main = load_pipeline()
+    label = args.label or main.GEN_BACKEND
+    cache_across_points(main)
+
+    points = []
+    all_rows = []
+    try:
+        for params in parse_grid(args.grid):
+            t0 = time.time()
+            rows = eval_point(main, tasks, args, label, params)
+            s = summarize_rows(rows)
+            s["wall_sec"] = time.time() - t0
+            points.append((params, rows, s))
+            all_rows.extend(rows)
+            print(f"params={format_params(params)} pass_rate={s['pass_rate']:.3f} wall_sec={s['wall_sec']:.1f}")
+    finally:
+        main.shutdown()
+
+    Path(args.out_run).parent.mkdir(parents=True, exist_ok=True)
+    write_jsonl(Path(args.out_run), all_rows)
+    print(f"wrote: {args.out_run}")
+
+    if len(points) == 1:
+        run_rows, summary = points[0][1], points[0][2]
+        compare_stats = None
+        compare_lines = []
+        if args.baseline_run:
+            compare_lines, compare_stats = compare_to_baseline(run_rows, read_jsonl(Path(args.baseline_run)), label)
+        Path(args.out_report).write_text("\n".join(report_lines(run_rows, summary, label, args, compare_lines)), encoding="utf-8")
+        print(f"wrote: {args.out_report}")
+        print_summary(summary, label, compare_stats)
+        return
+
+    Path(args.out_report).write_text("\n".join(sweep_report_lines(points, label, args)), encoding="utf-8")
+    best = max(points, key=lambda p: p[2]["pass_rate"])
+    print(f"wrote: {args.out_report}")
+    print(f"grid_points={len(points)}")
+    print(f"best_params={format_params(best[0])}")
+    print(f"best_pass_rate={best[2]['pass_rate']:.3f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--api", default="http://localhost:8000")
+    ap.add_argument("--in_file", default="eval/questions.jsonl")
+    ap.add_argument("--out_run", default="eval/runs/latest.jsonl")
+    ap.add_argument("--out_report", default="eval/report.md")
+    ap.add_argument("--sleep_ms", type=int, default=0)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--resume", action="store_true")
+    ap.add_argument("--in_process", action="store_true")
+    ap.add_argument("--grid", nargs="*", default=[])
+    ap.add_argument("--batch_size", type=int, default=8)
+
+    ap.add_argument("--top_k", type=int, default=10)
+    ap.add_argument("--cite_k", type=int, default=2)
+    ap.add_argument("--include_evidence", action="store_true")
+
+    ap.add_argument("--min_words", type=int, default=8)
+    ap.add_argument("--timeout_sec", type=int, default=120)
+    ap.add_argument("--fail_examples", type=int, default=12)
+    ap.add_argument("--label", default="")
+    ap.add_argument("--baseline_run", default="")
+    args = ap.parse_args()
+
+    tasks = read_jsonl(Path(args.in_file))
+    if args.in_process:
+        run_in_process(tasks, args)
+        return
+
+    # Runs are labelled with the server's generator backend unless --label is set.
+    label = args.label or server_backend(args.api, args.timeout_sec)
+
+    done = load_resume(Path(args.out_run)) if args.resume else {}
+    run_rows, sent = run_tasks(tasks, args, label, done)
+
+    summary = summarize_rows(run_rows)
+    compare_stats = None
+    compare_lines = []
+    if args.baseline_run:
+        compare_lines, compare_stats = compare_to_baseline(run_rows, read_jsonl(Path(args.baseline_run)), label)
+    Path(args.out_report).write_text("\n".join(report_lines(run_rows, summary, label, args, compare_lines)), encoding="utf-8")
 
     print(f"wrote: {args.out_run}")
+    print(f"sent={sent} resumed={len(run_rows) - sent}")
     print(f"wrote: {args.out_report}")
-    print(f"overall_pass_rate={pass_rate:.3f}")
-    print(f"citation_coverage={citation_coverage:.3f}")
-    print(f"abstain_rate={abstain_rate:.3f}")
-    print(f"lat_avg={lat_avg:.3f}")
-    print(f"lat_p95={lat_p95:.3f}")
+    print_summary(summary, label, compare_stats)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import json
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ACRONYM_FILE = "acronyms.json"
+MAX_CITES = 3
+MAX_WORDS = 12
+
+# "... Information Security Continuous Monitoring (ISCM) ..."
+PAREN_RE = re.compile(r"\(\s*([A-Za-z][A-Za-z0-9&\-]{1,11})\s*\)")
+WORD_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9\-/']*")
+# Words an acronym usually skips: "Internet of Things" -> IoT.
+SMALL_WORDS = frozenset("a an and for in of on or the to with".split())
+
+TERM = r"([A-Za-z][A-Za-z0-9&\-]{1,14})"
+DEFINITION_QUERIES = [
+    re.compile(rf"^what\s+does\s+(?:the\s+)?(?:acronym\s+|abbreviation\s+)?{TERM}\s+stand\s+for\b", re.IGNORECASE),
+    re.compile(rf"^what\s+(?:is|are)\s+the\s+(?:meaning|expansion|full\s+form)\s+of\s+(?:the\s+)?(?:acronym\s+)?{TERM}\b", re.IGNORECASE),
+    re.compile(rf"^(?:define|expand)\s+(?:the\s+)?(?:acronym\s+)?{TERM}\W*$", re.IGNORECASE),
+    re.compile(rf"^{TERM}\s+stands\s+for\s+what\b", re.IGNORECASE),
+]
+# "What is ISCM?" asks for a definition only when nothing else follows.
+BARE_QUERY = re.compile(rf"^what(?:\s+is|\s+are|'s)\s+(?:an?\s+)?{TERM}\s*\??$", re.IGNORECASE)
+
+
+def acronym_letters(acronym: str) -> str:
+    return "".join(c for c in acronym if c.isupper() or c.isdigit())
+
+
+def is_acronym(token: str) -> bool:
+    return len(acronym_letters(token)) >= 2
+
+
+def initials(words: List[str]) -> str:
+    out = []
+    for w in words:
+        for part in re.split(r"[-/]", w):
+            if part and part.lower() not in SMALL_WORDS:
+                out.append(part[0].upper())
+    return "".join(out)
+
+
+def trim_expansion(acronym: str, before: str) -> Optional[str]:
+    # The shortest run of words right before "(ACR)" whose initials spell the
+    # acronym; None when no run matches, so stray parentheses are skipped.
+    letters = acronym_letters(acronym)
+    words = WORD_RE.findall(before)[-MAX_WORDS:]
+    for n in range(1, len(words) + 1):
+        cand = words[-n:]
+        if cand[0].lower() in SMALL_WORDS:
+            continue
+        got = initials(cand)
+        if got == letters:
+            return " ".join(cand)
+        if len(got) > len(letters):
+            break
+    return None
+
+
+def sentence_around(text: str, start: int, end: int, max_chars: int = 260) -> str:
+    a = text.rfind(". ", 0, start)
+    a = 0 if a == -1 else a + 2
+    if start - a > max_chars:
+        # Too far back: start at a word boundary instead of mid-word.
+        a = text.find(" ", start - max_chars, start) + 1
+    b = text.find(". ", end)
+    b = len(text) if b == -1 else b + 1
+    s = re.sub(r"\s+", " ", text[a:b]).strip()
+    if len(s) > max_chars:
+        s = s[:max_chars].rstrip() + " ..."
+    return s
+
+
+def extract_definitions(text: str) -> List[Tuple[str, str, str]]:
+    # (acronym, expansion, context sentence) for every "Expansion (ACR)".
+    out = []
+    for m in PAREN_RE.finditer(text):
+        acronym = m.group(1)
+        if not is_acronym(acronym):
+            continue
+        before = text[max(0, m.start() - 200):m.start()]
+        exp = trim_expansion(acronym, before)
+        if exp is None:
+            continue
+        out.append((acronym, exp, sentence_around(text, m.start(), m.end())))
+    return out
+
+
+class AcronymTableBuilder:
+    # Collects every definition seen in the corpus; table() keeps the most
+    # frequent expansion per acronym with up to MAX_CITES citing chunks.
+
+    def __init__(self):
+        self.seen: Dict[str, Counter] = {}
+        self.first: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def add(self, row_idx: int, row: Dict[str, Any]):
+        cite = f"{row.get('doc_id', '')}:{row.get('chunk_id', '')}"
+        for acronym, exp, context in extract_definitions(row.get("text", "")):
+            key = exp.lower()
+            self.seen.setdefault(acronym, Counter())[key] += 1
+            ent = self.first.get((acronym, key))
+            if ent is None:
+                ent = {"expansion": exp, "context": context, "cites": [], "rows": []}
+                self.first[(acronym, key)] = ent
+            if len(ent["cites"]) < MAX_CITES and cite not in ent["cites"]:
+                ent["cites"].append(cite)
+                ent["rows"].append(int(row_idx))
+
+    def table(self) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for acronym in sorted(self.seen):
+            key, count = self.seen[acronym].most_common(1)[0]
+            ent = dict(self.first[(acronym, key)])
+            ent["count"] = count
+            out[acronym] = ent
+        return out
+
+    def write(self, path: Path) -> Dict[str, Any]:
+        table = self.table()
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps({"entries": table}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        return {"file": path.name, "entries": len(table)}
+
+
+def write_acronyms(path: Path, rows) -> Dict[str, Any]:
+    b = AcronymTableBuilder()
+    for i, r in enumerate(rows):
+        b.add(i, r)
+    return b.write(path)
+
+
+def load_acronyms(index_dir: Path, info: Dict[str, Any]) -> Optional[Dict[str, Dict[str, Any]]]:
+    spec = info.get("acronyms")
+    if not spec:
+        return None
+    path = Path(index_dir) / spec.get("file", ACRONYM_FILE)
+    if not path.exists():
+        return None
+    return acronym_lookup(json.loads(path.read_text(encoding="utf-8")).get("entries", {}))
+
+
+def acronym_lookup(entries: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    # Exact spelling first, then case-insensitive ("iscm" -> "ISCM").
+    folded = {}
+    for k, v in entries.items():
+        folded.setdefault(k.lower(), (k, v))
+    return {"entries": entries, "folded": folded}
+
+
+def lookup_acronym(table: Optional[Dict[str, Any]], acronym: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    if table is None:
+        return None
+    ent = table["entries"].get(acronym)
+    if ent is not None:
+        return acronym, ent
+    return table["folded"].get(acronym.lower())
+
+
+def definition_acronym(q: str) -> Optional[str]:
+    # The acronym a definition question asks about, or None for any other
+    # question (so "What is the purpose of an ISCM strategy?" is not one).
+    # The term must look like an acronym in every form, or "What does it
+    # stand for?" would find IT through the case-folded lookup.
+    t = q.strip()
+    for pat in DEFINITION_QUERIES + [BARE_QUERY]:
+        m = pat.search(t)
+        if m and is_acronym(m.group(1)):
+            return m.group(1)
+    return None
@@ -0,0 +1,372 @@
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import faiss
+
+
+INDEX_TYPES = ["flat", "ivf", "hnsw", "ivfpq", "sq8", "binary"]
+
+NPROBE_GRID = [1, 2, 4, 8, 16, 32, 64, 128]
+EF_SEARCH_GRID = [16, 32, 64, 128, 256, 512]
+
+
+def auto_nlist(n: int) -> int:
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid.
+    nlist = int(4 * math.sqrt(max(n, 1)))
+    nlist = min(nlist, max(1, n // 39))
+    return max(1, nlist)
+
+
+def auto_pq_m(dim: int) -> int:
+    # Largest sub-quantizer count <= dim/8 that divides dim.
+    m = max(1, dim // 8)
+    while m > 1 and dim % m != 0:
+        m -= 1
+    return m
+
+
+def train_sample(emb: np.ndarray, sample_rows: int, seed: int = 0) -> np.ndarray:
+    n = emb.shape[0]
+    if sample_rows <= 0 or sample_rows >= n:
+        return emb
+    rng = np.random.default_rng(seed)
+    pick = np.sort(rng.choice(n, size=sample_rows, replace=False))
+    return np.ascontiguousarray(emb[pick])
+
+
+class BinaryIndex:
+    # One bit per dimension (32x smaller than float32), stored in a faiss
+    # IndexLSH that thresholds each dimension at its trained median. The
+    # Hamming distance h is turned into the cosine estimate cos(pi * h / d),
+    # so scores stay on the min_score scale; use rescoring for exact scores.
+
+    def __init__(self, index):
+        self.index = index
+        self.d = index.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def search(self, x: np.ndarray, k: int, params=None):
+        D, I = self.index.search(x, k)
+        return np.cos(np.pi * D / self.d).astype(np.float32), I
+
+
+class RescoredIndex:
+    # Fetches factor * k candidates from a compressed index and re-ranks them
+    # by exact inner product against float16 vectors memory-mapped from disk;
+    # only the candidate rows are read.
+
+    def __init__(self, index, vectors: np.ndarray, factor: int = 4):
+        self.index = index
+        self.vectors = vectors
+        self.factor = max(1, int(factor))
+        self.d = index.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def search(self, x: np.ndarray, k: int, params=None):
+        _, cand = self.index.search(x, k * self.factor, params=params)
+        D = np.full((x.shape[0], k), -np.inf, dtype=np.float32)
+        I = np.full((x.shape[0], k), -1, dtype=np.int64)
+        for row in range(x.shape[0]):
+            ids = np.unique(cand[row][cand[row] >= 0])
+            if ids.size == 0:
+                continue
+            scores = self.vectors[ids].astype(np.float32) @ x[row]
+            order = np.argsort(-scores, kind="stable")[:k]
+            D[row, :order.size] = scores[order]
+            I[row, :order.size] = ids[order]
+        return D, I
+
+
+def new_vector_index(index_type: str, dim: int, n: int, nlist: int = 0, pq_m: int = 0, pq_bits: int = 8,
+                     hnsw_m: int = 32, ef_construction: int = 200):
+    # An empty index of the given type, sized for n rows. Types other than
+    # flat and hnsw must be trained before vectors are added.
+    params: Dict[str, Any] = {}
+
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dim), params
+
+    if index_type == "sq8":
+        # 8-bit scalar quantization: one byte per dimension (4x smaller).
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT), params
+
+    if index_type == "binary":
+        return faiss.IndexLSH(dim, dim, False, True), params
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        params["hnsw_m"] = hnsw_m
+        params["ef_construction"] = ef_construction
+        return index, params
+
+    if index_type not in ("ivf", "ivfpq"):
+        raise ValueError(f"unknown index_type: {index_type}")
+
+    if nlist <= 0:
+        nlist = auto_nlist(n)
+    nlist = min(nlist, n)
+
+    quantizer = faiss.IndexFlatIP(dim)
+    if index_type == "ivf":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        if pq_m <= 0:
+            pq_m = auto_pq_m(dim)
+        if dim % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} must divide dim={dim}")
+        # PQ codebooks need at least 2**bits training points.
+        pq_bits = max(1, min(pq_bits, int(math.log2(max(n, 2)))))
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits, faiss.METRIC_INNER_PRODUCT)
+        params["pq_m"] = pq_m
+        params["pq_bits"] = pq_bits
+    params["nlist"] = nlist
+    return index, params
+
+
+def needs_training(index_type: str) -> bool:
+    return index_type not in ("flat", "hnsw")
+
+
+def build_vector_index(emb: np.ndarray, index_type: str, nlist: int = 0, pq_m: int = 0, pq_bits: int = 8,
+                       hnsw_m: int = 32, ef_construction: int = 200, sample_rows: int = 50000):
+    n, dim = emb.shape
+    index, params = new_vector_index(index_type, dim, n, nlist, pq_m, pq_bits, hnsw_m, ef_construction)
+    if needs_training(index_type):
+        sample = train_sample(emb, sample_rows)
+        index.train(sample)
+        params["train_rows"] = int(sample.shape[0])
+    index.add(emb)
+    if index_type == "binary":
+        return BinaryIndex(index), params
+    return index, params
+
+
+class StreamingIndexBuilder:
+    # Adds vectors batch by batch. Types that need training buffer vectors
+    # until sample_rows have arrived (all of them if sample_rows <= 0), size
+    # and train the index on that buffer, then add everything else as it
+    # comes; only the buffer is held besides the index itself. Up to
+    # sample_rows rows the result is identical to build_vector_index.
+
+    def __init__(self, index_type: str, nlist: int = 0, pq_m: int = 0, pq_bits: int = 8, hnsw_m: int = 32,
+                 ef_construction: int = 200, sample_rows: int = 50000):
+        self.index_type = index_type
+        self.opts = {"nlist": nlist, "pq_m": pq_m, "pq_bits": pq_bits, "hnsw_m": hnsw_m, "ef_construction": ef_construction}
+        self.sample_rows = int(sample_rows)
+        self.index = None
+        self.params: Dict[str, Any] = {}
+        self.buffer: List[np.ndarray] = []
+        self.buffered = 0
+
+    def add(self, emb: np.ndarray):
+        if self.index is None and not needs_training(self.index_type):
+            self.index, self.params = new_vector_index(self.index_type, emb.shape[1], 0, **self.opts)
+        if self.index is not None:
+            self.index.add(emb)
+            return
+        self.buffer.append(emb)
+        self.buffered += emb.shape[0]
+        if self.sample_rows > 0 and self.buffered >= self.sample_rows:
+            self._train()
+
+    def _train(self):
+        emb = np.concatenate(self.buffer)
+        self.buffer = []
+        self.index, self.params = new_vector_index(self.index_type, emb.shape[1], emb.shape[0], **self.opts)
+        sample = train_sample(emb, self.sample_rows)
+        self.index.train(sample)
+        self.params["train_rows"] = int(sample.shape[0])
+        self.index.add(emb)
+
+    def finish(self):
+        if self.index is None:
+            if not self.buffer:
+                raise ValueError("no vectors were added")
+            self._train()
+        if self.index_type == "binary":
+            return BinaryIndex(self.index), self.params
+        return self.index, self.params
+
+
+def default_search(index_type: str, index_params: Dict[str, Any], nprobe: int = 0, ef_search: int = 0) -> Dict[str, int]:
+    if index_type in ("ivf", "ivfpq"):
+        if nprobe <= 0:
+            nlist = int(index_params.get("nlist", 1))
+            nprobe = min(nlist, max(8, nlist // 16))
+        return {"nprobe": int(nprobe)}
+    if index_type == "hnsw":
+        if ef_search <= 0:
+            ef_search = 64
+        return {"ef_search": int(ef_search)}
+    return {}
+
+
+def search_params(info: Dict[str, Any], nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    # Per-call faiss SearchParameters so concurrent queries can use different
+    # settings without mutating the shared index.
+    if "shards" in info:
+        # Sharded index (rag/shards.py): one parameter object per shard.
+        return [search_params(s, nprobe, ef_search) for s in info["shards"]]
+    index_type = info.get("index_type", "flat")
+    defaults = info.get("search", {})
+    if index_type in ("ivf", "ivfpq"):
+        p = nprobe if nprobe else int(defaults.get("nprobe", 1))
+        return faiss.SearchParametersIVF(nprobe=int(p))
+    if index_type == "hnsw":
+        ef = ef_search if ef_search else int(defaults.get("ef_search", 64))
+        return faiss.SearchParametersHNSW(efSearch=int(ef))
+    return None
+
+
+def index_vectors(index) -> Optional[np.ndarray]:
+    # Exact stored vectors, or None when the index only keeps lossy codes.
+    if index.ntotal == 0:
+        return None
+    if isinstance(index, (faiss.IndexIVFPQ, faiss.IndexScalarQuantizer, faiss.IndexLSH, BinaryIndex, RescoredIndex)):
+        return None
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def read_index(index_file: Path, index_type: str = "flat", mmap: bool = False):
+    # With mmap the file is mapped read-only instead of copied onto the heap,
+    # so processes serving the same index share it through the page cache.
+    # IVF maps its inverted lists; flat/HNSW storage is mapped where this
+    # faiss build supports it. Search results are identical either way.
+    if not mmap:
+        index = faiss.read_index(str(index_file))
+    elif index_type in ("ivf", "ivfpq"):
+        index = faiss.read_index(str(index_file), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    else:
+        index = faiss.read_index(str(index_file), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    if index_type == "binary":
+        return BinaryIndex(index)
+    return index
+
+
+def write_index(index, index_file: Path):
+    index_file = Path(index_file)
+    tmp = index_file.with_name(index_file.name + ".tmp")
+    if isinstance(index, BinaryIndex):
+        index = index.index
+    faiss.write_index(index, str(tmp))
+    os.replace(tmp, index_file)
+
+
+def write_rescore_vectors(path: Path, emb: np.ndarray):
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    emb.astype(np.float16).tofile(str(tmp))
+    os.replace(tmp, path)
+
+
+def with_rescoring(index, index_dir: Path, info: Dict[str, Any]):
+    # Wraps the index when info.json says the build stored rescore vectors.
+    rescore = info.get("rescore")
+    if not rescore:
+        return index
+    path = Path(index_dir) / rescore.get("file", "vectors.f16")
+    shape = (int(info.get("rows", index.ntotal)), int(info.get("dim", index.d)))
+    vectors = np.memmap(str(path), dtype=np.float16, mode="r", shape=shape)
+    return RescoredIndex(index, vectors, int(rescore.get("factor", 4)))
+
+
+def load_search_index(index_file: Path, info: Dict[str, Any], mmap: bool = False):
+    index = read_index(index_file, info.get("index_type", "flat"), mmap)
+    return with_rescoring(index, Path(index_file).parent, info)
+
+
+def load_index_info(info_file: Path) -> Dict[str, Any]:
+    info_file = Path(info_file)
+    if not info_file.exists():
+        return {"index_type": "flat"}
+    info = json.loads(info_file.read_text(encoding="utf-8"))
+    if "index_type" not in info:
+        info["index_type"] = "flat"
+    return info
+
+
+def recall_report(emb: np.ndarray, index, info: Dict[str, Any], queries: np.ndarray, k: int,
+                  index_bytes: int = 0, rescore_bytes: int = 0) -> List[str]:
+    exact = faiss.IndexFlatIP(emb.shape[1])
+    exact.add(emb)
+
+    t0 = time.perf_counter()
+    for i in range(queries.shape[0]):
+        exact.search(queries[i:i + 1], k)
+    flat_ms = (time.perf_counter() - t0) * 1000.0 / max(1, queries.shape[0])
+    _, I_true = exact.search(queries, k)
+
+    index_type = info.get("index_type", "flat")
+    grid = [None]
+    if index_type in ("ivf", "ivfpq"):
+        nlist = int(info.get("index_params", {}).get("nlist", 1))
+        grid = [p for p in NPROBE_GRID if p <= nlist]
+        if nlist not in grid:
+            grid.append(nlist)
+    elif index_type == "hnsw":
+        grid = EF_SEARCH_GRID
+
+    # Rescored indexes get one extra row for the compressed index alone.
+    variants = [(index, "")]
+    if isinstance(index, RescoredIndex):
+        variants = [(index, f", rescore x{index.factor}"), (index.index, ", no rescore")]
+
+    flat_bytes = emb.shape[0] * emb.shape[1] * 4
+    lines = []
+    lines.append("# Index Recall Report")
+    lines.append("")
+    lines.append(f"- Index type: **{index_type}**")
+    lines.append(f"- Index params: `{json.dumps(info.get('index_params', {}))}`")
+    lines.append(f"- Rows: **{emb.shape[0]}**, dim: **{emb.shape[1]}**")
+    lines.append(f"- Queries: **{queries.shape[0]}**, k: **{k}**")
+    lines.append(f"- Flat (exact) latency: **{flat_ms:.3f} ms/query**")
+    if index_bytes > 0:
+        ratio = flat_bytes / float(index_bytes)
+        lines.append(f"- Index size: **{index_bytes / 1e6:.2f} MB** (float32 flat: {flat_bytes / 1e6:.2f} MB, {ratio:.1f}x smaller)")
+    if rescore_bytes > 0:
+        lines.append(f"- Rescore vectors (float16, mmapped, not held in RAM): **{rescore_bytes / 1e6:.2f} MB**")
+    lines.append("")
+    lines.append(f"| setting | recall@{k} | ms/query | speedup vs flat |")
+    lines.append("|---|---:|---:|---:|")
+
+    for searcher, suffix in variants:
+        for value in grid:
+            if index_type in ("ivf", "ivfpq"):
+                params = search_params(info, nprobe=value)
+                label = f"nprobe={value}"
+            elif index_type == "hnsw":
+                params = search_params(info, ef_search=value)
+                label = f"ef_search={value}"
+            else:
+                params = None
+                label = "exact" if index_type == "flat" else index_type
+
+            t0 = time.perf_counter()
+            for i in range(queries.shape[0]):
+                searcher.search(queries[i:i + 1], k, params=params)
+            ms = (time.perf_counter() - t0) * 1000.0 / max(1, queries.shape[0])
+            _, I = searcher.search(queries, k, params=params)
+
+            hit = 0
+            for row_true, row in zip(I_true, I):
+                hit += len(set(row_true.tolist()) & set(row.tolist()))
+            recall = hit / float(I_true.size) if I_true.size > 0 else 0.0
+            speedup = flat_ms / ms if ms > 0 else 0.0
+            lines.append(f"| {label}{suffix} | {recall:.3f} | {ms:.3f} | {speedup:.2f}x |")
+
+    lines.append("")
+    return lines
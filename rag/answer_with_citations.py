@@ -1,24 +1,21 @@
 import argparse
-import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import numpy as np
-import faiss
 import torch
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
 
-def load_meta(meta_file: Path):
-    rows = []
-    with meta_file.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if len(line) == 0:
-                continue
-            rows.append(json.loads(line))
-    return rows
+from rag.ann_index import load_index_info, load_search_index, search_params
+from rag.bm25 import open_bm25, retrieve
+from rag.embedder import EMBED_BACKENDS, load_sentence_model
+from rag.generator import GEN_BACKENDS, load_seq2seq
+from rag.meta_store import open_meta
+from rag.query_cache import QueryEmbeddingCache
+from rag.shards import has_shards, open_shards
 
 
 def clean_text(s: str):
@@ -32,42 +29,20 @@ def clean_text(s: str):
     return t
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--index_file", default="data/index/faiss.index")
-    ap.add_argument("--meta_file", default="data/index/meta.jsonl")
-    ap.add_argument("--embed_model", default="sentence-transformers/all-MiniLM-L6-v2")
-    ap.add_argument("--gen_model", default="google/flan-t5-base")
-    ap.add_argument("--query", required=True)
-    ap.add_argument("--top_k", type=int, default=10)
-    ap.add_argument("--cite_k", type=int, default=2)
-    ap.add_argument("--min_score", type=float, default=0.35)
-    ap.add_argument("--max_context_chars", type=int, default=9000)
-    ap.add_argument("--max_new_tokens", type=int, default=140)
-    args = ap.parse_args()
-
-    index_file = Path(args.index_file)
-    meta_file = Path(args.meta_file)
+def load_generator(state, args):
+    if "gen_model" not in state:
+        tokenizer, model = load_seq2seq(args.gen_model, args.gen_backend, args.onnx_dir)
+        state["tokenizer"] = tokenizer
+        state["gen_model"] = model
+    return state["tokenizer"], state["gen_model"]
 
-    if not index_file.exists():
-        print(f"ERROR: index_file not found: {index_file}", file=sys.stderr)
-        sys.exit(1)
-    if not meta_file.exists():
-        print(f"ERROR: meta_file not found: {meta_file}", file=sys.stderr)
-        sys.exit(1)
 
-    rows = load_meta(meta_file)
-    index = faiss.read_index(str(index_file))
+def answer_query(query: str, args, state):
+    rows = state["rows"]
+    qvec = state["query_cache"].encode([query])
+    D, I, top = retrieve(state["index"], state["bm25"], qvec, [query], args.top_k, args.sparse_weight, state["params"])
 
-    embedder = SentenceTransformer(args.embed_model)
-
-    qvec = embedder.encode([args.query], convert_to_numpy=True, normalize_embeddings=True)
-    if qvec.dtype != np.float32:
-        qvec = qvec.astype(np.float32)
-
-    D, I = index.search(qvec, args.top_k)
-
-    top_score = float(D[0][0])
+    top_score = float(top[0])
     if top_score < args.min_score:
         print("FINAL: ABSTAIN (evidence score too low)")
         print(f"top_score={top_score:.4f} (min_score={args.min_score})")
@@ -76,6 +51,8 @@ def main():
     retrieved = []
     for j in range(args.top_k):
         idx = int(I[0][j])
+        if idx < 0:
+            continue
         score = float(D[0][j])
         r = rows[idx]
         doc_id = r.get("doc_id")
@@ -101,15 +78,13 @@ def main():
 
     context = "\n\n".join(context_blocks)
 
-    tokenizer = AutoTokenizer.from_pretrained(args.gen_model)
-    model = AutoModelForSeq2SeqLM.from_pretrained(args.gen_model)
-    model.eval()
+    tokenizer, model = load_generator(state, args)
 
     prompt = (
         "Answer the QUESTION using ONLY the SOURCE TEXT below.\n"
         "Write 1-2 sentences. Do NOT copy long passages.\n"
         "If the sources do not support an answer, output exactly: ABSTAIN\n\n"
-        f"QUESTION: {args.query}\n\n"
+        f"QUESTION: {query}\n\n"
         f"SOURCE TEXT:\n{context}\n\n"
         "ANSWER:"
     )
@@ -151,5 +126,79 @@ def main():
     print(final_out)
 
 
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index_file", default="data/index/faiss.index")
+    ap.add_argument("--meta_file", default="data/index/meta.bin")
+    ap.add_argument("--embed_model", default="sentence-transformers/all-MiniLM-L6-v2")
+    ap.add_argument("--embed_backend", default="", choices=[""] + EMBED_BACKENDS)
+    ap.add_argument("--gen_model", default="google/flan-t5-base")
+    ap.add_argument("--gen_backend", choices=GEN_BACKENDS, default="torch")
+    ap.add_argument("--onnx_dir", default=None)
+    ap.add_argument("--query", default="")
+    ap.add_argument("--interactive", action="store_true")
+    ap.add_argument("--query_cache_size", type=int, default=4096)
+    ap.add_argument("--top_k", type=int, default=10)
+    ap.add_argument("--cite_k", type=int, default=2)
+    ap.add_argument("--min_score", type=float, default=0.35)
+    ap.add_argument("--max_context_chars", type=int, default=9000)
+    ap.add_argument("--max_new_tokens", type=int, default=140)
+    ap.add_argument("--nprobe", type=int, default=0)
+    ap.add_argument("--ef_search", type=int, default=0)
+    ap.add_argument("--sparse_weight", type=float, default=0.0)
+    ap.add_argument("--shard_workers", type=int, default=4)
+    args = ap.parse_args()
+
+    if len(args.query) == 0 and not args.interactive:
+        ap.error("--query is required unless --interactive is set")
+
+    index_file = Path(args.index_file)
+    meta_file = Path(args.meta_file)
+
+    if has_shards(index_file.parent):
+        # shards.json next to the index: search every shard (rag/build_shards.py).
+        executor = ThreadPoolExecutor(max_workers=args.shard_workers) if args.shard_workers > 0 else None
+        shard_set = open_shards(index_file.parent, executor=executor)
+        rows, info, index, bm25 = shard_set.meta, shard_set.info, shard_set.index, shard_set.bm25
+    else:
+        if not index_file.exists():
+            print(f"ERROR: index_file not found: {index_file}", file=sys.stderr)
+            sys.exit(1)
+        if not meta_file.exists():
+            print(f"ERROR: meta_file not found: {meta_file}", file=sys.stderr)
+            sys.exit(1)
+
+        rows = open_meta(meta_file)
+        info = load_index_info(index_file.parent / "info.json")
+        index = load_search_index(index_file, info)
+        bm25 = open_bm25(index_file.parent, info)
+
+    embedder = load_sentence_model(args.embed_model, args.embed_backend or info.get("embed_backend", "torch"))
+
+    state = {
+        "rows": rows,
+        "index": index,
+        "bm25": bm25,
+        "params": search_params(info, args.nprobe, args.ef_search),
+        "query_cache": QueryEmbeddingCache(embedder, args.query_cache_size),
+    }
+
+    if len(args.query) > 0:
+        answer_query(args.query, args, state)
+
+    if args.interactive:
+        # Long-lived mode: one question per stdin line; the embedder, index
+        # and generator are loaded once and query embeddings are cached.
+        for line in sys.stdin:
+            q = line.strip()
+            if len(q) == 0:
+                continue
+            print(f"\nQUESTION: {q}")
+            answer_query(q, args, state)
+        st = state["query_cache"].stats()
+        print(f"query_cache_hits={st['hits']}")
+        print(f"query_cache_misses={st['misses']}")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,263 @@
+import array
+import json
+import math
+import mmap
+import os
+import re
+import struct
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# bm25.bin layout:
+#   8 bytes  magic b"RAGBM251"
+#   8 bytes  little-endian uint64 header length
+#   header   JSON: rows, terms, postings, k1, b, avgdl, section offsets
+#   sections (8-byte aligned): doc_len int32[rows], post_offsets int64[terms+1],
+#            post_doc int32[postings], post_tf uint16[postings],
+#            terms utf-8 blob (sorted, "\n"-separated)
+MAGIC = b"RAGBM251"
+BM25_FILE = "bm25.bin"
+RRF_K = 60
+
+# Keeps control ids and versions ("ac-2", "800-53", "3.5.3") as one token.
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in is it its of on or "
+    "that the their this to was what when where which who why with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def bm25_idf(rows: int, df: int) -> float:
+    return math.log(1.0 + (rows - df + 0.5) / (df + 0.5))
+
+
+class BM25Writer:
+    # Accumulates postings per term in compact arrays; close() writes the
+    # sorted vocabulary and the postings lists in one pass.
+
+    def __init__(self, path: Path, k1: float = 1.2, b: float = 0.75):
+        self.path = Path(path)
+        self.k1 = float(k1)
+        self.b = float(b)
+        self.doc_len = array.array("i")
+        self.postings: Dict[str, Tuple[array.array, array.array]] = {}
+
+    def add(self, text: str):
+        doc = len(self.doc_len)
+        tokens = tokenize(text)
+        self.doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            p = self.postings.get(term)
+            if p is None:
+                p = (array.array("i"), array.array("H"))
+                self.postings[term] = p
+            p[0].append(doc)
+            p[1].append(min(tf, 65535))
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def close(self) -> Dict[str, Any]:
+        terms = sorted(self.postings.keys())
+        offsets = [0]
+        for t in terms:
+            offsets.append(offsets[-1] + len(self.postings[t][0]))
+        n = len(self.doc_len)
+        avgdl = float(sum(self.doc_len)) / n if n > 0 else 0.0
+
+        post_doc = np.empty(offsets[-1], dtype="<i4")
+        post_tf = np.empty(offsets[-1], dtype="<u2")
+        for j, t in enumerate(terms):
+            docs, tfs = self.postings[t]
+            post_doc[offsets[j]:offsets[j + 1]] = np.frombuffer(docs, dtype=np.int32)
+            post_tf[offsets[j]:offsets[j + 1]] = np.frombuffer(tfs, dtype=np.uint16)
+
+        arrays = [
+            ("doc_len", np.frombuffer(self.doc_len, dtype=np.int32).astype("<i4")),
+            ("post_offsets", np.asarray(offsets, dtype="<i8")),
+            ("post_doc", post_doc),
+            ("post_tf", post_tf),
+        ]
+        blob = "\n".join(terms).encode("utf-8")
+
+        header_len = 0
+        while True:
+            pos = _align(16 + header_len)
+            sections = {}
+            for name, arr in arrays:
+                sections[name] = pos
+                pos = _align(pos + arr.nbytes)
+            sections["terms"] = pos
+            header = {
+                "rows": n,
+                "terms": len(terms),
+                "postings": int(offsets[-1]),
+                "k1": self.k1,
+                "b": self.b,
+                "avgdl": avgdl,
+                "terms_bytes": len(blob),
+                "sections": sections,
+            }
+            raw = json.dumps(header).encode("utf-8")
+            if len(raw) == header_len:
+                break
+            header_len = len(raw)
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", header_len))
+            f.write(raw)
+            for name, arr in arrays:
+                f.write(b"\0" * (sections[name] - f.tell()))
+                f.write(arr.tobytes())
+            f.write(b"\0" * (sections["terms"] - f.tell()))
+            f.write(blob)
+        os.replace(tmp, self.path)
+
+        return {"file": self.path.name, "terms": len(terms), "postings": int(offsets[-1]), "k1": self.k1, "b": self.b}
+
+
+def write_bm25(path: Path, texts, k1: float = 1.2, b: float = 0.75) -> Dict[str, Any]:
+    w = BM25Writer(path, k1, b)
+    for t in texts:
+        w.add(t)
+    return w.close()
+
+
+class BM25Index:
+    # Read-only, memory-mapped BM25 index. A query touches only the postings
+    # of its own terms.
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            if f.read(8) != MAGIC:
+                raise ValueError(f"not a bm25 index: {self.path}")
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.rows = int(header["rows"])
+        self.k1 = float(header["k1"])
+        self.b = float(header["b"])
+        sec = header["sections"]
+        n_terms = int(header["terms"])
+        n_post = int(header["postings"])
+        self.post_offsets = np.frombuffer(self.mm, dtype="<i8", count=n_terms + 1, offset=sec["post_offsets"])
+        self.post_doc = np.frombuffer(self.mm, dtype="<i4", count=n_post, offset=sec["post_doc"])
+        self.post_tf = np.frombuffer(self.mm, dtype="<u2", count=n_post, offset=sec["post_tf"])
+
+        start = int(sec["terms"])
+        blob = self.mm[start:start + int(header["terms_bytes"])].decode("utf-8")
+        terms = blob.split("\n") if n_terms > 0 else []
+        self.vocab = {t: j for j, t in enumerate(terms)}
+
+        self.doc_len = np.frombuffer(self.mm, dtype="<i4", count=self.rows, offset=sec["doc_len"])
+        self.avgdl = float(header["avgdl"])
+        # Per-document length normalization, precomputed once.
+        self.norm = self.length_norm(self.doc_len.astype(np.float32), self.avgdl)
+
+    def __len__(self):
+        return self.rows
+
+    def length_norm(self, doc_len: np.ndarray, avgdl: float) -> np.ndarray:
+        return (self.k1 * (1.0 - self.b + self.b * doc_len / (avgdl or 1.0))).astype(np.float32)
+
+    def df(self, term: str) -> int:
+        j = self.vocab.get(term)
+        if j is None:
+            return 0
+        return int(self.post_offsets[j + 1] - self.post_offsets[j])
+
+    def scores(self, query: str, idf: Optional[Dict[str, float]] = None, avgdl: Optional[float] = None) -> np.ndarray:
+        # idf and avgdl override this index's own term weights and average
+        # length (a shard scored with corpus-wide statistics).
+        out = np.zeros(self.rows, dtype=np.float32)
+        for term in set(tokenize(query)):
+            j = self.vocab.get(term)
+            if j is None:
+                continue
+            a = int(self.post_offsets[j])
+            b = int(self.post_offsets[j + 1])
+            docs = self.post_doc[a:b]
+            tf = self.post_tf[a:b].astype(np.float32)
+            w = bm25_idf(self.rows, b - a) if idf is None else idf.get(term, 0.0)
+            norm = self.norm[docs] if avgdl is None else self.length_norm(self.doc_len[docs].astype(np.float32), avgdl)
+            out[docs] += w * tf * (self.k1 + 1.0) / (tf + norm)
+        return out
+
+    def search(self, queries: List[str], k: int, idfs: Optional[List[Dict[str, float]]] = None,
+               avgdl: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # Same shape and padding as faiss: (n, k) scores and ids, -1 = no hit.
+        D = np.zeros((len(queries), k), dtype=np.float32)
+        I = np.full((len(queries), k), -1, dtype=np.int64)
+        for r, q in enumerate(queries):
+            s = self.scores(q, None if idfs is None else idfs[r], avgdl)
+            hits = np.flatnonzero(s)
+            if len(hits) > k:
+                hits = hits[np.argpartition(-s[hits], k - 1)[:k]]
+            hits = hits[np.lexsort((hits, -s[hits]))]
+            D[r, :len(hits)] = s[hits]
+            I[r, :len(hits)] = hits
+        return D, I
+
+
+def open_bm25(index_dir: Path, info: Dict[str, Any]) -> Optional[BM25Index]:
+    spec = info.get("bm25")
+    if not spec:
+        return None
+    path = Path(index_dir) / spec.get("file", BM25_FILE)
+    if not path.exists():
+        return None
+    return BM25Index(path)
+
+
+def rrf_fuse(dense_ids, sparse_ids, k: int, weight: float, rrf_k: int = RRF_K) -> Tuple[List[int], List[float]]:
+    # Weighted reciprocal rank fusion: (1 - weight) / (rrf_k + dense rank) +
+    # weight / (rrf_k + sparse rank). Ties keep dense order.
+    fused: Dict[int, float] = {}
+    for rank, i in enumerate(dense_ids):
+        i = int(i)
+        if i >= 0:
+            fused[i] = fused.get(i, 0.0) + (1.0 - weight) / (rrf_k + rank + 1)
+    for rank, i in enumerate(sparse_ids):
+        i = int(i)
+        if i >= 0:
+            fused[i] = fused.get(i, 0.0) + weight / (rrf_k + rank + 1)
+    ranked = sorted(fused.items(), key=lambda x: -x[1])[:k]
+    return [i for i, _ in ranked], [s for _, s in ranked]
+
+
+def retrieve(index, bm25: Optional[BM25Index], qvec: np.ndarray, queries: List[str], k: int, weight: float,
+             params=None, depth_factor: int = 3):
+    # Returns (D, I, top_dense). Without a BM25 index (or weight 0) this is
+    # plain dense search. Otherwise both sides fetch depth_factor * k
+    # candidates and D holds the fused RRF scores. top_dense is the best
+    # dense cosine per query, which min_score gates on in both modes.
+    if bm25 is None or weight <= 0:
+        D, I = index.search(qvec, k, params=params)
+        return D, I, D[:, 0]
+
+    depth = max(k, depth_factor * k)
+    Dd, Id = index.search(qvec, depth, params=params)
+    _, Is = bm25.search(queries, depth)
+    D = np.zeros((len(queries), k), dtype=np.float32)
+    I = np.full((len(queries), k), -1, dtype=np.int64)
+    for r in range(len(queries)):
+        ids, scores = rrf_fuse(Id[r], Is[r], k, weight)
+        D[r, :len(ids)] = scores
+        I[r, :len(ids)] = ids
+    return D, I, Dd[:, 0]
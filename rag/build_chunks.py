@@ -1,12 +1,21 @@
 import argparse
+import hashlib
 import json
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
 from pathlib import Path
 
 import fitz
 
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from rag.chunker import DEFAULT_TOKENIZERS, TokenChunker, TokenCounter, clean_page_text, parse_tokenizers
+
 
 def normalize_text(s: str) -> str:
     s = s.replace("\x00", " ")
@@ -67,18 +76,122 @@ def iter_inputs(in_dir: Path):
     return files
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--in_dir", default="data/sample_docs")
-    ap.add_argument("--out_file", default="data/chunks/chunks.jsonl")
+def extract_pdf_pages(path: Path, start_page: int, end_page: int, clean=normalize_text):
+    pages = []
+    try:
+        pdf = fitz.open(str(path))
+    except Exception:
+        for page_index in range(start_page, end_page):
+            pages.append((page_index + 1, ""))
+        return pages
+
+    for page_index in range(start_page, end_page):
+        try:
+            page = pdf.load_page(page_index)
+            text = page.get_text("text")
+        except Exception:
+            text = ""
+        pages.append((page_index + 1, clean(text)))
+
+    try:
+        pdf.close()
+    except Exception:
+        pass
+    return pages
+
+
+def run_task(task):
+    # keep_lines: the token chunker parses line structure, so pages are
+    # cleaned without collapsing line breaks.
+    file_idx, path, start_page, end_page, keep_lines = task
+    clean = clean_page_text if keep_lines else normalize_text
+    if start_page is None:
+        return file_idx, [(None, clean(read_text_file(path)))]
+    return file_idx, extract_pdf_pages(path, start_page, end_page, clean)
+
+
+def plan_tasks(files, pages_per_task: int, skip, keep_lines: bool = False):
+    tasks = []
+    opened = []
+    for file_idx, path in enumerate(files):
+        if file_idx in skip:
+            continue
+        if path.suffix.lower() != ".pdf":
+            tasks.append((file_idx, path, None, None, keep_lines))
+            opened.append(file_idx)
+            continue
+
+        try:
+            pdf = fitz.open(str(path))
+            page_count = pdf.page_count
+            pdf.close()
+        except Exception as e:
+            print(f"WARN: failed to open PDF: {path} ({e})", file=sys.stderr)
+            continue
+
+        opened.append(file_idx)
+        if page_count == 0:
+            continue
+
+        step = page_count
+        if pages_per_task > 0:
+            step = pages_per_task
+        start = 0
+        while start < page_count:
+            end = min(start + step, page_count)
+            tasks.append((file_idx, path, start, end, keep_lines))
+            start = end
+    return tasks, opened
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def manifest_path(out_file: Path) -> Path:
+    return out_file.with_name(out_file.stem + ".manifest.json")
+
+
+def load_manifest(path: Path):
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+def iter_task_results(tasks, workers: int):
+    if workers <= 1:
+        for task in tasks:
+            yield run_task(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for res in pool.map(run_task, tasks, chunksize=1):
+            yield res
+
+
+def add_chunk_args(ap):
+    # Chunking flags, shared with build_index.py --stream --in_dir.
     ap.add_argument("--chunk_chars", type=int, default=2000)
     ap.add_argument("--overlap_chars", type=int, default=300)
-    args = ap.parse_args()
+    ap.add_argument("--chunker", default="chars", choices=["chars", "tokens"])
+    ap.add_argument("--chunk_tokens", type=int, default=256)
+    ap.add_argument("--overlap_tokens", type=int, default=32)
+    ap.add_argument("--tokenizers", default=DEFAULT_TOKENIZERS)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--pages_per_task", type=int, default=32)
 
-    in_dir = Path(args.in_dir)
-    out_file = Path(args.out_file)
-    out_file.parent.mkdir(parents=True, exist_ok=True)
 
+def check_inputs(in_dir: Path):
     if not in_dir.exists() or not in_dir.is_dir():
         print(f"ERROR: in_dir not found: {in_dir}", file=sys.stderr)
         sys.exit(1)
@@ -87,81 +200,164 @@ def main():
     if len(files) == 0:
         print(f"ERROR: no input files found under: {in_dir}", file=sys.stderr)
         sys.exit(1)
+    return files
+
+
+def file_parts(task_results, counter, args):
+    # (text, page, page_end) for one file's task results, in page order. The
+    # token chunker keeps state across pages (and page-range tasks), so its
+    # chunks can span page breaks.
+    chunker = None
+    if counter is not None:
+        chunker = TokenChunker(counter, args.chunk_tokens, args.overlap_tokens)
+    for _, pages in task_results:
+        pages = [(page, text) for page, text in pages if len(text) > 0]
+        if chunker is not None:
+            for ch in chunker.add_pages(pages):
+                yield ch["text"], ch["page"], ch["page_end"]
+        else:
+            for page, text in pages:
+                for part in chunk_text(text, args.chunk_chars, args.overlap_chars):
+                    yield part, page, None
+    if chunker is not None:
+        for ch in chunker.finish():
+            yield ch["text"], ch["page"], ch["page_end"]
+
+
+def chunk_rows(in_dir: Path, files, out_file: Path, args, incremental: bool, stats):
+    # Writes out_file and its manifest, yielding each row as it is written
+    # (rows of reused files included), so build_index.py --stream can embed
+    # chunks while later files are still being extracted. Counts go to stats.
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    params = {"chunk_chars": args.chunk_chars, "overlap_chars": args.overlap_chars}
+    counter = None
+    if args.chunker == "tokens":
+        tokenizers = parse_tokenizers(args.tokenizers)
+        params = {
+            "mode": "tokens",
+            "chunk_tokens": args.chunk_tokens,
+            "overlap_tokens": args.overlap_tokens,
+            "tokenizers": tokenizers,
+        }
+        counter = TokenCounter(tokenizers)
+    man_file = manifest_path(out_file)
+
+    old_files = {}
+    if incremental:
+        old = load_manifest(man_file)
+        if old is None or not out_file.exists():
+            print("incremental=off (no previous manifest)")
+        elif old.get("params") != params:
+            print("incremental=off (chunking params changed)")
+        else:
+            old_files = old.get("files", {})
+
+    rel_names = []
+    hashes = []
+    reused = set()
+    for file_idx, path in enumerate(files):
+        rel = path.relative_to(in_dir).as_posix()
+        digest = sha256_file(path)
+        rel_names.append(rel)
+        hashes.append(digest)
+        prev = old_files.get(rel)
+        if prev is not None and prev.get("sha256") == digest:
+            reused.add(file_idx)
+
+    # PDFs are split into page ranges so one large document can use several
+    # workers. pool.map yields results in task order, so chunk ids are
+    # assigned exactly as in a serial run.
+    tasks, opened = plan_tasks(files, args.pages_per_task, reused, keep_lines=counter is not None)
+    opened = set(opened)
 
-    docs_processed = 0
     total_chunks = 0
+    new_files = {}
+    tmp_file = out_file.with_name(out_file.name + ".tmp")
 
-    with out_file.open("w", encoding="utf-8") as f_out:
-        for path in files:
-            doc_id = path.stem
-            source_name = path.name
-            chunk_counter = 1
-
-            suf = path.suffix.lower()
-
-            if suf == ".pdf":
-                try:
-                    pdf = fitz.open(str(path))
-                except Exception as e:
-                    print(f"WARN: failed to open PDF: {path} ({e})", file=sys.stderr)
-                    continue
-
-                docs_processed += 1
-
-                page_index = 0
-                while page_index < pdf.page_count:
-                    try:
-                        page = pdf.load_page(page_index)
-                        text = page.get_text("text")
-                    except Exception:
-                        text = ""
-
-                    text = normalize_text(text)
-                    if len(text) > 0:
-                        parts = chunk_text(text, args.chunk_chars, args.overlap_chars)
-                        for part in parts:
-                            chunk_id = "c" + str(chunk_counter).zfill(4)
-                            row = {
-                                "doc_id": doc_id,
-                                "source_name": source_name,
-                                "page": page_index + 1,
-                                "chunk_id": chunk_id,
-                                "text": part,
-                            }
-                            f_out.write(json.dumps(row, ensure_ascii=False) + "\n")
-                            chunk_counter += 1
-                            total_chunks += 1
-
-                    page_index += 1
-
-                try:
-                    pdf.close()
-                except Exception:
-                    pass
+    results = groupby(iter_task_results(tasks, args.workers), key=lambda res: res[0])
+    pending = next(results, None)
 
-            else:
-                raw = read_text_file(path)
-                raw = normalize_text(raw)
-                docs_processed += 1
-
-                if len(raw) > 0:
-                    parts = chunk_text(raw, args.chunk_chars, args.overlap_chars)
-                    for part in parts:
-                        chunk_id = "c" + str(chunk_counter).zfill(4)
+    with tmp_file.open("wb") as f_out:
+        for file_idx, path in enumerate(files):
+            rel = rel_names[file_idx]
+            offset = f_out.tell()
+
+            if file_idx in reused:
+                prev = old_files[rel]
+                with out_file.open("rb") as f_old:
+                    f_old.seek(prev["offset"])
+                    data = f_old.read(prev["length"])
+                f_out.write(data)
+                for line in data.decode("utf-8").splitlines():
+                    if line.strip():
+                        yield json.loads(line)
+                n_chunks = int(prev["chunks"])
+            elif file_idx in opened:
+                n_chunks = 0
+                if pending is not None and pending[0] == file_idx:
+                    for text, page, page_end in file_parts(pending[1], counter, args):
+                        n_chunks += 1
                         row = {
-                            "doc_id": doc_id,
-                            "source_name": source_name,
-                            "page": None,
-                            "chunk_id": chunk_id,
-                            "text": part,
+                            "doc_id": path.stem,
+                            "source_name": path.name,
+                            "page": page,
+                            "chunk_id": "c" + str(n_chunks).zfill(4),
+                            "text": text,
                         }
-                        f_out.write(json.dumps(row, ensure_ascii=False) + "\n")
-                        chunk_counter += 1
-                        total_chunks += 1
+                        if page_end is not None:
+                            row["page_end"] = page_end
+                        f_out.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+                        yield row
+                    pending = next(results, None)
+            else:
+                continue
+
+            total_chunks += n_chunks
+            new_files[rel] = {
+                "sha256": hashes[file_idx],
+                "doc_id": path.stem,
+                "source_name": path.name,
+                "offset": offset,
+                "length": f_out.tell() - offset,
+                "chunks": n_chunks,
+            }
+
+    os.replace(tmp_file, out_file)
+
+    manifest = {"params": params, "files": new_files}
+    man_file.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    stats["docs_processed"] = len(new_files)
+    stats["docs_reused"] = len(reused)
+    stats["docs_extracted"] = len(opened)
+    stats["docs_removed"] = len([rel for rel in old_files if rel not in new_files])
+    stats["chunks_written"] = total_chunks
+    stats["manifest"] = man_file
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", default="data/sample_docs")
+    ap.add_argument("--out_file", default="data/chunks/chunks.jsonl")
+    add_chunk_args(ap)
+    ap.add_argument("--incremental", action="store_true")
+    args = ap.parse_args()
+
+    in_dir = Path(args.in_dir)
+    out_file = Path(args.out_file)
+    files = check_inputs(in_dir)
+
+    stats = {}
+    for _ in chunk_rows(in_dir, files, out_file, args, args.incremental, stats):
+        pass
 
-    print(f"docs_processed={docs_processed}")
-    print(f"chunks_written={total_chunks}")
+    print(f"docs_processed={stats['docs_processed']}")
+    print(f"docs_reused={stats['docs_reused']}")
+    print(f"docs_extracted={stats['docs_extracted']}")
+    print(f"docs_removed={stats['docs_removed']}")
+    print(f"chunks_written={stats['chunks_written']}")
     print(f"out_file={out_file}")
+    print(f"manifest={stats['manifest']}")
 
 
 if __name__ == "__main__":
@@ -1,46 +1,445 @@
 import argparse
+import hashlib
 import json
 import os
+import queue
+import resource
 import sys
+import threading
+import time
 from pathlib import Path
 
 import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
 
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
 
-def load_chunks(chunks_file: Path):
-    rows = []
+from rag.acronyms import ACRONYM_FILE, AcronymTableBuilder, write_acronyms
+from rag.ann_index import (INDEX_TYPES, StreamingIndexBuilder, build_vector_index, default_search, index_vectors,
+                           load_index_info, read_index, recall_report, search_params, with_rescoring, write_index,
+                           write_rescore_vectors)
+from rag.bm25 import BM25_FILE, BM25Writer, write_bm25
+from rag.build_chunks import add_chunk_args, check_inputs, chunk_rows
+from rag.embed_cache import EmbeddingCache, encode_with_cache
+from rag.embedder import EMBED_BACKENDS, embed_model_key, load_sentence_model
+from rag.meta_store import MetaStore, MetaWriter, write_meta
+
+
+def iter_chunks(chunks_file: Path):
     with chunks_file.open("r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
             if len(line) == 0:
                 continue
-            obj = json.loads(line)
-            rows.append(obj)
-    return rows
+            yield json.loads(line)
+
+
+def load_chunks(chunks_file: Path):
+    return list(iter_chunks(chunks_file))
+
+
+def load_manifest(path: Path):
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+def doc_key(r) -> str:
+    return f"{r.get('doc_id')}|{r.get('source_name')}"
+
+
+def doc_keys(rows):
+    keys = []
+    for r in rows:
+        keys.append(doc_key(r))
+    return keys
+
+
+def group_by_doc(keys):
+    groups = {}
+    for i, key in enumerate(keys):
+        if key not in groups:
+            groups[key] = []
+        groups[key].append(i)
+    return groups
+
+
+def hash_row(h, r):
+    part = [r.get("chunk_id"), r.get("page"), r.get("text", "")]
+    if "page_end" in r:
+        part.append(r["page_end"])
+    h.update(json.dumps(part, ensure_ascii=False).encode("utf-8"))
+    h.update(b"\n")
+
+
+def doc_hash(rows, positions) -> str:
+    h = hashlib.sha256()
+    for i in positions:
+        hash_row(h, rows[i])
+    return h.hexdigest()
+
+
+def batched(rows, size: int):
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(batches, depth: int):
+    # Produces batches on a background thread, at most depth ahead of the
+    # consumer, so reading or extracting/chunking the next rows overlaps with
+    # embedding the current ones. Producer errors are re-raised here.
+    q = queue.Queue(maxsize=max(1, depth))
+    done = object()
+
+    def produce():
+        try:
+            for b in batches:
+                q.put(b)
+            q.put(done)
+        except BaseException as e:
+            q.put(e)
+
+    t = threading.Thread(target=produce, daemon=True)
+    t.start()
+    while True:
+        item = q.get()
+        if item is done:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+    t.join()
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def write_build_info(args, out_dir: Path, chunks_file: Path, model_key: str, n_rows: int, dim: int, index_params,
+                     search, rescore, bm25, acronyms, doc_rows, hashes):
+    # info.json and manifest.json for a finished build; doc_rows maps each
+    # doc key to its row count, in first-seen order.
+    docs = {}
+    for key, n in doc_rows.items():
+        docs[key] = {"hash": hashes[key], "rows": n}
+
+    # Content-derived version: the server keys its caches on it, so an
+    # identical rebuild keeps them valid and any real change invalidates them.
+    version_src = json.dumps(
+        [model_key, args.index_type, index_params, search, rescore, bm25, acronyms, [[k, hashes[k]] for k in doc_rows]],
+        sort_keys=True,
+    )
+    index_version = hashlib.sha256(version_src.encode("utf-8")).hexdigest()[:16]
+
+    info = {
+        "index_version": index_version,
+        "chunks_file": str(chunks_file),
+        "rows": int(n_rows),
+        "docs": int(len(doc_rows)),
+        "dim": int(dim),
+        "model": args.model,
+        "embed_backend": args.embed_backend,
+        "metric": "cosine_via_normalized_inner_product",
+        "index_type": args.index_type,
+        "index_params": index_params,
+        "search": search,
+    }
+    if rescore is not None:
+        info["rescore"] = rescore
+    if bm25 is not None:
+        info["bm25"] = bm25
+    if acronyms is not None:
+        info["acronyms"] = acronyms
+    # Chunking params from build_chunks.py; the API sizes prompt context by them.
+    chunk_manifest = load_manifest(chunks_file.with_name(chunks_file.stem + ".manifest.json"))
+    if chunk_manifest is not None and "params" in chunk_manifest:
+        info["chunking"] = chunk_manifest["params"]
+    info_file = out_dir / "info.json"
+    info_file.write_text(json.dumps(info, indent=2), encoding="utf-8")
+
+    manifest_file = out_dir / "manifest.json"
+    manifest = {"model": model_key, "docs": docs}
+    manifest_file.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    index_file = out_dir / "faiss.index"
+    print(f"index_saved={index_file}")
+    print(f"index_bytes={index_file.stat().st_size}")
+    if rescore is not None:
+        print(f"rescore_saved={out_dir / rescore['file']}")
+    print(f"meta_saved={out_dir / 'meta.bin'}")
+    if bm25 is not None:
+        print(f"bm25_saved={out_dir / bm25['file']}")
+    if acronyms is not None:
+        print(f"acronyms_saved={out_dir / acronyms['file']}")
+    print(f"info_saved={info_file}")
+    print(f"index_version={index_version}")
+    print(f"manifest_saved={manifest_file}")
+    return info
+
+
+def print_query(model, search_index, info, rows, q: str, top_k: int):
+    qvec = model.encode([q], convert_to_numpy=True, normalize_embeddings=True)
+    if qvec.dtype != np.float32:
+        qvec = qvec.astype(np.float32)
+
+    D, I = search_index.search(qvec, top_k, params=search_params(info))
+
+    print("")
+    print(f"QUERY: {q}")
+    k = int(top_k)
+    for j in range(k):
+        idx = int(I[0][j])
+        if idx < 0:
+            continue
+        score = float(D[0][j])
+        r = rows[idx]
+        doc_id = r.get("doc_id")
+        chunk_id = r.get("chunk_id")
+        page = r.get("page")
+        text_preview = r.get("text", "")[:160].replace("\n", " ")
+        print(f"{j+1}. score={score:.4f} [{doc_id}:{chunk_id}] page={page}  {text_preview}")
+
+
+def stream_build(args, chunks_file: Path, out_dir: Path):
+    # Constant-memory build: rows arrive in batches of --stream_rows from the
+    # chunks file, or straight from --in_dir through the chunker (which also
+    # writes the chunks file), and each batch is embedded and appended to
+    # the index, meta.bin, BM25 postings and acronym table before the next.
+    # Unchanged chunks are served by the embedding cache, so --incremental
+    # needs no previous vectors.
+    if len(args.recall_report) > 0:
+        print("ERROR: --recall_report needs every vector in memory; drop --stream", file=sys.stderr)
+        sys.exit(1)
+
+    chunk_stats = {}
+    if len(args.in_dir) > 0:
+        in_dir = Path(args.in_dir)
+        rows = chunk_rows(in_dir, check_inputs(in_dir), chunks_file, args, args.incremental, chunk_stats)
+    elif not chunks_file.exists():
+        print(f"ERROR: chunks_file not found: {chunks_file}", file=sys.stderr)
+        sys.exit(1)
+    else:
+        rows = iter_chunks(chunks_file)
+
+    print(f"embedding_model={args.model}")
+    print(f"embed_backend={args.embed_backend}")
+    print(f"stream_rows={args.stream_rows}")
+    model_key = embed_model_key(args.model, args.embed_backend)
+    model = load_sentence_model(args.model, args.embed_backend)
+
+    cache = None
+    if not args.no_cache:
+        cache = EmbeddingCache(Path(args.cache_dir), model_key, args.cache_max_rows)
+
+    vectors = StreamingIndexBuilder(
+        args.index_type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        pq_bits=args.pq_bits,
+        hnsw_m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+        sample_rows=args.train_sample,
+    )
+    meta_file = out_dir / "meta.bin"
+    meta = MetaWriter(meta_file)
+    bm25_file = out_dir / BM25_FILE
+    bm25_writer = None if args.no_bm25 else BM25Writer(bm25_file, args.bm25_k1, args.bm25_b)
+    acronym_file = out_dir / ACRONYM_FILE
+    acronym_builder = None if args.no_acronyms else AcronymTableBuilder()
+    rescore_file = out_dir / "vectors.f16"
+    rescore_tmp = rescore_file.with_name(rescore_file.name + ".tmp")
+    f_rescore = rescore_tmp.open("wb") if args.rescore else None
+
+    doc_rows = {}
+    doc_hashers = {}
+    n = 0
+    dim = 0
+    embed_sec = 0.0
+    wait_sec = 0.0
+    t_start = time.perf_counter()
+    last_report = t_start
+    t_wait = t_start
+    for batch in prefetch(batched(rows, args.stream_rows), args.prefetch):
+        wait_sec += time.perf_counter() - t_wait
+        t0 = time.perf_counter()
+        emb = encode_with_cache(model, [r.get("text", "") for r in batch], args.batch_size, cache, show_progress_bar=False)
+        embed_sec += time.perf_counter() - t0
+        dim = int(emb.shape[1])
+        vectors.add(emb)
+        if f_rescore is not None:
+            f_rescore.write(emb.astype(np.float16).tobytes())
+
+        for r in batch:
+            key = doc_key(r)
+            if key not in doc_hashers:
+                doc_hashers[key] = hashlib.sha256()
+                doc_rows[key] = 0
+            hash_row(doc_hashers[key], r)
+            doc_rows[key] += 1
+            meta.add(r)
+            if bm25_writer is not None:
+                bm25_writer.add(r.get("text", ""))
+            if acronym_builder is not None:
+                acronym_builder.add(n, r)
+            n += 1
+
+        now = time.perf_counter()
+        if now - last_report >= args.progress_sec:
+            last_report = now
+            print(f"progress rows={n} docs={len(doc_rows)} rows_per_sec={n / (now - t_start):.1f} "
+                  f"embed_sec={embed_sec:.1f} source_wait_sec={wait_sec:.1f} peak_rss_mb={peak_rss_mb():.0f}", flush=True)
+        t_wait = time.perf_counter()
+
+    if n == 0:
+        print("ERROR: no rows loaded from chunks_file", file=sys.stderr)
+        sys.exit(1)
+    if cache is not None:
+        cache.save()
+
+    total_sec = time.perf_counter() - t_start
+    for k in ("docs_processed", "docs_reused", "docs_extracted", "docs_removed", "chunks_written"):
+        if k in chunk_stats:
+            print(f"{k}={chunk_stats[k]}")
+    if len(args.in_dir) > 0:
+        print(f"chunks_file={chunks_file}")
+    print(f"rows_loaded={n}")
+    print(f"embedding_dim={dim}")
+    if cache is not None:
+        st = cache.stats()
+        print(f"cache_hits={st['hits']}")
+        print(f"cache_misses={st['misses']}")
+        print(f"cache_evicted={st['evicted']}")
+        print(f"cache_rows={st['rows']}")
+    print(f"stream_sec={total_sec:.2f}")
+    print(f"rows_per_sec={n / total_sec:.1f}")
+    print(f"embed_sec={embed_sec:.2f}")
+    print(f"source_wait_sec={wait_sec:.2f}")
+
+    index, index_params = vectors.finish()
+    search = default_search(args.index_type, index_params, args.nprobe, args.ef_search)
+    print(f"index_type={args.index_type}")
+    print(f"index_params={json.dumps(index_params)}")
+    print(f"search_params={json.dumps(search)}")
+    write_index(index, out_dir / "faiss.index")
+
+    rescore = None
+    if f_rescore is not None:
+        f_rescore.close()
+        os.replace(rescore_tmp, rescore_file)
+        rescore = {"file": rescore_file.name, "dtype": "float16", "factor": int(args.rescore_factor)}
+    elif rescore_file.exists():
+        os.remove(rescore_file)
+
+    meta.close()
 
+    bm25 = None
+    if bm25_writer is not None:
+        bm25 = bm25_writer.close()
+        print(f"bm25_terms={bm25['terms']}")
+        print(f"bm25_postings={bm25['postings']}")
+    elif bm25_file.exists():
+        os.remove(bm25_file)
 
-def save_meta(meta_file: Path, rows):
-    with meta_file.open("w", encoding="utf-8") as f:
-        for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    acronyms = None
+    if acronym_builder is not None:
+        acronyms = acronym_builder.write(acronym_file)
+        print(f"acronym_entries={acronyms['entries']}")
+    elif acronym_file.exists():
+        os.remove(acronym_file)
 
+    hashes = {key: h.hexdigest() for key, h in doc_hashers.items()}
+    info = write_build_info(args, out_dir, chunks_file, model_key, n, dim, index_params, search, rescore, bm25,
+                            acronyms, doc_rows, hashes)
+    print(f"peak_rss_mb={peak_rss_mb():.0f}")
 
-def main():
+    if len(args.query) > 0:
+        print_query(model, with_rescoring(index, out_dir, info), info, MetaStore(meta_file), args.query, args.top_k)
+
+
+def load_previous_vectors(out_dir: Path, manifest, model_name: str):
+    # Vectors of unchanged docs are read back from the previous index, so
+    # only added/changed docs go through the embedder.
+    if manifest is None or manifest.get("model") != model_name:
+        return None, None, "model changed or no previous manifest"
+
+    index_file = out_dir / "faiss.index"
+    meta_file = out_dir / "meta.bin"
+    if not index_file.exists() or not meta_file.exists():
+        return None, None, "previous index missing"
+
+    old_rows = MetaStore(meta_file)
+    old_info = load_index_info(out_dir / "info.json")
+    old_index = read_index(index_file, old_info.get("index_type", "flat"))
+    if old_index.ntotal != len(old_rows):
+        return None, None, "previous index and meta out of sync"
+
+    old_vecs = index_vectors(old_index)
+    if old_vecs is None:
+        return None, None, "previous index does not store exact vectors"
+    return old_rows, old_vecs, ""
+
+
+def main(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--chunks_file", default="data/chunks/chunks.jsonl")
     ap.add_argument("--out_dir", default="data/index")
     ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    ap.add_argument("--embed_backend", default="torch", choices=EMBED_BACKENDS)
     ap.add_argument("--batch_size", type=int, default=64)
     ap.add_argument("--query", default="")
     ap.add_argument("--top_k", type=int, default=5)
-    args = ap.parse_args()
+    ap.add_argument("--incremental", action="store_true")
+    ap.add_argument("--cache_dir", default="data/emb_cache")
+    ap.add_argument("--cache_max_rows", type=int, default=200000)
+    ap.add_argument("--no_cache", action="store_true")
+    ap.add_argument("--index_type", default="flat", choices=INDEX_TYPES)
+    ap.add_argument("--nlist", type=int, default=0)
+    ap.add_argument("--pq_m", type=int, default=0)
+    ap.add_argument("--pq_bits", type=int, default=8)
+    ap.add_argument("--hnsw_m", type=int, default=32)
+    ap.add_argument("--ef_construction", type=int, default=200)
+    ap.add_argument("--train_sample", type=int, default=50000)
+    ap.add_argument("--nprobe", type=int, default=0)
+    ap.add_argument("--ef_search", type=int, default=0)
+    ap.add_argument("--rescore", action="store_true")
+    ap.add_argument("--rescore_factor", type=int, default=4)
+    ap.add_argument("--no_bm25", action="store_true")
+    ap.add_argument("--bm25_k1", type=float, default=1.2)
+    ap.add_argument("--bm25_b", type=float, default=0.75)
+    ap.add_argument("--no_acronyms", action="store_true")
+    ap.add_argument("--recall_report", default="")
+    ap.add_argument("--recall_queries", default="")
+    ap.add_argument("--recall_samples", type=int, default=200)
+    ap.add_argument("--recall_k", type=int, default=10)
+    ap.add_argument("--stream", action="store_true")
+    ap.add_argument("--stream_rows", type=int, default=1024)
+    ap.add_argument("--prefetch", type=int, default=2)
+    ap.add_argument("--progress_sec", type=float, default=10.0)
+    ap.add_argument("--in_dir", default="")
+    add_chunk_args(ap)
+    args = ap.parse_args(argv)
 
     chunks_file = Path(args.chunks_file)
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
+    if args.stream:
+        stream_build(args, chunks_file, out_dir)
+        return
+    if len(args.in_dir) > 0:
+        print("ERROR: --in_dir needs --stream (or run build_chunks.py first)", file=sys.stderr)
+        sys.exit(1)
+
     if not chunks_file.exists():
         print(f"ERROR: chunks_file not found: {chunks_file}", file=sys.stderr)
         sys.exit(1)
@@ -50,72 +449,170 @@ def main():
         print("ERROR: no rows loaded from chunks_file", file=sys.stderr)
         sys.exit(1)
 
-    texts = []
-    for r in rows:
-        texts.append(r["text"])
-
     print(f"rows_loaded={len(rows)}")
     print(f"embedding_model={args.model}")
+    print(f"embed_backend={args.embed_backend}")
+    model_key = embed_model_key(args.model, args.embed_backend)
 
-    model = SentenceTransformer(args.model)
+    manifest_file = out_dir / "manifest.json"
+    groups = group_by_doc(doc_keys(rows))
+    hashes = {}
+    for key, positions in groups.items():
+        hashes[key] = doc_hash(rows, positions)
 
-    emb = model.encode(
-        texts,
-        batch_size=args.batch_size,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-        normalize_embeddings=True,
-    )
+    old_rows = None
+    old_vecs = None
+    old_docs = {}
+    if args.incremental:
+        manifest = load_manifest(manifest_file)
+        old_rows, old_vecs, why = load_previous_vectors(out_dir, manifest, model_key)
+        if old_rows is None:
+            print(f"incremental=off ({why})")
+        else:
+            old_docs = manifest.get("docs", {})
+
+    reuse = {}
+    if old_rows is not None:
+        old_groups = group_by_doc(old_rows.doc_keys())
+        for key, positions in groups.items():
+            prev = old_docs.get(key)
+            if prev is None or prev.get("hash") != hashes[key]:
+                continue
+            if key not in old_groups or len(old_groups[key]) != len(positions):
+                continue
+            reuse[key] = old_groups[key]
+
+    encode_pos = []
+    for key, positions in groups.items():
+        if key not in reuse:
+            encode_pos.extend(positions)
+    encode_pos.sort()
+
+    texts = []
+    for i in encode_pos:
+        texts.append(rows[i]["text"])
 
-    if emb.dtype != np.float32:
-        emb = emb.astype(np.float32)
+    docs_removed = 0
+    for key in old_docs:
+        if key not in groups:
+            docs_removed += 1
+
+    print(f"docs_reused={len(reuse)}")
+    print(f"docs_embedded={len(groups) - len(reuse)}")
+    print(f"docs_removed={docs_removed}")
+    print(f"rows_to_embed={len(texts)}")
+
+    model = load_sentence_model(args.model, args.embed_backend)
+
+    cache = None
+    if not args.no_cache:
+        cache = EmbeddingCache(Path(args.cache_dir), model_key, args.cache_max_rows)
+
+    new_emb = None
+    if len(texts) > 0:
+        new_emb = encode_with_cache(model, texts, args.batch_size, cache)
+        if cache is not None:
+            cache.save()
+
+    if new_emb is not None:
+        dim = int(new_emb.shape[1])
+    else:
+        dim = int(old_vecs.shape[1])
+
+    emb = np.zeros((len(rows), dim), dtype=np.float32)
+    if new_emb is not None:
+        emb[np.asarray(encode_pos, dtype=np.int64)] = new_emb
+    for key, old_positions in reuse.items():
+        emb[np.asarray(groups[key], dtype=np.int64)] = old_vecs[np.asarray(old_positions, dtype=np.int64)]
 
     dim = int(emb.shape[1])
     print(f"embedding_dim={dim}")
+    if cache is not None:
+        st = cache.stats()
+        print(f"cache_hits={st['hits']}")
+        print(f"cache_misses={st['misses']}")
+        print(f"cache_evicted={st['evicted']}")
+        print(f"cache_rows={st['rows']}")
 
-    index = faiss.IndexFlatIP(dim)
-    index.add(emb)
+    index, index_params = build_vector_index(
+        emb,
+        args.index_type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        pq_bits=args.pq_bits,
+        hnsw_m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+        sample_rows=args.train_sample,
+    )
+    search = default_search(args.index_type, index_params, args.nprobe, args.ef_search)
+    print(f"index_type={args.index_type}")
+    print(f"index_params={json.dumps(index_params)}")
+    print(f"search_params={json.dumps(search)}")
 
     index_file = out_dir / "faiss.index"
-    faiss.write_index(index, str(index_file))
+    write_index(index, index_file)
 
-    meta_file = out_dir / "meta.jsonl"
-    save_meta(meta_file, rows)
+    # Float16 copies of the vectors for re-ranking the compressed index's
+    # candidates; readers mmap the file and touch only candidate rows.
+    rescore = None
+    rescore_file = out_dir / "vectors.f16"
+    if args.rescore:
+        write_rescore_vectors(rescore_file, emb)
+        rescore = {"file": rescore_file.name, "dtype": "float16", "factor": int(args.rescore_factor)}
+    elif rescore_file.exists():
+        os.remove(rescore_file)
 
-    info = {
-        "chunks_file": str(chunks_file),
-        "rows": int(len(rows)),
-        "dim": int(dim),
-        "model": args.model,
-        "metric": "cosine_via_normalized_inner_product",
-    }
-    info_file = out_dir / "info.json"
-    info_file.write_text(json.dumps(info, indent=2), encoding="utf-8")
+    meta_file = out_dir / "meta.bin"
+    write_meta(meta_file, rows)
 
-    print(f"index_saved={index_file}")
-    print(f"meta_saved={meta_file}")
-    print(f"info_saved={info_file}")
+    # Sparse side of hybrid retrieval: BM25 postings over the same rows.
+    bm25 = None
+    bm25_file = out_dir / BM25_FILE
+    if not args.no_bm25:
+        t0 = time.perf_counter()
+        bm25 = write_bm25(bm25_file, (r.get("text", "") for r in rows), args.bm25_k1, args.bm25_b)
+        print(f"bm25_terms={bm25['terms']}")
+        print(f"bm25_postings={bm25['postings']}")
+        print(f"bm25_build_sec={time.perf_counter() - t0:.3f}")
+    elif bm25_file.exists():
+        os.remove(bm25_file)
+
+    # Acronym -> expansion table for instant "what does X stand for" answers.
+    acronyms = None
+    acronym_file = out_dir / ACRONYM_FILE
+    if not args.no_acronyms:
+        acronyms = write_acronyms(acronym_file, rows)
+        print(f"acronym_entries={acronyms['entries']}")
+    elif acronym_file.exists():
+        os.remove(acronym_file)
+
+    doc_rows = {key: len(positions) for key, positions in groups.items()}
+    info = write_build_info(args, out_dir, chunks_file, model_key, len(rows), dim, index_params, search, rescore, bm25,
+                            acronyms, doc_rows, hashes)
+    index_bytes = index_file.stat().st_size
+
+    search_index = with_rescoring(index, out_dir, info)
+
+    if len(args.recall_report) > 0:
+        if len(args.recall_queries) > 0:
+            qtexts = []
+            for r in load_chunks(Path(args.recall_queries)):
+                qtexts.append(r.get("query", r.get("text", "")))
+            queries = model.encode(qtexts, batch_size=args.batch_size, convert_to_numpy=True, normalize_embeddings=True)
+            queries = queries.astype(np.float32)
+        else:
+            rng = np.random.default_rng(0)
+            pick = rng.choice(len(rows), size=min(args.recall_samples, len(rows)), replace=False)
+            queries = np.ascontiguousarray(emb[np.sort(pick)])
+        rescore_bytes = rescore_file.stat().st_size if rescore is not None else 0
+        lines = recall_report(emb, search_index, info, queries, args.recall_k, index_bytes, rescore_bytes)
+        report_file = Path(args.recall_report)
+        report_file.parent.mkdir(parents=True, exist_ok=True)
+        report_file.write_text("\n".join(lines), encoding="utf-8")
+        print(f"recall_report={report_file}")
 
     if len(args.query) > 0:
-        q = args.query
-        qvec = model.encode([q], convert_to_numpy=True, normalize_embeddings=True)
-        if qvec.dtype != np.float32:
-            qvec = qvec.astype(np.float32)
-
-        D, I = index.search(qvec, args.top_k)
-
-        print("")
-        print(f"QUERY: {q}")
-        k = int(args.top_k)
-        for j in range(k):
-            idx = int(I[0][j])
-            score = float(D[0][j])
-            r = rows[idx]
-            doc_id = r.get("doc_id")
-            chunk_id = r.get("chunk_id")
-            page = r.get("page")
-            text_preview = r.get("text", "")[:160].replace("\n", " ")
-            print(f"{j+1}. score={score:.4f} [{doc_id}:{chunk_id}] page={page}  {text_preview}")
+        print_query(model, search_index, info, rows, args.query, args.top_k)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from rag import build_index
+from rag.build_index import doc_key, iter_chunks, load_manifest
+from rag.shards import SHARD_DIR, SHARDS_FILE, has_shards, read_shards, write_shards
+
+
+def parse_collections(s: str):
+    # "zero-trust=NIST.SP.800-207*;privacy=*800-122*,*800-188*" ->
+    # [(name, [source_name globs])]; the first matching collection wins.
+    out = []
+    for part in s.split(";"):
+        part = part.strip()
+        if len(part) == 0:
+            continue
+        name, _, globs = part.partition("=")
+        pats = [g.strip() for g in globs.split(",") if g.strip() != ""]
+        if len(name.strip()) == 0 or len(pats) == 0:
+            raise ValueError(f"bad collection spec: {part!r} (expected name=glob[,glob])")
+        out.append((name.strip(), pats))
+    return out
+
+
+def collection_of(source_name: str, collections, default: str) -> str:
+    for name, pats in collections:
+        if any(fnmatch.fnmatch(source_name, p) for p in pats):
+            return name
+    return default
+
+
+def assign_shards(doc_rows, doc_collection, shard_rows: int):
+    # doc key -> shard name. Documents are never split; a collection larger
+    # than shard_rows becomes <collection>-000, <collection>-001, ... in
+    # document order.
+    parts = {}
+    for key, n in doc_rows.items():
+        groups = parts.setdefault(doc_collection[key], [[]])
+        used = sum(doc_rows[k] for k in groups[-1])
+        if shard_rows > 0 and len(groups[-1]) > 0 and used + n > shard_rows:
+            groups.append([])
+        groups[-1].append(key)
+
+    out = {}
+    for coll, groups in parts.items():
+        for j, keys in enumerate(groups):
+            name = coll if len(groups) == 1 else f"{coll}-{j:03d}"
+            for key in keys:
+                out[key] = name
+    return out
+
+
+def main():
+    # Arguments this script does not know (--index_type, --incremental, ...)
+    # are passed on to build_index.py for every shard.
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks_file", default="data/chunks/chunks.jsonl")
+    ap.add_argument("--out_dir", default="data/index")
+    ap.add_argument("--collections", default="")
+    ap.add_argument("--default_collection", default="main")
+    ap.add_argument("--shard_rows", type=int, default=0)
+    ap.add_argument("--only", default="")
+    ap.add_argument("--force", action="store_true")
+    args, build_args = ap.parse_known_args()
+
+    chunks_file = Path(args.chunks_file)
+    out_dir = Path(args.out_dir)
+    if not chunks_file.exists():
+        print(f"ERROR: chunks_file not found: {chunks_file}", file=sys.stderr)
+        sys.exit(1)
+    for flag in ("--chunks_file", "--out_dir", "--in_dir"):
+        if any(a == flag or a.startswith(flag + "=") for a in build_args):
+            ap.error(f"{flag} is set per shard and cannot be passed through")
+    try:
+        collections = parse_collections(args.collections)
+    except ValueError as e:
+        ap.error(str(e))
+    if len(collections) == 0 and args.shard_rows <= 0:
+        ap.error("set --collections and/or --shard_rows")
+
+    # Pass 1: rows per document, in first-seen order.
+    doc_rows = {}
+    doc_collection = {}
+    for r in iter_chunks(chunks_file):
+        key = doc_key(r)
+        if key not in doc_rows:
+            doc_rows[key] = 0
+            doc_collection[key] = collection_of(str(r.get("source_name", "")), collections, args.default_collection)
+        doc_rows[key] += 1
+    if len(doc_rows) == 0:
+        print("ERROR: no rows loaded from chunks_file", file=sys.stderr)
+        sys.exit(1)
+    assignment = assign_shards(doc_rows, doc_collection, args.shard_rows)
+    names = list(dict.fromkeys(assignment.values()))
+
+    only = set(x.strip() for x in args.only.split(",") if x.strip() != "")
+    unknown = only - set(names)
+    if unknown:
+        ap.error(f"--only names unknown shards: {sorted(unknown)} (shards: {names})")
+
+    # Pass 2: each shard's rows to its own chunks file, hashed on the way.
+    shard_dirs = {name: out_dir / SHARD_DIR / name for name in names}
+    tmp_files = {name: d / "chunks.jsonl.tmp" for name, d in shard_dirs.items()}
+    hashes = {name: hashlib.sha256() for name in names}
+    shard_rows = {name: 0 for name in names}
+    shard_docs = {name: 0 for name in names}
+    for key, name in assignment.items():
+        shard_docs[name] += 1
+    writers = {}
+    try:
+        for r in iter_chunks(chunks_file):
+            name = assignment[doc_key(r)]
+            f = writers.get(name)
+            if f is None:
+                shard_dirs[name].mkdir(parents=True, exist_ok=True)
+                f = tmp_files[name].open("w", encoding="utf-8")
+                writers[name] = f
+            line = json.dumps(r, ensure_ascii=False) + "\n"
+            f.write(line)
+            hashes[name].update(line.encode("utf-8"))
+            shard_rows[name] += 1
+    finally:
+        for f in writers.values():
+            f.close()
+
+    old = {}
+    if has_shards(out_dir):
+        old = {e["name"]: e for e in read_shards(out_dir).get("shards", [])}
+    chunk_manifest = load_manifest(chunks_file.with_name(chunks_file.stem + ".manifest.json"))
+
+    entries = []
+    built = 0
+    for name in names:
+        d = shard_dirs[name]
+        digest = hashes[name].hexdigest()
+        prev = old.get(name)
+        selected = len(only) == 0 or name in only
+        unchanged = (
+            prev is not None
+            and prev.get("chunks_hash") == digest
+            and prev.get("build_args") == build_args
+            and (d / "info.json").exists()
+        )
+        if not selected or (unchanged and not args.force):
+            os.remove(tmp_files[name])
+            if prev is None or not (d / "info.json").exists():
+                print(f"WARN: shard {name} is not built; skipped", file=sys.stderr)
+                continue
+            print(f"shard={name} rows={prev.get('rows')} {'unchanged' if selected else 'not selected'}")
+            entries.append(prev)
+            continue
+
+        os.replace(tmp_files[name], d / "chunks.jsonl")
+        if chunk_manifest is not None and "params" in chunk_manifest:
+            (d / "chunks.manifest.json").write_text(json.dumps({"params": chunk_manifest["params"]}, indent=2), encoding="utf-8")
+        print(f"shard={name} rows={shard_rows[name]} docs={shard_docs[name]} building")
+        build_index.main(["--chunks_file", str(d / "chunks.jsonl"), "--out_dir", str(d)] + build_args)
+        built += 1
+        entries.append({
+            "name": name,
+            "dir": f"{SHARD_DIR}/{name}",
+            "rows": shard_rows[name],
+            "docs": shard_docs[name],
+            "chunks_hash": digest,
+            "build_args": build_args,
+        })
+
+    for name in sorted(set(old) - set(names)):
+        print(f"shard_dropped={name} (its directory is left in place)")
+    if len(entries) == 0:
+        print("ERROR: no shards built", file=sys.stderr)
+        sys.exit(1)
+
+    # Written last: the server reloads when it changes.
+    first = json.loads((out_dir / entries[0]["dir"] / "info.json").read_text(encoding="utf-8"))
+    write_shards(out_dir, {
+        "chunks_file": str(chunks_file),
+        "model": first.get("model"),
+        "embed_backend": first.get("embed_backend", "torch"),
+        "shards": entries,
+    })
+    print(f"shards={len(entries)}")
+    print(f"shards_built={built}")
+    print(f"shards_saved={out_dir / SHARDS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
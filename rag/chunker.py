@@ -0,0 +1,255 @@
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_TOKENIZERS = "sentence-transformers/all-MiniLM-L6-v2,google/flan-t5-base"
+
+# "3.2.1", "A.4", "Appendix B" alone on a line: PDF extraction often puts a
+# section number on its own line, before the title.
+SECTION_NUM_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[A-Z]\.\d+(?:\.\d+)*|(?:appendix|chapter|section|part)\s+[A-Z0-9]+)$", re.IGNORECASE)
+# "2.1 Scope", "3 Method", "A.2 Terms"; "1. Define ..." is a list item.
+NUMBERED_HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)+\.?|\d+|[A-Z]\.\d+(?:\.\d+)*)\s+[A-Z]")
+TOC_LEADER_RE = re.compile(r"\.{4,}|\s\.(?:\s\.){3,}")
+SENTENCE_END_RE = re.compile(r"[.!?:;][\"')\]]*$")
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+# Running headers and footers differ only in their page numbers.
+DIGITS_RE = re.compile(r"\d+")
+MAX_HEADING_CHARS = 90
+MAX_HEADING_WORDS = 12
+REPEAT_PAGES = 3
+
+
+def clean_page_text(s: str) -> str:
+    # Like normalize_text, but keeps line breaks for the structure parser.
+    s = s.replace("\x00", " ")
+    lines = [re.sub(r"\s+", " ", line).strip() for line in s.split("\n")]
+    return "\n".join(lines).strip()
+
+
+def is_heading(line: str) -> bool:
+    if len(line) > MAX_HEADING_CHARS or len(line.split()) > MAX_HEADING_WORDS:
+        return False
+    if not line[:1].isalnum() or TOC_LEADER_RE.search(line):
+        return False
+    if line.endswith((".", ",", ";")) and not SECTION_NUM_RE.match(line):
+        return False
+    if NUMBERED_HEADING_RE.match(line):
+        return True
+    # All-caps titles; single words are usually table headers or labels.
+    letters = [c for c in line if c.isalpha()]
+    return len(line.split()) >= 2 and len(letters) >= 4 and all(c.isupper() for c in letters)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s for s in SENTENCE_SPLIT_RE.split(text) if s.strip()]
+
+
+def join_lines(lines: List[str]) -> str:
+    # Re-joins words hyphenated across a line break ("moni-" + "toring").
+    out = ""
+    for line in lines:
+        if out.endswith("-") and line[:1].islower():
+            out = out[:-1] + line
+        elif out:
+            out = out + " " + line
+        else:
+            out = line
+    return out
+
+
+class PageParser:
+    # Turns one document's pages, in order, into ("heading" | "text", str)
+    # units. Lines seen on REPEAT_PAGES earlier pages (page numbers masked)
+    # are treated as running headers/footers and dropped.
+
+    def __init__(self):
+        self.seen: Counter = Counter()
+
+    def units(self, text: str) -> List[Tuple[str, str]]:
+        lines = [line for line in text.split("\n")]
+        keys = [DIGITS_RE.sub("#", line) for line in lines]
+        out: List[Tuple[str, str]] = []
+        para: List[str] = []
+        number = ""
+
+        def flush_para():
+            if para:
+                for s in split_sentences(join_lines(para)):
+                    out.append(("text", s))
+                para.clear()
+
+        for line, key in zip(lines, keys):
+            if not line:
+                flush_para()
+                continue
+            if self.seen[key] >= REPEAT_PAGES:
+                continue
+            if SECTION_NUM_RE.match(line):
+                flush_para()
+                number = line
+                continue
+            if number:
+                if len(line) <= MAX_HEADING_CHARS and line[:1].isupper():
+                    out.append(("heading", f"{number} {line}"))
+                    number = ""
+                    continue
+                para.append(number)
+                number = ""
+            if is_heading(line):
+                flush_para()
+                out.append(("heading", line))
+            else:
+                para.append(line)
+        if number:
+            para.append(number)
+        flush_para()
+
+        for key in set(keys):
+            if key:
+                self.seen[key] += 1
+        return out
+
+
+def load_tokenizer(name: str):
+    # The Rust tokenizer alone (tokenizer.json), without importing
+    # transformers: counting is all the chunker needs.
+    from tokenizers import Tokenizer
+
+    path = Path(name)
+    tok = Tokenizer.from_file(str(path / "tokenizer.json")) if path.is_dir() else Tokenizer.from_pretrained(name)
+    tok.no_truncation()
+    tok.no_padding()
+    return tok
+
+
+class TokenCounter:
+    # Token counts under several tokenizers (the embedder's and the
+    # generator's); a chunk must fit the largest count.
+
+    def __init__(self, names: List[str]):
+        self.names = list(names)
+        self.tokenizers = [load_tokenizer(n) for n in self.names]
+        self.special = max([t.num_special_tokens_to_add(False) for t in self.tokenizers] + [0])
+
+    def counts(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        out = [0] * len(texts)
+        for tok in self.tokenizers:
+            encode = getattr(tok, "encode_batch_fast", tok.encode_batch)
+            enc = encode(texts, add_special_tokens=False)
+            out = [max(a, len(e.ids)) for a, e in zip(out, enc)]
+        return out
+
+
+class TokenChunker:
+    # Streams units into chunks of at most chunk_tokens tokens (special tokens
+    # included) under every tokenizer. Chunks break between sentences, start
+    # a new chunk at a section heading (once the current one holds at least a
+    # quarter of the budget), and may span pages; each chunk records its
+    # first and last page. The last overlap_tokens worth of sentences are
+    # repeated at the start of the next chunk within a section.
+
+    def __init__(self, counter: TokenCounter, chunk_tokens: int, overlap_tokens: int):
+        self.counter = counter
+        self.budget = max(8, int(chunk_tokens) - counter.special)
+        self.overlap = max(0, min(int(overlap_tokens), self.budget // 2))
+        self.min_section = self.budget // 4
+        self.parser = PageParser()
+        self.units: List[Tuple[str, int, Optional[int], bool]] = []
+        self.used = 0
+        self.carry: Optional[Tuple[str, Optional[int]]] = None
+
+    def add_pages(self, pages) -> Iterator[Dict[str, Any]]:
+        # Tokenizer calls have a fixed cost, so units of all given pages are
+        # counted in one batch.
+        units = []
+        for page, text in pages:
+            units.extend(self.page_units(page, text))
+        counts = self.counter.counts([s for _, s, _ in units])
+        for (kind, s, p), n in zip(units, counts):
+            yield from self.push(s, n, p, kind == "heading")
+
+    def page_units(self, page: Optional[int], text: str) -> List[Tuple[str, str, Optional[int]]]:
+        units = [(kind, s, page) for kind, s in self.parser.units(text)]
+        if self.carry is not None:
+            # A sentence cut by the page break continues on this page.
+            if units and units[0][0] == "text":
+                units[0] = ("text", self.carry[0] + " " + units[0][1], self.carry[1])
+            else:
+                units.insert(0, ("text", self.carry[0], self.carry[1]))
+            self.carry = None
+        if units and units[-1][0] == "text" and not SENTENCE_END_RE.search(units[-1][1]):
+            self.carry = (units[-1][1], units[-1][2])
+            units = units[:-1]
+        return units
+
+    def finish(self) -> Iterator[Dict[str, Any]]:
+        if self.carry is not None:
+            s, p = self.carry
+            self.carry = None
+            yield from self.push(s, self.counter.counts([s])[0], p, False)
+        if self.units:
+            yield self.emit(keep_overlap=False)
+
+    def push(self, text: str, n: int, page: Optional[int], heading: bool) -> Iterator[Dict[str, Any]]:
+        if n > self.budget:
+            for piece, m in self.split_long(text, n):
+                yield from self.push(piece, m, page, heading)
+            return
+        if heading and self.used >= self.min_section and any(not h for _, _, _, h in self.units):
+            yield self.emit(keep_overlap=False)
+        elif self.used + n > self.budget:
+            yield self.emit(keep_overlap=True)
+            while self.units and self.used + n > self.budget:
+                self.used -= self.units.pop(0)[1]
+        self.units.append((text, n, page, heading))
+        self.used += n
+
+    def split_long(self, text: str, n: int) -> List[Tuple[str, int]]:
+        # A sentence longer than the budget is cut into near-equal word runs.
+        words = text.split()
+        parts = max(2, math.ceil(n / self.budget))
+        size = max(1, math.ceil(len(words) / parts))
+        pieces = [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+        counts = self.counter.counts(pieces)
+        out = []
+        for piece, m in zip(pieces, counts):
+            if m > self.budget and len(piece.split()) > 1:
+                out.extend(self.split_long(piece, m))
+            else:
+                out.append((piece, m))
+        return out
+
+    def emit(self, keep_overlap: bool) -> Dict[str, Any]:
+        # Headings at the very end belong to the next chunk.
+        tail: List[Tuple[str, int, Optional[int], bool]] = []
+        while len(self.units) > 1 and self.units[-1][3]:
+            tail.insert(0, self.units.pop())
+        body = self.units
+
+        pages = [p for _, _, p, _ in body if p is not None]
+        chunk = {
+            "text": " ".join(s for s, _, _, _ in body),
+            "page": pages[0] if pages else None,
+            "page_end": pages[-1] if pages else None,
+            "tokens": sum(n for _, n, _, _ in body),
+        }
+
+        keep: List[Tuple[str, int, Optional[int], bool]] = []
+        if keep_overlap and not tail:
+            used = 0
+            for u in reversed(body[1:]):
+                if u[3] or used + u[1] > self.overlap:
+                    break
+                keep.insert(0, u)
+                used += u[1]
+        self.units = keep + tail
+        self.used = sum(n for _, n, _, _ in self.units)
+        return chunk
+
+
+def parse_tokenizers(s: str) -> List[str]:
+    return [x.strip() for x in s.split(",") if x.strip() != ""]
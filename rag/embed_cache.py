@@ -0,0 +1,201 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from rag.model_paths import model_slug
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # On-disk cache of normalized float32 embeddings for one model.
+    # vectors.f32 is a memory-mapped (capacity, dim) matrix; index.json maps
+    # sha256(text) -> [row, last_used_tick]. When max_rows is reached the least
+    # recently used rows are evicted and their slots reused.
+
+    def __init__(self, cache_dir: Path, model_name: str, max_rows: int = 200000):
+        self.dir = Path(cache_dir) / model_slug(model_name)
+        self.model_name = model_name
+        self.max_rows = max(1, int(max_rows))
+        self.vec_file = self.dir / "vectors.f32"
+        self.index_file = self.dir / "index.json"
+
+        self.dim = 0
+        self.capacity = 0
+        self.tick = 0
+        self.entries: Dict[str, List[int]] = {}
+        self.free: List[int] = []
+        self.vecs = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        self._load()
+
+    def _load(self):
+        if not self.index_file.exists() or not self.vec_file.exists():
+            return
+        try:
+            info = json.loads(self.index_file.read_text(encoding="utf-8"))
+        except Exception:
+            return
+        if info.get("model") != self.model_name:
+            return
+        dim = int(info.get("dim", 0))
+        capacity = int(info.get("capacity", 0))
+        if dim <= 0 or capacity <= 0:
+            return
+        if self.vec_file.stat().st_size != capacity * dim * 4:
+            return
+
+        self.dim = dim
+        self.capacity = capacity
+        self.tick = int(info.get("tick", 0))
+        self.entries = {k: [int(v[0]), int(v[1])] for k, v in info.get("entries", {}).items()}
+        self.vecs = np.memmap(self.vec_file, dtype=np.float32, mode="r+", shape=(capacity, dim))
+
+        used = set(v[0] for v in self.entries.values())
+        self.free = [i for i in range(capacity - 1, -1, -1) if i not in used]
+
+        if len(self.entries) > self.max_rows:
+            self._evict(len(self.entries) - self.max_rows)
+
+    def _reset(self, dim: int):
+        self.dim = dim
+        self.capacity = 0
+        self.entries = {}
+        self.free = []
+        self.vecs = None
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if self.vec_file.exists():
+            self.vec_file.unlink()
+
+    def _grow(self, need: int):
+        target = self.capacity
+        while target - len(self.entries) < need and target < self.max_rows:
+            target = max(1024, target * 2)
+        target = min(target, self.max_rows)
+        if target <= self.capacity:
+            return
+
+        if self.vecs is not None:
+            self.vecs.flush()
+            self.vecs = None
+        with open(self.vec_file, "ab") as f:
+            f.truncate(target * self.dim * 4)
+        self.vecs = np.memmap(self.vec_file, dtype=np.float32, mode="r+", shape=(target, self.dim))
+        self.free.extend(range(target - 1, self.capacity - 1, -1))
+        self.capacity = target
+
+    def _evict(self, n: int):
+        if n <= 0:
+            return
+        oldest = sorted(self.entries.items(), key=lambda kv: kv[1][1])[:n]
+        for k, (row, _) in oldest:
+            del self.entries[k]
+            self.free.append(row)
+        self.evicted += len(oldest)
+
+    def get_many(self, keys: List[str]) -> Tuple[Dict[int, np.ndarray], List[int]]:
+        self.tick += 1
+        found = {}
+        missing = []
+        for i, k in enumerate(keys):
+            e = self.entries.get(k)
+            if e is None or self.vecs is None:
+                missing.append(i)
+                continue
+            e[1] = self.tick
+            found[i] = np.array(self.vecs[e[0]], dtype=np.float32)
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, keys: List[str], vecs: np.ndarray):
+        if len(keys) == 0:
+            return
+        dim = int(vecs.shape[1])
+        if dim != self.dim:
+            self._reset(dim)
+
+        keys = keys[-self.max_rows:]
+        vecs = vecs[-self.max_rows:]
+
+        fresh = set(k for k in keys if k not in self.entries)
+        self._grow(len(fresh))
+        overflow = len(self.entries) + len(fresh) - self.capacity
+        self._evict(overflow)
+
+        for k, v in zip(keys, vecs):
+            e = self.entries.get(k)
+            if e is None:
+                e = [self.free.pop(), self.tick]
+                self.entries[k] = e
+            e[1] = self.tick
+            self.vecs[e[0]] = v
+
+    def save(self):
+        if self.vecs is None:
+            return
+        self.vecs.flush()
+        info = {
+            "model": self.model_name,
+            "dim": self.dim,
+            "capacity": self.capacity,
+            "tick": self.tick,
+            "entries": self.entries,
+        }
+        tmp = self.index_file.with_name(self.index_file.name + ".tmp")
+        tmp.write_text(json.dumps(info), encoding="utf-8")
+        tmp.replace(self.index_file)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "rows": len(self.entries),
+            "capacity": self.capacity,
+        }
+
+
+def encode_with_cache(model, texts: List[str], batch_size: int, cache, show_progress_bar: bool = True) -> np.ndarray:
+    keys = [text_key(t) for t in texts]
+    found = {}
+    missing = list(range(len(texts)))
+    if cache is not None:
+        found, missing = cache.get_many(keys)
+
+    new_emb = None
+    if len(missing) > 0:
+        new_emb = model.encode(
+            [texts[i] for i in missing],
+            batch_size=batch_size,
+            show_progress_bar=show_progress_bar,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        if new_emb.dtype != np.float32:
+            new_emb = new_emb.astype(np.float32)
+        if cache is not None:
+            cache.put_many([keys[i] for i in missing], new_emb)
+
+    if new_emb is not None:
+        dim = int(new_emb.shape[1])
+    elif len(found) > 0:
+        dim = int(next(iter(found.values())).shape[0])
+    else:
+        dim = int(model.get_sentence_embedding_dimension())
+
+    emb = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, v in found.items():
+        emb[i] = v
+    if new_emb is not None:
+        emb[np.asarray(missing, dtype=np.int64)] = new_emb
+    return emb
@@ -0,0 +1,31 @@
+from rag.generator import quantize_int8
+
+
+EMBED_BACKENDS = ["torch", "int8", "onnx"]
+
+
+def embed_model_key(model_name: str, backend: str = "torch") -> str:
+    # Backends produce slightly different vectors, so caches and manifests
+    # are keyed on model and backend together. torch keeps the bare name so
+    # existing caches stay valid.
+    if backend == "torch":
+        return model_name
+    return f"{model_name}@{backend}"
+
+
+def load_sentence_model(model_name: str, backend: str = "torch"):
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"unknown embedding backend: {backend} (expected one of {EMBED_BACKENDS})")
+    if backend == "onnx":
+        try:
+            return SentenceTransformer(model_name, backend="onnx")
+        except ImportError as e:
+            raise RuntimeError("the onnx embedding backend needs optimum[onnxruntime]: pip install 'optimum[onnxruntime]'") from e
+
+    model = SentenceTransformer(model_name)
+    model.eval()
+    if backend == "int8":
+        model = quantize_int8(model)
+    return model
@@ -0,0 +1,52 @@
+from pathlib import Path
+from typing import Optional
+
+import torch
+
+from rag.model_paths import model_slug
+
+
+GEN_BACKENDS = ["torch", "int8", "onnx"]
+
+
+def quantize_int8(model):
+    # Dynamic int8: Linear weights are stored as int8 and activations are
+    # quantized on the fly. No calibration data is needed.
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_onnx(model_name: str, onnx_dir: Optional[Path] = None):
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise RuntimeError("the onnx generator backend needs optimum[onnxruntime]: pip install 'optimum[onnxruntime]'") from e
+
+    # The export is slow, so it is saved once and reused.
+    if onnx_dir is None:
+        onnx_dir = Path("data/onnx") / model_slug(model_name)
+    onnx_dir = Path(onnx_dir)
+    if (onnx_dir / "config.json").exists():
+        return ORTModelForSeq2SeqLM.from_pretrained(str(onnx_dir))
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+    onnx_dir.mkdir(parents=True, exist_ok=True)
+    model.save_pretrained(str(onnx_dir))
+    return model
+
+
+def load_seq2seq(model_name: str, backend: str = "torch", onnx_dir: Optional[Path] = None):
+    # Returns (tokenizer, model); every backend's model supports the same
+    # generate() call, so callers do not need to know which one they got.
+    from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+    if backend not in GEN_BACKENDS:
+        raise ValueError(f"unknown generator backend: {backend} (expected one of {GEN_BACKENDS})")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if backend == "onnx":
+        return tokenizer, load_onnx(model_name, onnx_dir)
+
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    model.eval()
+    if backend == "int8":
+        model = quantize_int8(model)
+    return tokenizer, model
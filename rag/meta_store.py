@@ -0,0 +1,232 @@
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+# meta.bin layout:
+#   8 bytes  magic b"RAGMETA1"
+#   8 bytes  little-endian uint64 header length
+#   header   JSON: rows, docs table, chunk_id width, section offsets
+#   sections (8-byte aligned): offsets int64[rows+1], doc_idx int32[rows],
+#            page int32[rows] (-1 = None), chunk_id S{w}[rows], text utf-8 blob,
+#            page_end int32[rows] (only when some row spans pages)
+MAGIC = b"RAGMETA1"
+NO_PAGE = -1
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class MetaWriter:
+    # Streams rows to disk: text goes straight to a temp blob file, the small
+    # fixed-width columns are kept in memory until close().
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.blob_file = self.path.with_name(self.path.name + ".text.tmp")
+        self.blob = self.blob_file.open("wb")
+        self.offsets = [0]
+        self.doc_idx: List[int] = []
+        self.pages: List[int] = []
+        self.page_ends: List[int] = []
+        self.has_page_end = False
+        self.chunk_ids: List[bytes] = []
+        self.docs: List[List[str]] = []
+        self.doc_lookup: Dict[tuple, int] = {}
+
+    def add(self, row: Dict[str, Any]):
+        key = (row.get("doc_id", ""), row.get("source_name", ""))
+        d = self.doc_lookup.get(key)
+        if d is None:
+            d = len(self.docs)
+            self.doc_lookup[key] = d
+            self.docs.append([key[0], key[1]])
+
+        page = row.get("page")
+        data = row.get("text", "").encode("utf-8")
+        self.blob.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        self.doc_idx.append(d)
+        self.pages.append(NO_PAGE if page is None else int(page))
+        page_end = row.get("page_end", page)
+        if page_end != page:
+            self.has_page_end = True
+        self.page_ends.append(NO_PAGE if page_end is None else int(page_end))
+        self.chunk_ids.append(str(row.get("chunk_id", "")).encode("utf-8"))
+
+    def __len__(self):
+        return len(self.doc_idx)
+
+    def close(self):
+        self.blob.close()
+        n = len(self.doc_idx)
+        width = max([len(c) for c in self.chunk_ids] + [1])
+
+        arrays = [
+            ("offsets", np.asarray(self.offsets, dtype="<i8")),
+            ("doc_idx", np.asarray(self.doc_idx, dtype="<i4")),
+            ("page", np.asarray(self.pages, dtype="<i4")),
+            ("chunk_id", np.asarray(self.chunk_ids, dtype=f"S{width}")),
+        ]
+        if self.has_page_end:
+            arrays.append(("page_end", np.asarray(self.page_ends, dtype="<i4")))
+
+        # Section offsets depend on the header length, which depends on the
+        # offsets; iterate until the header size is stable.
+        header_len = 0
+        while True:
+            pos = _align(16 + header_len)
+            sections = {}
+            for name, arr in arrays:
+                sections[name] = pos
+                pos = _align(pos + arr.nbytes)
+            sections["text"] = pos
+            header = {
+                "rows": n,
+                "docs": self.docs,
+                "chunk_id_width": width,
+                "text_bytes": self.offsets[-1],
+                "sections": sections,
+            }
+            raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            if len(raw) == header_len:
+                break
+            header_len = len(raw)
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", header_len))
+            f.write(raw)
+            for name, arr in arrays:
+                f.write(b"\0" * (sections[name] - f.tell()))
+                f.write(arr.tobytes())
+            f.write(b"\0" * (sections["text"] - f.tell()))
+            with self.blob_file.open("rb") as fb:
+                while True:
+                    block = fb.read(1 << 20)
+                    if not block:
+                        break
+                    f.write(block)
+        os.replace(tmp, self.path)
+        self.blob_file.unlink()
+
+
+def write_meta(path: Path, rows) -> int:
+    w = MetaWriter(path)
+    for r in rows:
+        w.add(r)
+    w.close()
+    return len(w)
+
+
+class MetaStore:
+    # Read-only, memory-mapped view of meta.bin. Columns are numpy views into
+    # the mapping; text and strings are decoded only for the rows accessed.
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            if f.read(8) != MAGIC:
+                raise ValueError(f"not a meta store: {self.path}")
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.rows = int(header["rows"])
+        self.docs = [tuple(d) for d in header["docs"]]
+        sec = header["sections"]
+        n = self.rows
+        width = int(header["chunk_id_width"])
+        self.offsets = np.frombuffer(self.mm, dtype="<i8", count=n + 1, offset=sec["offsets"])
+        self.doc_idx = np.frombuffer(self.mm, dtype="<i4", count=n, offset=sec["doc_idx"])
+        self.pages = np.frombuffer(self.mm, dtype="<i4", count=n, offset=sec["page"])
+        self.chunk_ids = np.frombuffer(self.mm, dtype=f"S{width}", count=n, offset=sec["chunk_id"])
+        self.page_ends = None
+        if "page_end" in sec:
+            self.page_ends = np.frombuffer(self.mm, dtype="<i4", count=n, offset=sec["page_end"])
+        self.text_start = int(sec["text"])
+
+    def __len__(self):
+        return self.rows
+
+    def _pos(self, i: int) -> int:
+        i = int(i)
+        if i < 0:
+            i += self.rows
+        if i < 0 or i >= self.rows:
+            raise IndexError(i)
+        return i
+
+    def doc_id(self, i: int) -> str:
+        return self.docs[int(self.doc_idx[self._pos(i)])][0]
+
+    def source_name(self, i: int) -> str:
+        return self.docs[int(self.doc_idx[self._pos(i)])][1]
+
+    def chunk_id(self, i: int) -> str:
+        return self.chunk_ids[self._pos(i)].decode("utf-8")
+
+    def page(self, i: int) -> Optional[int]:
+        p = int(self.pages[self._pos(i)])
+        return None if p == NO_PAGE else p
+
+    def page_end(self, i: int) -> Optional[int]:
+        if self.page_ends is None:
+            return self.page(i)
+        p = int(self.page_ends[self._pos(i)])
+        return None if p == NO_PAGE else p
+
+    def text(self, i: int) -> str:
+        i = self._pos(i)
+        a = self.text_start + int(self.offsets[i])
+        b = self.text_start + int(self.offsets[i + 1])
+        return self.mm[a:b].decode("utf-8")
+
+    def doc_keys(self) -> List[str]:
+        keys = [f"{d}|{s}" for d, s in self.docs]
+        return [keys[int(d)] for d in self.doc_idx]
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        i = self._pos(i)
+        doc_id, source_name = self.docs[int(self.doc_idx[i])]
+        row = {
+            "doc_id": doc_id,
+            "source_name": source_name,
+            "page": self.page(i),
+            "chunk_id": self.chunk_id(i),
+            "text": self.text(i),
+        }
+        if self.page_ends is not None:
+            row["page_end"] = self.page_end(i)
+        return row
+
+    def __iter__(self):
+        for i in range(self.rows):
+            yield self[i]
+
+
+def load_meta_jsonl(meta_file: Path) -> List[Dict[str, Any]]:
+    rows = []
+    with Path(meta_file).open("r", encoding="utf-8") as f:
+        for line in f:
+            s = line.strip()
+            if not s:
+                continue
+            rows.append(json.loads(s))
+    return rows
+
+
+def open_meta(meta_file: Path):
+    # meta.jsonl from older index builds is still accepted.
+    meta_file = Path(meta_file)
+    if meta_file.suffix == ".jsonl":
+        return load_meta_jsonl(meta_file)
+    return MetaStore(meta_file)
@@ -0,0 +1,9 @@
+import hashlib
+import re
+
+
+def model_slug(model_name: str) -> str:
+    # Filesystem-safe directory name for a model id or path, unique per name.
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name).strip("_")
+    digest = hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:8]
+    return f"{slug[-60:]}-{digest}"
@@ -0,0 +1,62 @@
+import re
+from typing import Dict, List
+
+import numpy as np
+
+from rag.lru_cache import LRUCache
+
+
+def normalize_for_embedding(q: str) -> str:
+    # Case, punctuation and whitespace variants of a query share one entry.
+    t = q.lower()
+    t = re.sub(r"[^\w\s]", " ", t)
+    t = re.sub(r"\s+", " ", t).strip()
+    return t
+
+
+class QueryEmbeddingCache:
+    # Bounded normalized-query -> embedding cache in front of
+    # SentenceTransformer.encode. Misses in one call are encoded together;
+    # each distinct normalized query is encoded once, from its first raw form.
+
+    def __init__(self, embedder, max_items: int = 4096):
+        self.embedder = embedder
+        self.cache = LRUCache(max_items)
+
+    def encode(self, queries: List[str]) -> np.ndarray:
+        keys = [normalize_for_embedding(q) for q in queries]
+        found: Dict[int, np.ndarray] = {}
+        missing: Dict[str, List[int]] = {}
+        for i, k in enumerate(keys):
+            v = None
+            if k not in missing:
+                v = self.cache.get(k)
+            if v is None:
+                missing.setdefault(k, []).append(i)
+            else:
+                found[i] = v
+
+        if len(missing) > 0:
+            miss_keys = list(missing.keys())
+            texts = [queries[missing[k][0]] for k in miss_keys]
+            vecs = self.embedder.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+            if vecs.dtype != np.float32:
+                vecs = vecs.astype(np.float32)
+            for k, v in zip(miss_keys, vecs):
+                v.setflags(write=False)
+                self.cache.put(k, v)
+                for i in missing[k]:
+                    found[i] = v
+
+        out = np.zeros((len(queries), self._dim(found)), dtype=np.float32)
+        for i, v in found.items():
+            out[i] = v
+        return out
+
+    def _dim(self, found: Dict[int, np.ndarray]) -> int:
+        if len(found) > 0:
+            return int(next(iter(found.values())).shape[0])
+        return int(self.embedder.get_sentence_embedding_dimension())
+
+    def stats(self):
+        return self.cache.stats()
@@ -1,64 +1,98 @@
 import argparse
-import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
 
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
 
-def load_meta(meta_file: Path):
-    rows = []
-    with meta_file.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if len(line) == 0:
-                continue
-            rows.append(json.loads(line))
-    return rows
+from rag.ann_index import load_index_info, load_search_index, search_params
+from rag.bm25 import open_bm25, retrieve
+from rag.embedder import EMBED_BACKENDS, load_sentence_model
+from rag.meta_store import open_meta
+from rag.query_cache import QueryEmbeddingCache
+from rag.shards import has_shards, open_shards
 
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--index_file", default="data/index/faiss.index")
-    ap.add_argument("--meta_file", default="data/index/meta.jsonl")
+    ap.add_argument("--meta_file", default="data/index/meta.bin")
     ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
-    ap.add_argument("--query", required=True)
+    ap.add_argument("--embed_backend", default="", choices=[""] + EMBED_BACKENDS)
+    ap.add_argument("--query", default="")
+    ap.add_argument("--interactive", action="store_true")
+    ap.add_argument("--query_cache_size", type=int, default=4096)
     ap.add_argument("--top_k", type=int, default=5)
+    ap.add_argument("--nprobe", type=int, default=0)
+    ap.add_argument("--ef_search", type=int, default=0)
+    ap.add_argument("--sparse_weight", type=float, default=0.0)
+    ap.add_argument("--shard_workers", type=int, default=4)
     args = ap.parse_args()
 
+    if len(args.query) == 0 and not args.interactive:
+        ap.error("--query is required unless --interactive is set")
+
     index_file = Path(args.index_file)
     meta_file = Path(args.meta_file)
 
-    if not index_file.exists():
-        print(f"ERROR: index_file not found: {index_file}", file=sys.stderr)
-        sys.exit(1)
-    if not meta_file.exists():
-        print(f"ERROR: meta_file not found: {meta_file}", file=sys.stderr)
-        sys.exit(1)
-
-    rows = load_meta(meta_file)
-
-    index = faiss.read_index(str(index_file))
-    model = SentenceTransformer(args.model)
-
-    qvec = model.encode([args.query], convert_to_numpy=True, normalize_embeddings=True)
-    if qvec.dtype != np.float32:
-        qvec = qvec.astype(np.float32)
-
-    D, I = index.search(qvec, args.top_k)
-
-    print(f"QUERY: {args.query}")
-    for j in range(args.top_k):
-        idx = int(I[0][j])
-        score = float(D[0][j])
-        r = rows[idx]
-        doc_id = r.get("doc_id")
-        chunk_id = r.get("chunk_id")
-        page = r.get("page")
-        text_preview = r.get("text", "")[:180].replace("\n", " ")
-        print(f"{j+1}. score={score:.4f} [{doc_id}:{chunk_id}] page={page}  {text_preview}")
+    if has_shards(index_file.parent):
+        # shards.json next to the index: search every shard (rag/build_shards.py).
+        executor = ThreadPoolExecutor(max_workers=args.shard_workers) if args.shard_workers > 0 else None
+        shard_set = open_shards(index_file.parent, executor=executor)
+        rows, info, index, bm25 = shard_set.meta, shard_set.info, shard_set.index, shard_set.bm25
+        print(f"shards={len(shard_set.shards)} rows={len(rows)}")
+    else:
+        if not index_file.exists():
+            print(f"ERROR: index_file not found: {index_file}", file=sys.stderr)
+            sys.exit(1)
+        if not meta_file.exists():
+            print(f"ERROR: meta_file not found: {meta_file}", file=sys.stderr)
+            sys.exit(1)
+
+        rows = open_meta(meta_file)
+
+        info = load_index_info(index_file.parent / "info.json")
+        index = load_search_index(index_file, info)
+        bm25 = open_bm25(index_file.parent, info)
+    model = load_sentence_model(args.model, args.embed_backend or info.get("embed_backend", "torch"))
+
+    query_cache = QueryEmbeddingCache(model, args.query_cache_size)
+    params = search_params(info, args.nprobe, args.ef_search)
+
+    def run_query(q: str):
+        qvec = query_cache.encode([q])
+        D, I, _ = retrieve(index, bm25, qvec, [q], args.top_k, args.sparse_weight, params)
+
+        print(f"QUERY: {q}")
+        for j in range(args.top_k):
+            idx = int(I[0][j])
+            if idx < 0:
+                continue
+            score = float(D[0][j])
+            r = rows[idx]
+            doc_id = r.get("doc_id")
+            chunk_id = r.get("chunk_id")
+            page = r.get("page")
+            text_preview = r.get("text", "")[:180].replace("\n", " ")
+            print(f"{j+1}. score={score:.4f} [{doc_id}:{chunk_id}] page={page}  {text_preview}")
+
+    if len(args.query) > 0:
+        run_query(args.query)
+
+    if args.interactive:
+        # Long-lived mode: one query per stdin line, models loaded once.
+        for line in sys.stdin:
+            q = line.strip()
+            if len(q) == 0:
+                continue
+            run_query(q)
+            print("")
+        st = query_cache.stats()
+        print(f"query_cache_hits={st['hits']}")
+        print(f"query_cache_misses={st['misses']}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag.acronyms import acronym_lookup, load_acronyms
+from rag.ann_index import load_index_info, load_search_index
+from rag.bm25 import bm25_idf, open_bm25, tokenize
+from rag.meta_store import open_meta
+
+
+# shards.json sits in the index directory and lists the shards to serve:
+#   {"shards": [{"name": "...", "dir": "shards/<name>"}, ...], "model": ..., "embed_backend": ...}
+# Each shard dir is a complete build_index.py output (faiss.index, meta.bin,
+# info.json, bm25.bin, ...), so any shard can be rebuilt on its own.
+SHARDS_FILE = "shards.json"
+SHARD_DIR = "shards"
+
+
+def read_shards(index_dir: Path) -> Dict[str, Any]:
+    return json.loads((Path(index_dir) / SHARDS_FILE).read_text(encoding="utf-8"))
+
+
+def write_shards(index_dir: Path, spec: Dict[str, Any]):
+    path = Path(index_dir) / SHARDS_FILE
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(spec, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def sharded_version(parts: List[List[str]]) -> str:
+    # parts: [name, shard index_version] in serving order.
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def shard_state(index_dir: Path) -> Tuple[int, str]:
+    # Like the server's info_state() for one index: the newest mtime among
+    # shards.json and the shards' info.json files, and the combined version.
+    index_dir = Path(index_dir)
+    try:
+        mtimes = [(index_dir / SHARDS_FILE).stat().st_mtime_ns]
+        spec = read_shards(index_dir)
+    except (OSError, ValueError):
+        return 0, ""
+    parts = []
+    for ent in spec.get("shards", []):
+        info_file = index_dir / ent["dir"] / "info.json"
+        try:
+            mtime = info_file.stat().st_mtime_ns
+        except OSError:
+            continue
+        mtimes.append(mtime)
+        parts.append([ent["name"], str(load_index_info(info_file).get("index_version") or f"mtime:{mtime}")])
+    return max(mtimes), sharded_version(parts)
+
+
+class Shard:
+    # One shard's index, metadata, BM25 index and acronym table, opened from
+    # its own directory.
+
+    def __init__(self, name: str, index_dir: Path, info: Dict[str, Any], mmap: bool = False):
+        self.name = name
+        self.dir = Path(index_dir)
+        for f in ("faiss.index", "meta.bin"):
+            if not (self.dir / f).exists():
+                raise RuntimeError(f"Missing {f} for shard {name}: {self.dir}")
+        self.info = info
+        self.version = str(info.get("index_version") or f"mtime:{(self.dir / 'info.json').stat().st_mtime_ns}")
+        self.meta = open_meta(self.dir / "meta.bin")
+        self.index = load_search_index(self.dir / "faiss.index", info, mmap)
+        self.bm25 = open_bm25(self.dir, info)
+        self.acronyms = load_acronyms(self.dir, info)
+
+    def __len__(self):
+        return len(self.meta)
+
+
+def merge_top(results, bases: List[int], k: int, empty: float) -> Tuple[np.ndarray, np.ndarray]:
+    # results: per-shard (D, I) with shard-local ids. Returns the k best by
+    # score with global ids (shard base + local id); ties keep shard order.
+    D = np.concatenate([d for d, _ in results], axis=1)
+    I = np.concatenate([np.where(i >= 0, i + base, -1) for (_, i), base in zip(results, bases)], axis=1)
+    D = np.where(I >= 0, D, -np.inf)
+    order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+    D = np.take_along_axis(D, order, axis=1).astype(np.float32)
+    I = np.take_along_axis(I, order, axis=1)
+    D[I < 0] = empty
+    if D.shape[1] < k:
+        pad = k - D.shape[1]
+        D = np.pad(D, ((0, 0), (0, pad)), constant_values=empty)
+        I = np.pad(I, ((0, 0), (0, pad)), constant_values=-1)
+    return D, I
+
+
+class ShardedIndex:
+    # faiss-style search over all shards: every shard returns its own top k
+    # (in parallel on the executor) and the lists are merged by score. Dense
+    # scores are cosines from the same model, so they compare across shards.
+    # params is the per-shard list from search_params(info).
+
+    def __init__(self, shard_set: "ShardSet"):
+        self.set = shard_set
+        self.d = int(shard_set.info.get("dim", 0))
+
+    @property
+    def ntotal(self) -> int:
+        return self.set.rows
+
+    def search(self, x: np.ndarray, k: int, params=None):
+        shards = self.set.shards
+        if params is None:
+            params = [None] * len(shards)
+        results = self.set.fan_out(lambda j: shards[j].index.search(x, k, params=params[j]))
+        return merge_top(results, self.set.bases, k, -np.inf)
+
+
+class ShardedBM25:
+    # BM25 over all shards with corpus-wide document frequencies and average
+    # length, so shard scores compare and match a single index's.
+
+    def __init__(self, shard_set: "ShardSet"):
+        self.set = shard_set
+        parts = [s.bm25 for s in shard_set.shards if s.bm25 is not None]
+        self.rows = sum(len(p) for p in parts)
+        self.avgdl = sum(p.avgdl * len(p) for p in parts) / self.rows if self.rows > 0 else 0.0
+
+    def __len__(self):
+        return self.rows
+
+    def idf(self, query: str) -> Dict[str, float]:
+        out = {}
+        for term in set(tokenize(query)):
+            df = sum(s.bm25.df(term) for s in self.set.shards if s.bm25 is not None)
+            if df > 0:
+                out[term] = bm25_idf(self.rows, df)
+        return out
+
+    def search(self, queries: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        shards = self.set.shards
+        idfs = [self.idf(q) for q in queries]
+
+        def one(j):
+            if shards[j].bm25 is None:
+                return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+            return shards[j].bm25.search(queries, k, idfs, self.avgdl)
+
+        return merge_top(self.set.fan_out(one), self.set.bases, k, 0.0)
+
+
+class ShardedMeta:
+    # Row lookup by global id across the shards' meta stores.
+
+    def __init__(self, metas, bases: List[int], rows: int):
+        self.metas = metas
+        self.bases = bases
+        self.rows = rows
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0 or i >= self.rows:
+            raise IndexError(i)
+        j = bisect_right(self.bases, i) - 1
+        return self.metas[j][i - self.bases[j]]
+
+    def __iter__(self):
+        for meta in self.metas:
+            yield from meta
+
+
+def merge_acronyms(shards: List[Shard], bases: List[int]) -> Optional[Dict[str, Any]]:
+    # Per acronym, the entry defined most often in any one shard; its rows
+    # become global ids.
+    entries: Dict[str, Dict[str, Any]] = {}
+    found = False
+    for s, base in zip(shards, bases):
+        if s.acronyms is None:
+            continue
+        found = True
+        for key, ent in s.acronyms["entries"].items():
+            cur = entries.get(key)
+            if cur is None or ent.get("count", 0) > cur.get("count", 0):
+                ent = dict(ent)
+                ent["rows"] = [base + int(r) for r in ent.get("rows", [])]
+                entries[key] = ent
+    return acronym_lookup(entries) if found else None
+
+
+class ShardSet:
+    # The served view of all shards: global row ids are the shard's base
+    # offset (shards in shards.json order) plus its local row id.
+
+    def __init__(self, shards: List[Shard], executor=None):
+        if len(shards) == 0:
+            raise RuntimeError("shards.json lists no shards")
+        first = shards[0].info
+        for s in shards[1:]:
+            for key in ("model", "embed_backend", "dim"):
+                if s.info.get(key) != first.get(key):
+                    raise RuntimeError(
+                        f"shard {s.name} was built with {key}={s.info.get(key)}, "
+                        f"shard {shards[0].name} with {first.get(key)}"
+                    )
+        self.shards = shards
+        self.executor = executor
+        self.bases = []
+        n = 0
+        for s in shards:
+            self.bases.append(n)
+            n += len(s)
+        self.rows = n
+        self.version = sharded_version([[s.name, s.version] for s in shards])
+
+        self.info = {
+            "index_version": self.version,
+            "index_type": "sharded",
+            "rows": self.rows,
+            "dim": first.get("dim"),
+            "model": first.get("model"),
+            "embed_backend": first.get("embed_backend", "torch"),
+            "shards": [s.info for s in shards],
+        }
+        chunking = [s.info.get("chunking") for s in shards]
+        if all(c == chunking[0] for c in chunking) and chunking[0] is not None:
+            self.info["chunking"] = chunking[0]
+
+        self.index = ShardedIndex(self)
+        self.meta = ShardedMeta([s.meta for s in shards], self.bases, self.rows)
+        self.bm25 = ShardedBM25(self) if any(s.bm25 is not None for s in shards) else None
+        self.acronyms = merge_acronyms(shards, self.bases)
+
+    def fan_out(self, fn):
+        # fn(j) for every shard j, in parallel when there is an executor.
+        if self.executor is None or len(self.shards) == 1:
+            return [fn(j) for j in range(len(self.shards))]
+        return list(self.executor.map(fn, range(len(self.shards))))
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [
+            {"name": s.name, "rows": len(s), "index_type": s.info.get("index_type", "flat"), "index_version": s.version}
+            for s in self.shards
+        ]
+
+
+def open_shards(index_dir: Path, mmap: bool = False, executor=None, previous: Optional[ShardSet] = None) -> ShardSet:
+    # Shards whose index_version is unchanged since previous are reused as
+    # they are, so refreshing one shard reopens only that shard.
+    index_dir = Path(index_dir)
+    spec = read_shards(index_dir)
+    reuse = {}
+    if previous is not None:
+        reuse = {(str(s.dir), s.version): s for s in previous.shards}
+    shards = []
+    for ent in spec.get("shards", []):
+        shard_dir = index_dir / ent["dir"]
+        info_file = shard_dir / "info.json"
+        if not info_file.exists():
+            raise RuntimeError(f"Missing info.json for shard {ent['name']}: {shard_dir}")
+        info = load_index_info(info_file)
+        version = str(info.get("index_version") or f"mtime:{info_file.stat().st_mtime_ns}")
+        s = reuse.get((str(shard_dir), version))
+        if s is None or s.name != ent["name"]:
+            s = Shard(ent["name"], shard_dir, info, mmap)
+        shards.append(s)
+    return ShardSet(shards, executor)
+
+
+def has_shards(index_dir: Path) -> bool:
+    return (Path(index_dir) / SHARDS_FILE).exists()
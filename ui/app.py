@@ -14,6 +14,7 @@ with st.sidebar:
     top_k = st.slider("top_k (retrieve)", min_value=1, max_value=30, value=10, step=1)
     cite_k = st.slider("cite_k (attach citations)", min_value=1, max_value=6, value=2, step=1)
     include_evidence = st.checkbox("Include evidence (top chunks)", value=True)
+    stream_answer = st.checkbox("Stream answer (/ask_stream)", value=True)
     timeout_sec = st.slider("Request timeout (sec)", min_value=5, max_value=120, value=60, step=5)
 
     st.divider()
@@ -34,6 +35,101 @@ with col_a:
 with col_b:
     st.write("Tip: keep your FastAPI server running on port 8000 while using this UI.")
 
+
+def iter_sse(resp):
+    event = "message"
+    data_lines = []
+    for line in resp.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event = "message"
+            data_lines = []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+def render_chunks(top_chunks):
+    st.markdown("### Top retrieved chunks (evidence)")
+    if isinstance(top_chunks, list) and len(top_chunks) > 0:
+        for i, ch in enumerate(top_chunks, start=1):
+            score = ch.get("score", 0.0)
+            doc_id = ch.get("doc_id", "")
+            chunk_id = ch.get("chunk_id", "")
+            page = ch.get("page", "")
+            preview = ch.get("text_preview", "")
+
+            with st.expander(f"{i}) score={score:.4f}  [{doc_id}:{chunk_id}]  page={page}"):
+                st.write(preview)
+    else:
+        st.info("No top_chunks returned. (Try include_evidence=true or check your API response.)")
+
+
+def render_result(out, show_evidence: bool, answer_slot=None):
+    abstained = bool(out.get("abstained", False))
+    answer = out.get("answer", "")
+    citations = out.get("citations", [])
+    top_chunks = out.get("top_chunks", [])
+
+    if abstained:
+        st.warning("ABSTAINED (not enough evidence to answer safely).")
+    else:
+        st.success("Answered")
+
+    if answer_slot is None:
+        st.markdown("### Answer")
+        st.write(answer)
+    else:
+        answer_slot.write(answer)
+
+    st.markdown("### Citations")
+    if isinstance(citations, list) and len(citations) > 0:
+        st.write(", ".join([f"`{c}`" for c in citations]))
+    else:
+        st.write("_None_")
+
+    if show_evidence:
+        render_chunks(top_chunks)
+
+    st.markdown("### Raw JSON")
+    st.json(out)
+
+
+def ask_streaming(payload):
+    # Evidence shows up as soon as retrieval finishes; answer text is filled
+    # in token by token and replaced by the final cited answer.
+    r = requests.post(api_base + "/ask_stream", json=payload, timeout=timeout_sec, stream=True)
+    if r.status_code >= 400:
+        st.error(f"HTTP {r.status_code}")
+        st.text(r.text)
+        return
+
+    evidence_slot = st.container()
+    st.markdown("### Answer")
+    answer_slot = st.empty()
+    answer_slot.write("_retrieving..._")
+    partial = ""
+
+    for event, data in iter_sse(r):
+        if event == "retrieval":
+            answer_slot.write("_generating..._")
+            if include_evidence:
+                with evidence_slot:
+                    render_chunks(data.get("top_chunks", []))
+        elif event == "token":
+            partial += data.get("text", "")
+            answer_slot.write(partial)
+        elif event == "retry":
+            partial = ""
+            answer_slot.write("_answer too short, retrying..._")
+        elif event == "final":
+            render_result(data, False, answer_slot)
+
+
 if ask_btn:
     payload = {
         "query": query,
@@ -45,49 +141,15 @@ if ask_btn:
     st.subheader("Result")
 
     try:
-        r = requests.post(api_base + "/ask", json=payload, timeout=timeout_sec)
-        if r.status_code >= 400:
-            st.error(f"HTTP {r.status_code}")
-            st.text(r.text)
+        if stream_answer:
+            ask_streaming(payload)
         else:
-            out = r.json()
-
-            abstained = bool(out.get("abstained", False))
-            answer = out.get("answer", "")
-            citations = out.get("citations", [])
-            top_chunks = out.get("top_chunks", [])
-
-            if abstained:
-                st.warning("ABSTAINED (not enough evidence to answer safely).")
+            r = requests.post(api_base + "/ask", json=payload, timeout=timeout_sec)
+            if r.status_code >= 400:
+                st.error(f"HTTP {r.status_code}")
+                st.text(r.text)
             else:
-                st.success("Answered")
-
-            st.markdown("### Answer")
-            st.write(answer)
-
-            st.markdown("### Citations")
-            if isinstance(citations, list) and len(citations) > 0:
-                st.write(", ".join([f"`{c}`" for c in citations]))
-            else:
-                st.write("_None_")
-
-            if include_evidence:
-                st.markdown("### Top retrieved chunks (evidence)")
-                if isinstance(top_chunks, list) and len(top_chunks) > 0:
-                    for i, ch in enumerate(top_chunks, start=1):
-                        score = ch.get("score", 0.0)
-                        doc_id = ch.get("doc_id", "")
-                        chunk_id = ch.get("chunk_id", "")
-                        page = ch.get("page", "")
-                        preview = ch.get("text_preview", "")
-
-                        with st.expander(f"{i}) score={score:.4f}  [{doc_id}:{chunk_id}]  page={page}"):
-                            st.write(preview)
-                else:
-                    st.info("No top_chunks returned. (Try include_evidence=true or check your API response.)")
-
-            st.markdown("### Raw JSON")
-            st.json(out)
+                render_result(r.json(), include_evidence)
 
     except Exception as e:
         st.error(f"Request failed: {e}")